@@ -1,10 +1,19 @@
-from ninja import NinjaAPI
+from .ratelimit import RateLimit, limit_router
+from .renderers import NinjaAPI
 
 from ninjablog.api import router as blog_router
 from ninjanews.api import router as new_router
+from polls.api import router as polls_router
 
 
 apis = NinjaAPI(version='2.0.0')
 
+# 整个 router 共用一个令牌桶：每个 IP 每分钟最多 600 次，见 mysite/ratelimit.py
+limit_router(blog_router, RateLimit('600/m', key='ip', scope='apis:blogs'))
+limit_router(new_router, RateLimit('600/m', key='ip', scope='apis:news'))
+# 一次请求可以提交很多票，同步频率不用太高
+limit_router(polls_router, RateLimit('60/m', key='ip', scope='apis:polls'))
+
 apis.add_router('/blogs/', blog_router, tags=['blog'])
 apis.add_router('/news/', new_router, tags=['new'])
+apis.add_router('/polls/', polls_router, tags=['polls'])
@@ -14,3 +14,12 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mysite.settings')
 
 application = get_asgi_application()
+
+# 后台任务（mysite/tasks.py）在 lifespan startup 时启动，shutdown 时等待已提交的任务执行完
+from .tasks import with_lifespan  # noqa: E402
+
+application = with_lifespan(application)
+
+# 使用 uvicorn/daphne 运行：uvicorn mysite.asgi:application
+# async 接口等待数据库时不占用线程，查询在 mysite/asyncdb.py 的线程池中执行，
+# 大量慢客户端同时连接时只占用事件循环中的协程，数据库连接数由 ASYNC_DB_WORKERS 限制
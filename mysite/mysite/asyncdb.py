@@ -0,0 +1,257 @@
+"""
+异步接口访问数据库
+Django 4.0 的 ORM 只能同步执行，在 async 接口里直接查询会抛出 SynchronousOnlyOperation 或阻塞事件循环
+1. 查询放到固定大小的线程池中执行，queryset 在线程内全部取完（list/count/get），不会把惰性的 queryset 带回事件循环
+2. 线程数 ASYNC_DB_WORKERS 限制了同时占用的数据库连接数，排队数量超过 ASYNC_DB_MAX_PENDING 时直接抛出 DatabaseBusy，
+   慢客户端再多也只是在事件循环中等待，不会占用线程
+3. 超过 timeout 秒抛出 QueryTimeout；超时或协程被取消时，还在排队的查询不再执行，
+   SQLite 正在执行的查询通过 progress handler 中断，其它数据库等查询结束后丢弃结果
+4. async_auth：异步接口使用 django_auth 时，先在线程池中加载 session 和用户，再执行 ninja 的认证检查
+5. 查询在当前的 contextvars context 中执行，读写分离的路由状态（见 mysite/db/routers.py）和发起查询的请求一致
+6. read_ahead：Django 4.0 的 ASGIHandler 在事件循环中同步迭代 StreamingHttpResponse，不支持异步迭代器；
+   流式响应的每一块提前一块提交到线程池中查询，不会抛出 SynchronousOnlyOperation，事件循环只在查询比发送慢时等待
+
+使用：
+    @api.get('/questions', response=QuestionPage, auth=None)
+    async def list_questions(request, offset: int = 0, limit: int = 20):
+        return await fetch_page(Question.objects.order_by('-pub_date'), offset, limit)
+"""
+
+import asyncio
+import concurrent.futures
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connections
+from django.shortcuts import get_object_or_404
+
+
+class DatabaseBusy(Exception):
+    pass
+
+
+class QueryTimeout(Exception):
+    pass
+
+
+@contextmanager
+def _interruptible(cancelled):
+    """
+    查询可能被路由到主库或任意一个从库：在每个 SQLite 连接上挂一个 execute wrapper，
+    第一次真正执行查询时才在这个连接上设置 progress handler，不会为用不到的库打开连接
+    """
+    raws = []
+
+    def install(execute, sql, params, many, context):
+        raw = context['connection'].connection
+        if raw not in raws:
+            # 每执行 1000 条虚拟机指令检查一次，返回 True 时 SQLite 中断当前查询
+            raw.set_progress_handler(cancelled.is_set, 1000)
+            raws.append(raw)
+        return execute(sql, params, many, context)
+
+    with ExitStack() as stack:
+        for alias in (DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS):
+            connection = connections[alias]
+            if connection.vendor == 'sqlite':
+                stack.enter_context(connection.execute_wrapper(install))
+        try:
+            yield
+        finally:
+            for raw in raws:
+                raw.set_progress_handler(None, 0)
+
+
+class PendingQuery:
+    """
+    已经提交到线程池的查询：result 同步等待结果，cancel 取消（还在排队的不再执行，SQLite 正在执行的被中断）
+    """
+
+    def __init__(self, future, cancelled):
+        self._future = future
+        self._cancelled = cancelled
+
+    def result(self, timeout):
+        try:
+            return self._future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            self.cancel()
+            raise QueryTimeout(f'query did not finish in {timeout}s') from None
+
+    def cancel(self):
+        self._cancelled.set()
+        self._future.cancel()
+
+
+class DatabaseExecutor:
+
+    def __init__(self, max_workers=8, max_pending=1000, timeout=10):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix='asyncdb')
+        self._lock = threading.Lock()
+        self._pending = 0
+
+    @property
+    def pending(self):
+        return self._pending
+
+    def _call(self, cancelled, func, args, kwargs):
+        if cancelled.is_set():
+            return None
+        # 和处理一个请求一样，前后关闭过期或出错的连接
+        close_old_connections()
+        try:
+            with _interruptible(cancelled):
+                return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    @contextmanager
+    def _reserve(self):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise DatabaseBusy(f'{self._pending} queries pending')
+            self._pending += 1
+        try:
+            yield
+        finally:
+            self._release()
+
+    async def run(self, func, *args, timeout=None, **kwargs):
+        """
+        在线程池中执行 func(*args, **kwargs)，返回结果
+        """
+        if timeout is None:
+            timeout = self.timeout
+        with self._reserve():
+            cancelled = threading.Event()
+            try:
+                context = contextvars.copy_context()
+                future = asyncio.get_running_loop().run_in_executor(
+                    self._executor, context.run, self._call, cancelled, func, args, kwargs)
+                return await asyncio.wait_for(future, timeout)
+            except asyncio.TimeoutError:
+                raise QueryTimeout(f'query did not finish in {timeout}s') from None
+            finally:
+                cancelled.set()
+
+    def submit(self, func, *args, **kwargs):
+        """
+        在线程池中执行 func(*args, **kwargs)，不等待结果，返回 PendingQuery；查询结束或被取消后才释放排队名额
+        """
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise DatabaseBusy(f'{self._pending} queries pending')
+            self._pending += 1
+        cancelled = threading.Event()
+        context = contextvars.copy_context()
+        try:
+            future = self._executor.submit(context.run, self._call, cancelled, func, args, kwargs)
+        except BaseException:
+            self._release()
+            raise
+        future.add_done_callback(lambda _: self._release())
+        return PendingQuery(future, cancelled)
+
+    def _release(self):
+        with self._lock:
+            self._pending -= 1
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+
+database = DatabaseExecutor(
+    max_workers=settings.ASYNC_DB_WORKERS,
+    max_pending=settings.ASYNC_DB_MAX_PENDING,
+    timeout=settings.ASYNC_DB_TIMEOUT,
+)
+
+
+async def fetch_all(queryset, *, timeout=None):
+    """
+    返回 queryset 的全部结果（list），prefetch_related 也在线程内完成
+    """
+    return await database.run(list, queryset, timeout=timeout)
+
+
+def in_event_loop():
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+def read_ahead(chunk, fetch_next, *, timeout=None):
+    """
+    流式响应分块读取：依次产出 chunk、fetch_next(chunk)、……，直到取到空块
+    在事件循环线程中迭代时，产出当前块之前就把下一块的查询提交到线程池，事件循环发送当前块的同时执行查询，
+    查询比发送慢时才等待；线程池忙时抛出 DatabaseBusy 或 QueryTimeout。其它时候（WSGI）直接查询
+    """
+    if timeout is None:
+        timeout = database.timeout
+    pending = None
+    try:
+        while chunk:
+            if not in_event_loop():
+                yield chunk
+                chunk = fetch_next(chunk)
+                continue
+            pending = database.submit(fetch_next, chunk)
+            yield chunk
+            chunk, pending = pending.result(timeout), None
+    finally:
+        # 客户端断开后不再需要的查询
+        if pending is not None:
+            pending.cancel()
+
+
+async def fetch_page(queryset, offset, limit, *, timeout=None):
+    """
+    返回 {"count": 总数, "items": offset 开始的 limit 条}
+    """
+
+    def page():
+        return {'count': queryset.count(), 'items': list(queryset[offset:offset + limit])}
+
+    return await database.run(page, timeout=timeout)
+
+
+async def aget_object_or_404(queryset, *, timeout=None, **lookup):
+    return await database.run(get_object_or_404, queryset, timeout=timeout, **lookup)
+
+
+def _load_user(request):
+    user = getattr(request, 'user', None)
+    if user is not None:
+        user.is_authenticated  # 触发 SimpleLazyObject 加载 session 和用户
+
+
+def async_auth(view_func):
+    """
+    放在 @api.get/post 等装饰器下面，异步接口的认证检查不再在事件循环中查询数据库
+    """
+    contribute = getattr(view_func, '_ninja_contribute_to_operation', None)
+
+    def contribute_to_operation(operation):
+        if contribute is not None:
+            contribute(operation)
+        run = operation.run
+
+        async def run_with_user(request, *args, **kwargs):
+            try:
+                await database.run(_load_user, request)
+            except Exception as e:
+                return operation.api.on_exception(request, e)
+            return await run(request, *args, **kwargs)
+
+        operation.run = run_with_user
+
+    view_func._ninja_contribute_to_operation = contribute_to_operation
+    return view_func
@@ -0,0 +1,329 @@
+"""
+响应压缩
+API 的 JSON、页面和静态文件（polls/static 中的 css）都不压缩，文本内容通常能压缩到 1/5 以下
+1. CompressionMiddleware：按 Accept-Encoding 选择 br（安装了 brotli 时）或 gzip，q 值相同时优先 br；
+   小于 COMPRESSION_MIN_SIZE 字节、类型不在 COMPRESSION_TYPES 中、已经压缩过、支持 Range 的文件响应不压缩，
+   压缩后没有变小时返回原内容
+2. 流式响应（/api/employees/stream 等）逐块压缩，每块之后 flush，客户端可以边收边解压，不需要等整个响应生成完
+3. 压缩后强 ETag 改为弱 ETag（内容的字节变了，语义不变），Vary 加上 Accept-Encoding
+4. stats：按压缩方式和原始大小分组统计响应数、压缩前后字节数和压缩占用的 CPU 时间，/api/compression/metrics 查看，
+   python manage.py bench_compression 对比不同大小、不同级别的压缩率和耗时
+5. 静态文件：CompressedManifestStaticFilesStorage 在 collectstatic 时生成带内容哈希的文件名（style.3f2a….css），
+   再为每个文本文件写入最高压缩级别的 .gz、.br；serve_static 按 Accept-Encoding 返回预先压缩的文件，
+   带哈希的文件名内容不会变，Cache-Control 设置一年并且 immutable
+   没有执行过 collectstatic 时（开发、测试）使用原文件名，DEBUG 时 runserver 直接从各应用的 static 目录返回
+
+使用：
+    MIDDLEWARE = [..., 'mysite.compression.CompressionMiddleware', ...]
+    STATICFILES_STORAGE = 'mysite.compression.CompressedManifestStaticFilesStorage'
+    python manage.py collectstatic
+"""
+
+import bisect
+import mimetypes
+import os
+import threading
+import time
+import zlib
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.base import ContentFile
+from django.http import Http404
+from django.utils._os import safe_join
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.decorators.http import require_safe
+
+from .downloads import serve_file
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class GzipCompressor:
+    name = 'gzip'
+    extension = '.gz'
+
+    def __init__(self, level=None):
+        level = settings.COMPRESSION_GZIP_LEVEL if level is None else level
+        # wbits 16 + MAX_WBITS：gzip 格式（带头和校验和）
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        """
+        压缩一块并 flush，已经压缩的数据可以马上发送
+        """
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self, data=b''):
+        return self._compressor.compress(data) + self._compressor.flush()
+
+
+class BrotliCompressor:
+    name = 'br'
+    extension = '.br'
+
+    def __init__(self, quality=None):
+        quality = settings.COMPRESSION_BROTLI_QUALITY if quality is None else quality
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self, data=b''):
+        return self._compressor.process(data) + self._compressor.finish()
+
+
+def compressors():
+    """
+    可用的压缩方式，q 值相同时靠前的优先
+    """
+    available = {'gzip': GzipCompressor}
+    if brotli is not None:
+        available = {'br': BrotliCompressor, **available}
+    return available
+
+
+def parse_accept_encoding(header):
+    """
+    'br;q=1.0, gzip;q=0.8, *;q=0' -> {'br': 1.0, 'gzip': 0.8, '*': 0.0}
+    """
+    accepted = {}
+    for part in header.split(','):
+        coding, _, params = part.partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        name, _, value = params.partition('=')
+        if name.strip().lower() == 'q':
+            try:
+                q = float(value)
+            except ValueError:
+                q = 0.0
+        accepted[coding] = q
+    return accepted
+
+
+def select_encoding(header, available=None):
+    """
+    返回客户端接受的 q 值最高的压缩方式，都不接受时返回 None
+    """
+    accepted = parse_accept_encoding(header or '')
+    best, best_q = None, 0.0
+    for name in available or compressors():
+        q = accepted.get(name, accepted.get('*', 0.0))
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+
+def compressible(content_type):
+    media_type = content_type.split(';', 1)[0].strip().lower()
+    return any(media_type.startswith(prefix) for prefix in settings.COMPRESSION_TYPES)
+
+
+SIZE_BUCKETS = [1024, 4 * 1024, 16 * 1024, 64 * 1024, 256 * 1024, 1024 * 1024]
+
+
+def _bucket_label(index):
+    if index == len(SIZE_BUCKETS):
+        return f'>={SIZE_BUCKETS[-1] // 1024}K'
+    return f'<{SIZE_BUCKETS[index] // 1024}K'
+
+
+class CompressionStats:
+    """
+    按 (压缩方式, 原始大小区间) 统计：响应数、原始字节数、压缩后字节数、CPU 时间
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rows = {}
+
+    def record(self, encoding, size, compressed, cpu_ns):
+        key = encoding, bisect.bisect_right(SIZE_BUCKETS, size)
+        with self._lock:
+            row = self._rows.setdefault(key, [0, 0, 0, 0])
+            row[0] += 1
+            row[1] += size
+            row[2] += compressed
+            row[3] += cpu_ns
+
+    def clear(self):
+        with self._lock:
+            self._rows.clear()
+
+    def metrics(self):
+        with self._lock:
+            rows = sorted(self._rows.items())
+        return [
+            {
+                'encoding': encoding,
+                'size': _bucket_label(bucket),
+                'responses': responses,
+                'bytes_in': size,
+                'bytes_out': compressed,
+                'saved': round(1 - compressed / size, 3) if size else 0.0,
+                'cpu_us': round(cpu_ns / responses / 1000, 1),
+                'mb_per_s': round(size / cpu_ns * 1000, 1) if cpu_ns else 0.0,
+            }
+            for (encoding, bucket), (responses, size, compressed, cpu_ns) in rows
+        ]
+
+
+stats = CompressionStats()
+
+
+def _compress_stream(compressor, chunks):
+    size = compressed = cpu_ns = 0
+    try:
+        for chunk in chunks:
+            size += len(chunk)
+            started = time.thread_time_ns()
+            data = compressor.compress(chunk)
+            cpu_ns += time.thread_time_ns() - started
+            compressed += len(data)
+            if data:
+                yield data
+        started = time.thread_time_ns()
+        data = compressor.finish()
+        cpu_ns += time.thread_time_ns() - started
+        compressed += len(data)
+        yield data
+    finally:
+        stats.record(compressor.name, size, compressed, cpu_ns)
+
+
+def compress_response(request, response):
+    """
+    按请求的 Accept-Encoding 压缩 response（原地修改）并返回
+    """
+    if (response.status_code in (204, 206, 304) or response.has_header('Content-Encoding')
+            or response.has_header('Accept-Ranges') or not compressible(response.get('Content-Type', ''))):
+        return response
+    patch_vary_headers(response, ('Accept-Encoding',))
+    encoding = select_encoding(request.headers.get('Accept-Encoding'))
+    if encoding is None:
+        return response
+    compressor = compressors()[encoding]()
+
+    if response.streaming:
+        length = response.get('Content-Length')
+        if length is not None and int(length) < settings.COMPRESSION_MIN_SIZE:
+            return response
+        response.streaming_content = _compress_stream(compressor, response.streaming_content)
+        response.headers.pop('Content-Length', None)
+    else:
+        content = response.content
+        if len(content) < settings.COMPRESSION_MIN_SIZE:
+            return response
+        started = time.thread_time_ns()
+        compressed = compressor.finish(content)
+        stats.record(encoding, len(content), len(compressed), time.thread_time_ns() - started)
+        if len(compressed) >= len(content):
+            return response
+        response.content = compressed
+        response.headers['Content-Length'] = str(len(compressed))
+
+    etag = response.get('ETag')
+    if etag and etag.startswith('"'):
+        response.headers['ETag'] = 'W/' + etag
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+class CompressionMiddleware:
+    """
+    放在修改响应内容的中间件前面（列表中靠前）
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return compress_response(request, self.get_response(request))
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    collectstatic 时生成带哈希的文件名，并为文本文件写入 .gz、.br（安装了 brotli 时）
+    """
+    compress_levels = {'gzip': 9, 'br': 11}
+    # 只替换 css 中的 url()、@import；ninja 的 swagger-ui-bundle.js 引用了没有随包发布的 .map，
+    # 默认的 js sourceMappingURL 规则会让 collectstatic 失败
+    patterns = tuple(pattern for pattern in ManifestStaticFilesStorage.patterns if pattern[0] == '*.css')
+
+    def stored_name(self, name):
+        if not self.hashed_files:
+            # 没有执行过 collectstatic
+            return name
+        return super().stored_name(name)
+
+    def post_process(self, paths, dry_run=False, **options):
+        # ManifestFilesMixin 从关键字参数中取 dry_run
+        yield from super().post_process(paths, dry_run=dry_run, **options)
+        if dry_run:
+            return
+        names = [*paths, *self.hashed_files.values()]
+        for name in dict.fromkeys(names):
+            for compressed_name in self.compress_file(name):
+                yield name, compressed_name, True
+
+    def compress_file(self, name):
+        """
+        写入 name 的压缩版本，返回写入的文件名；压缩后没有变小的不写
+        """
+        if name.endswith(('.gz', '.br')) or not compressible(mimetypes.guess_type(name)[0] or ''):
+            return []
+        with self.open(name) as f:
+            content = f.read()
+        if len(content) < settings.COMPRESSION_MIN_SIZE:
+            return []
+        written = []
+        for encoding, compressor_class in compressors().items():
+            compressed = compressor_class(self.compress_levels[encoding]).finish(content)
+            if len(compressed) >= len(content):
+                continue
+            compressed_name = name + compressor_class.extension
+            if self.exists(compressed_name):
+                self.delete(compressed_name)
+            written.append(self._save(compressed_name, ContentFile(compressed)))
+        return written
+
+    def is_hashed(self, name):
+        hashed = getattr(self, '_hashed_names', None)
+        if hashed is None:
+            hashed = self._hashed_names = set(self.hashed_files.values())
+        return name in hashed
+
+
+@require_safe
+def serve_static(request, path):
+    """
+    STATIC_ROOT 中的文件，有预先压缩的版本且客户端接受时返回压缩版本
+    """
+    if not settings.STATIC_ROOT:
+        raise Http404('STATIC_ROOT is not set')
+    try:
+        full_path = safe_join(settings.STATIC_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404(path) from None
+    available = {name: compressor for name, compressor in compressors().items()
+                 if os.path.exists(full_path + compressor.extension)}
+    encoding = select_encoding(request.headers.get('Accept-Encoding'), available) if available else None
+    served = full_path + available[encoding].extension if encoding else full_path
+    # 文件名用原来的，Content-Type 按原文件的类型
+    response = serve_file(request, served, filename=os.path.basename(full_path))
+    if encoding and response.status_code != 416:
+        response.headers['Content-Encoding'] = encoding
+    if available:
+        patch_vary_headers(response, ('Accept-Encoding',))
+    if isinstance(staticfiles_storage, CompressedManifestStaticFilesStorage) and staticfiles_storage.is_hashed(path):
+        patch_cache_control(response, public=True, max_age=settings.STATIC_MAX_AGE, immutable=True)
+    else:
+        patch_cache_control(response, public=True, no_cache=True)
+    return response
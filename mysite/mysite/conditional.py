@@ -0,0 +1,197 @@
+"""
+条件请求（ETag / Last-Modified）
+轮询的客户端每次都拿到完整的响应，数据没有变化时查询、序列化和传输都是浪费
+1. 每张表一个版本号（generation）和最后修改时间，保存在 CONDITIONAL_CACHE_ALIAS 缓存中；
+   数据修改的事务提交之后 bump_version 把版本号加一（ninjademo/signals.py 中的信号，bulk_create/bulk_update 之后手动调用）
+2. @conditional(Employee) 放在 @api.get 等装饰器下面：认证、限流通过之后先读取版本号生成弱 ETag（版本号 + 完整路径 + Accept），
+   和 If-None-Match 相同（或者没有 If-None-Match、Last-Modified 不晚于 If-Modified-Since）时直接返回 304，
+   不执行查询和序列化；否则执行接口，响应带上 ETag、Last-Modified 和 Cache-Control: no-cache（每次都要校验）
+3. 先读版本号再查询：查询期间数据被修改时，响应带的是旧版本号，下次请求会拿到新数据，不会把旧数据保存在新版本号下；
+   同样的原因，数据在 DATABASE_REPLICA_STICKY_SECONDS 秒内修改过时整个请求读主库（从库可能还没复制到）
+4. Last-Modified 精确到秒，同一秒内可能还会修改，最后修改时间在 1 秒以内时不返回 Last-Modified，只使用 ETag
+5. 数据写在代码里的接口使用 @conditional(version=...)，修改数据时修改 version；version 也可以是参数为 request 的函数
+6. 只处理 GET、HEAD 请求，同时支持 POST 的接口 POST 时不变
+
+使用：
+    @api.get('/employees', response=List[EmployeeOut])
+    @conditional(Employee)
+    def get_employees(request):
+        ...
+"""
+
+import functools
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponseNotModified
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+
+from .db.routers import pin_primary
+
+SAFE_METHODS = {'GET', 'HEAD'}
+
+
+def get_cache():
+    return caches[settings.CONDITIONAL_CACHE_ALIAS]
+
+
+def _keys(model):
+    label = model._meta.label_lower
+    return f'conditional:gen:{label}', f'conditional:modified:{label}'
+
+
+def get_versions(*models):
+    """
+    返回 ([版本号], 最后修改时间)；缓存中没有时初始化，最后修改时间按当前时间算（保守：只会让客户端多取一次）
+    """
+    cache = get_cache()
+    keys = [key for model in models for key in _keys(model)]
+    values = cache.get_many(keys)
+    missing = [key for key in keys if key not in values]
+    if missing:
+        now = time.time()
+        for key in missing:
+            cache.add(key, time.time_ns() if key.startswith('conditional:gen:') else now, timeout=None)
+        values.update(cache.get_many(missing))
+    generations = [values.get(key) for key in keys[::2]]
+    modified = max((values.get(key) or time.time()) for key in keys[1::2])
+    return generations, modified
+
+
+def _bump(models):
+    cache = get_cache()
+    now = time.time()
+    for model in models:
+        generation_key, modified_key = _keys(model)
+        try:
+            cache.incr(generation_key)
+        except ValueError:
+            cache.add(generation_key, time.time_ns(), timeout=None)
+        cache.set(modified_key, now, timeout=None)
+
+
+def bump_version(*models, using=None):
+    """
+    表中的数据修改后调用；在事务中时等提交之后再加一，避免其它请求用新版本号读到旧数据
+    """
+    transaction.on_commit(lambda: _bump(models), using=using)
+
+
+def _opaque(etag):
+    return etag[2:] if etag.startswith('W/') else etag
+
+
+def _matches(etag, if_none_match):
+    # 弱比较：忽略 W/ 前缀
+    if if_none_match.strip() == '*':
+        return True
+    return _opaque(etag) in {_opaque(tag) for tag in parse_etags(if_none_match)}
+
+
+class Validators:
+    __slots__ = ('etag', 'last_modified')
+
+    def __init__(self, etag, last_modified):
+        self.etag = etag
+        self.last_modified = last_modified
+
+    def not_modified(self, request):
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match is not None:
+            return _matches(self.etag, if_none_match)
+        if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+        return (self.last_modified is not None and if_modified_since is not None
+                and int(self.last_modified) <= if_modified_since)
+
+    def patch_response(self, response, private):
+        response['ETag'] = self.etag
+        if self.last_modified is not None:
+            response['Last-Modified'] = http_date(self.last_modified)
+        patch_cache_control(response, no_cache=True)
+        if private:
+            patch_cache_control(response, private=True)
+        patch_vary_headers(response, ['Accept'])
+        return response
+
+
+def validators(request, version, last_modified=None):
+    digest = hashlib.blake2b(
+        repr((version, request.get_full_path(), request.headers.get('Accept', ''))).encode(), digest_size=12
+    ).hexdigest()
+    return Validators(f'W/"{digest}"', last_modified)
+
+
+def _conditional_operation(operation, models, version):
+    view_func = operation.view_func
+    run = operation.run
+
+    def not_modified(request):
+        # 在接口函数中比较：认证、限流等检查和参数校验都通过之后，查询数据库之前
+        if request.method not in SAFE_METHODS:
+            return None
+        last_modified = None
+        if models:
+            current, modified = get_versions(*models)
+            now = time.time()
+            if now - modified < settings.DATABASE_REPLICA_STICKY_SECONDS:
+                pin_primary()
+            if now - modified >= 1:
+                last_modified = modified
+        else:
+            current = version(request) if callable(version) else version
+        request.validators = validators(request, current, last_modified)
+        if request.validators.not_modified(request):
+            # api 级别的 auth 在 operation 创建之后才设置，请求时再判断
+            return request.validators.patch_response(HttpResponseNotModified(), bool(operation.auth_callbacks))
+        return None
+
+    def patch(request, response):
+        request_validators = getattr(request, 'validators', None)
+        if request_validators is not None and response.status_code == 200 and not response.streaming:
+            request_validators.patch_response(response, bool(operation.auth_callbacks))
+        return response
+
+    if operation.is_async:
+        @functools.wraps(view_func)
+        async def conditional_view(request, **kwargs):
+            response = not_modified(request)
+            return response if response is not None else await view_func(request, **kwargs)
+
+        async def conditional_run(request, *args, **kwargs):
+            return patch(request, await run(request, *args, **kwargs))
+    else:
+        @functools.wraps(view_func)
+        def conditional_view(request, **kwargs):
+            response = not_modified(request)
+            return response if response is not None else view_func(request, **kwargs)
+
+        def conditional_run(request, *args, **kwargs):
+            return patch(request, run(request, *args, **kwargs))
+
+    operation.view_func = conditional_view
+    operation.run = conditional_run
+
+
+def conditional(*models, version=None):
+    """
+    放在 @api.get 等装饰器下面；models 为响应依赖的表，数据不在数据库中时使用 version
+    """
+    if not models and version is None:
+        raise ValueError('conditional needs models or a version')
+
+    def decorator(view_func):
+        contribute = getattr(view_func, '_ninja_contribute_to_operation', None)
+
+        def contribute_to_operation(operation):
+            if contribute is not None:
+                contribute(operation)
+            _conditional_operation(operation, models, version)
+
+        view_func._ninja_contribute_to_operation = contribute_to_operation
+        return view_func
+
+    return decorator
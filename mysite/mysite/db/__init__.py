@@ -0,0 +1,3 @@
+"""
+数据库连接管理：连接池（pool.py）和使用连接池、连接时设置 PRAGMA 的 SQLite 后端（sqlite3/）
+"""
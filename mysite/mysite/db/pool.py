@@ -0,0 +1,203 @@
+"""
+数据库连接池
+CONN_MAX_AGE = 0 时每个请求结束都关闭连接，下一个请求重新连接；CONN_MAX_AGE > 0 时每个线程各自保留一个连接，
+ASGI 下 sync_to_async 和 asyncdb 的线程越多连接越多，也没有上限
+1. ConnectionPool 在进程内的所有线程间共享，最多 max_size 个连接；连接用完时等待，超过 timeout 秒抛出 PoolTimeout
+2. 归还时执行 reset（如回滚未结束的事务），失败的连接直接关闭
+3. 取出时：超过 max_lifetime 或空闲超过 max_idle 的连接关闭后重新取；空闲超过 health_check_interval 的连接先执行 check，
+   失败的关闭（数据库重启、网络断开等）
+4. 后进先出，常用的几个连接一直保持热的，多余的连接空闲超时后关闭
+5. metrics：连接数（使用中、空闲、创建、关闭）、取连接的次数、等待次数和等待时间、超时次数、健康检查失败次数
+
+使用：
+    pool = get_pool('default', lambda: ConnectionPool(connect, max_size=10))
+    conn = pool.acquire()
+    try:
+        ...
+    finally:
+        pool.release(conn)
+"""
+
+import threading
+import time
+from collections import deque
+
+pools = {}
+_pools_lock = threading.Lock()
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+def get_pool(key, factory):
+    """
+    返回 key 对应的连接池，不存在时用 factory() 创建
+    """
+    pool = pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = pools.get(key)
+            if pool is None:
+                pool = pools[key] = factory()
+    return pool
+
+
+def pool_metrics():
+    return {key: pool.metrics() for key, pool in list(pools.items())}
+
+
+def _close(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+class ConnectionPool:
+
+    def __init__(self, connect, max_size=10, timeout=10, max_idle=300, max_lifetime=3600,
+                 health_check_interval=30, check=None, reset=None):
+        self.connect = connect
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        self.health_check_interval = health_check_interval
+        self.check = check
+        self.reset = reset
+        self._cond = threading.Condition()
+        self._idle = deque()  # (连接, 创建时间, 归还时间)，右端是最近归还的
+        self._in_use = {}  # id(连接) -> 创建时间
+        self._connecting = 0
+        self._closed = False
+        self.created = 0
+        self.closed = 0
+        self.acquired = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.health_check_failures = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def _healthy(self, conn):
+        if self.check is None:
+            return True
+        try:
+            self.check(conn)
+            return True
+        except Exception:
+            self.health_check_failures += 1
+            return False
+
+    def _take_idle(self, now):
+        # 调用时持有 self._cond
+        while self._idle:
+            conn, created, released = self._idle.pop()
+            if (now - created > self.max_lifetime or now - released > self.max_idle
+                    or (now - released > self.health_check_interval and not self._healthy(conn))):
+                self.closed += 1
+                _close(conn)
+                continue
+            self._in_use[id(conn)] = created
+            return conn
+        return None
+
+    def _record_wait(self, started):
+        waited = time.monotonic() - started
+        self.acquired += 1
+        self._wait_total += waited
+        self._wait_max = max(self._wait_max, waited)
+
+    def acquire(self, timeout=None):
+        """
+        取一个连接，用完后必须 release
+        """
+        started = time.monotonic()
+        deadline = started + (self.timeout if timeout is None else timeout)
+        with self._cond:
+            if self._closed:
+                raise PoolTimeout('connection pool is closed')
+            waited = False
+            while True:
+                conn = self._take_idle(time.monotonic())
+                if conn is not None:
+                    self._record_wait(started)
+                    return conn
+                if len(self._in_use) + self._connecting < self.max_size:
+                    self._connecting += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise PoolTimeout(f'no connection available in {self.max_size} connections '
+                                      f'after {time.monotonic() - started:.1f}s')
+                if not waited:
+                    waited = True
+                    self.waits += 1
+                self._cond.wait(remaining)
+        # 连接数据库时不持有锁
+        try:
+            conn = self.connect()
+        except BaseException:
+            with self._cond:
+                self._connecting -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._connecting -= 1
+            self._in_use[id(conn)] = time.monotonic()
+            self.created += 1
+            self._record_wait(started)
+        return conn
+
+    def release(self, conn):
+        with self._cond:
+            created = self._in_use.pop(id(conn), None)
+        if created is None:
+            # 不是从这个连接池取出的
+            _close(conn)
+            return
+        reusable = not self._closed
+        if reusable and self.reset is not None:
+            try:
+                self.reset(conn)
+            except Exception:
+                reusable = False
+        with self._cond:
+            if reusable and not self._closed:
+                self._idle.append((conn, created, time.monotonic()))
+            else:
+                self.closed += 1
+                _close(conn)
+            self._cond.notify()
+
+    def close(self):
+        """
+        关闭空闲的连接，之后归还的连接也直接关闭
+        """
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, deque()
+            self.closed += len(idle)
+            self._cond.notify_all()
+        for conn, _, _ in idle:
+            _close(conn)
+
+    def metrics(self):
+        with self._cond:
+            return {
+                'max_size': self.max_size,
+                'in_use': len(self._in_use),
+                'idle': len(self._idle),
+                'created': self.created,
+                'closed': self.closed,
+                'acquired': self.acquired,
+                'waits': self.waits,
+                'timeouts': self.timeouts,
+                'health_check_failures': self.health_check_failures,
+                'wait_ms': {
+                    'avg': round(self._wait_total / self.acquired * 1000, 3) if self.acquired else 0,
+                    'max': round(self._wait_max * 1000, 3),
+                },
+            }
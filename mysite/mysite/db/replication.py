@@ -0,0 +1,56 @@
+"""
+本地测试用的复制：用 SQLite 的 backup API 把主库文件整个复制到从库文件
+真实的主从复制（MySQL binlog、PostgreSQL 流复制）由数据库完成，这里只用来在本地模拟有延迟的从库：
+python manage.py replicate --interval 1 每秒复制一次，复制之间的写就是从库的延迟
+1. backup 在一个读事务中复制主库的一致快照，主库可以继续写入（WAL 模式下不阻塞）
+2. 从库在复制过程中持有写锁，其它连接读到的要么是复制前、要么是复制后的完整数据
+3. 每次复制 pages 页后短暂释放锁，复制大文件时不会长时间阻塞从库上的读
+
+使用：
+    replicate_databases()  # default -> DATABASE_REPLICAS
+"""
+
+import sqlite3
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+def replicate(source, targets, pages=1024):
+    """
+    把 source 文件复制到 targets 中的每个文件，返回 {target: 耗时秒数}
+    """
+    elapsed = {}
+    src = sqlite3.connect(source)
+    try:
+        for target in targets:
+            started = time.perf_counter()
+            dst = sqlite3.connect(target, timeout=30)
+            try:
+                src.backup(dst, pages=pages)
+            finally:
+                dst.close()
+            elapsed[target] = time.perf_counter() - started
+    finally:
+        src.close()
+    return elapsed
+
+
+def replicate_databases(primary=DEFAULT_DB_ALIAS, replicas=None, pages=1024):
+    """
+    按 DATABASES 中的 NAME 把主库复制到从库（默认 DATABASE_REPLICAS），返回 {从库: 耗时秒数}
+    测试时从库是主库的 MIRROR，文件相同，不需要复制
+    """
+    if replicas is None:
+        replicas = settings.DATABASE_REPLICAS
+    source = str(connections[primary].settings_dict['NAME'])
+    targets = {str(connections[alias].settings_dict['NAME']): alias for alias in replicas}
+    targets.pop(source, None)
+    if not targets:
+        return {}
+    for alias in (primary, *targets.values()):
+        if connections[alias].vendor != 'sqlite' or connections[alias].is_in_memory_db():
+            raise ValueError(f'{alias}: only SQLite database files can be replicated')
+    elapsed = replicate(source, list(targets), pages)
+    return {targets[name]: seconds for name, seconds in elapsed.items()}
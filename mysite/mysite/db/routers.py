@@ -0,0 +1,150 @@
+"""
+读写分离
+所有查询都发到 default 时，读多写少的接口无法通过增加数据库横向扩展
+1. PrimaryReplicaRouter：写（save/create/update/delete/bulk_create 等）发到主库 default，
+   读随机发到 DATABASE_REPLICAS 中的一个从库；DATABASE_REPLICAS 为空时全部使用 default
+2. 读自己的写：从库有复制延迟，刚写完再读可能读到旧数据，以下情况读也发到主库
+   - 当前请求已经写过数据库，或者是 POST/PUT/PATCH/DELETE 请求（写之前的校验读取也要看到最新的数据）
+   - 主库上有未结束的事务（atomic 中先读后写）
+   - 客户端在 DATABASE_REPLICA_STICKY_SECONDS 秒内写过：ReplicaRoutingMiddleware 在写过数据库的请求的响应中设置 cookie，
+     之后的请求带着 cookie 时读主库，时间超过复制延迟后再回到从库
+   - use_primary() 中：按版本号缓存的数据（页面缓存、首页列表、搜索索引）在写之后重新加载，
+     从还没复制到的从库加载会把旧数据缓存到新版本号下，所以这些加载都读主库
+   - pin_primary() 之后：ETag 按版本号生成的接口（见 conditional.py），数据刚修改过时整个请求读主库
+3. 路由状态保存在 contextvar 中，每个请求一份；asyncdb 的线程池执行查询时带上当前请求的 context
+4. 从库不执行迁移，表结构随数据一起从主库复制（见 replication.py）
+
+使用：
+    DATABASE_ROUTERS = ['mysite.db.routers.PrimaryReplicaRouter']
+    DATABASE_REPLICAS = ['replica1', 'replica2']
+    MIDDLEWARE = [..., 'mysite.db.routers.ReplicaRoutingMiddleware', ...]
+"""
+
+import contextvars
+import math
+import random
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+PRIMARY = DEFAULT_DB_ALIAS
+COOKIE_NAME = 'primary_until'
+SAFE_METHODS = {'GET', 'HEAD', 'OPTIONS', 'TRACE'}
+
+
+class RoutingState:
+    """
+    pinned：读主库；written：写过数据库
+    """
+    __slots__ = ('pinned', 'written')
+
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.written = False
+
+
+_state = contextvars.ContextVar('db_routing_state', default=None)
+
+
+@contextmanager
+def routing_state(pinned=False):
+    """
+    在一个新的路由状态中执行（每个请求一个），返回 RoutingState
+    """
+    state = RoutingState(pinned)
+    token = _state.set(state)
+    try:
+        yield state
+    finally:
+        _state.reset(token)
+
+
+@contextmanager
+def use_primary():
+    """
+    其中的读都发到主库
+    """
+    state = _state.get()
+    if state is None:
+        with routing_state(pinned=True):
+            yield
+        return
+    pinned, state.pinned = state.pinned, True
+    try:
+        yield
+    finally:
+        state.pinned = pinned
+
+
+def pin_primary():
+    """
+    当前请求之后的读都发到主库（没有 ReplicaRoutingMiddleware 的路由状态时不起作用）
+    """
+    state = _state.get()
+    if state is not None:
+        state.pinned = True
+
+
+def _read_from_primary():
+    state = _state.get()
+    if state is not None and (state.pinned or state.written):
+        return True
+    return connections[PRIMARY].in_atomic_block
+
+
+class PrimaryReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        replicas = settings.DATABASE_REPLICAS
+        if not replicas or _read_from_primary():
+            return PRIMARY
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.written = True
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # 主库和从库的数据相同，从库读出的对象可以和主库的对象关联
+        databases = {PRIMARY, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
+
+
+class ReplicaRoutingMiddleware:
+    """
+    放在 SessionMiddleware 前面，session 的保存也算作写
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def _sticky(self, request, now):
+        try:
+            until = float(request.COOKIES[COOKIE_NAME])
+        except (KeyError, ValueError):
+            return False
+        # 只认有效期内的时间，伪造一个很大的值也不能一直读主库
+        return now < until <= now + settings.DATABASE_REPLICA_STICKY_SECONDS
+
+    def __call__(self, request):
+        now = time.time()
+        pinned = request.method not in SAFE_METHODS or self._sticky(request, now)
+        with routing_state(pinned) as state:
+            response = self.get_response(request)
+        if state.written and settings.DATABASE_REPLICAS:
+            sticky = settings.DATABASE_REPLICA_STICKY_SECONDS
+            # 向下取整到毫秒：向上舍入的值会超出 _sticky 认可的范围
+            until = math.floor((time.time() + sticky) * 1000) / 1000
+            response.set_cookie(COOKIE_NAME, f'{until:.3f}', max_age=sticky, httponly=True, samesite='Lax')
+        return response
@@ -0,0 +1,79 @@
+"""
+SQLite 后端：ENGINE = 'mysite.db.sqlite3'
+1. 新连接执行 OPTIONS['pragmas'] 中的 PRAGMA：WAL 模式下读写互不阻塞，busy_timeout 在写锁被占用时等待而不是立即报错，
+   mmap_size、cache_size 让读取更多在内存中完成；只在真正创建连接时执行一次
+2. OPTIONS['pool'] 不为空时使用进程内的连接池（见 mysite/db/pool.py）：Django 关闭连接时归还到连接池，下次连接时直接取出，
+   省去打开文件、注册函数和设置 PRAGMA 的开销；取连接超时抛出 OperationalError
+3. 内存数据库（测试）不使用连接池
+
+    DATABASES = {
+        'default': {
+            'ENGINE': 'mysite.db.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'OPTIONS': {
+                'pool': {'max_size': 10, 'timeout': 10},
+                'pragmas': {'journal_mode': 'wal', 'busy_timeout': 5000},
+            },
+        }
+    }
+"""
+
+import functools
+
+from django.db.backends.sqlite3 import base
+from django.db.backends.sqlite3.base import Database
+from django.utils.asyncio import async_unsafe
+
+from mysite.db.pool import ConnectionPool, PoolTimeout, get_pool
+
+
+def _check(conn):
+    conn.execute('SELECT 1').fetchone()
+
+
+def _reset(conn):
+    if conn.in_transaction:
+        conn.rollback()
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        # 不是 sqlite3.connect 的参数
+        params.pop('pool', None)
+        params.pop('pragmas', None)
+        return params
+
+    def get_pool(self):
+        options = self.settings_dict['OPTIONS'].get('pool')
+        if not options or self.is_in_memory_db():
+            return None
+        return get_pool(
+            f"{self.alias}:{self.settings_dict['NAME']}",
+            lambda: ConnectionPool(functools.partial(self._connect, self.get_connection_params()),
+                                   check=_check, reset=_reset, **options),
+        )
+
+    def _connect(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.settings_dict['OPTIONS'].get('pragmas', {}).items():
+            conn.execute(f'PRAGMA {name} = {value}').fetchall()
+        return conn
+
+    @async_unsafe
+    def get_new_connection(self, conn_params):
+        pool = self.get_pool()
+        if pool is None:
+            return self._connect(conn_params)
+        try:
+            return pool.acquire()
+        except PoolTimeout as e:
+            raise Database.OperationalError(str(e)) from e
+
+    def _close(self):
+        pool = self.get_pool()
+        if pool is None or self.connection is None:
+            return super()._close()
+        with self.wrap_database_errors:
+            pool.release(self.connection)
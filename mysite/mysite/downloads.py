@@ -0,0 +1,160 @@
+"""
+大文件下载
+1. serve_file 返回 FileResponse，支持 Range（单个范围，206 Partial Content）、HEAD，下载中断后客户端可以从断点继续
+2. ETag（文件大小 + 修改时间）和 Last-Modified：If-None-Match / If-Modified-Since 命中时返回 304；
+   If-Range 与当前文件不一致时（文件已经变了）忽略 Range 返回整个文件，避免拼出错误的内容
+3. 零拷贝：RangeFile 有 fileno()，文件位置已经移到范围开头，WSGI 服务器的 wsgi.file_wrapper 支持 sendfile 时（gunicorn 等）
+   按 Content-Length 直接由内核发送；不支持时（runserver、ASGI）通过 read() 从 mmap 中按块读取，
+   每次只复制 DOWNLOAD_BLOCK_SIZE 字节，进程内存不随文件大小增长
+
+使用：
+    @api.api_operation(['GET', 'HEAD'], '/download/{path:name}')
+    def download(request, name: str):
+        return serve_file(request, default_storage.path(name))
+"""
+
+import mmap
+import os
+import stat as stat_module
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+
+
+class RangeFile:
+    """
+    只读文件中 [start, start + length) 的部分
+    """
+
+    def __init__(self, path, start=0, length=None):
+        self._file = open(path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        self.start = start
+        self.length = size - start if length is None else length
+        self.position = 0
+        # 空文件不能 mmap
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        # sendfile 从文件描述符的当前位置开始发送
+        os.lseek(self._file.fileno(), start, os.SEEK_SET)
+
+    def fileno(self):
+        return self._file.fileno()
+
+    def read(self, size=-1):
+        remaining = self.length - self.position
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        if size <= 0:
+            return b''
+        offset = self.start + self.position
+        self.position += size
+        return self._mmap[offset:offset + size]
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._file.close()
+
+
+def file_etag(stat):
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def parse_range(header, size):
+    """
+    解析 Range: bytes=start-end，返回 (start, length)；
+    没有 Range、格式不对或有多个范围时返回 None（返回整个文件），范围超出文件时抛出 ValueError（416）
+    """
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in spec:
+        return None
+    first, dash, last = (part.strip() for part in spec.strip().partition('-'))
+    if not dash or not (first or last) or not all(part.isdigit() for part in (first, last) if part):
+        return None
+    if not first:
+        # bytes=-500：最后 500 字节
+        suffix = int(last)
+        if not suffix:
+            raise ValueError('empty suffix range')
+        start, end = max(size - suffix, 0), size - 1
+    else:
+        start = int(first)
+        end = int(last) if last else size - 1
+        if last and end < start:
+            return None
+    if start >= size:
+        raise ValueError(f'range start {start} is beyond {size} bytes')
+    return start, min(end, size - 1) - start + 1
+
+
+def _not_modified(request, etag, mtime):
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match is not None:
+        etags = parse_etags(if_none_match)
+        return '*' in etags or etag in etags
+    if_modified_since = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+    return if_modified_since is not None and int(mtime) <= if_modified_since
+
+
+def _range_applies(request, etag, mtime):
+    if_range = request.headers.get('If-Range')
+    if if_range is None:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        # 弱 ETag 不能用于 If-Range
+        return if_range == etag
+    if_range_date = parse_http_date_safe(if_range)
+    return if_range_date is not None and int(mtime) <= if_range_date
+
+
+def serve_file(request, path, as_attachment=False, filename=''):
+    """
+    返回 path 的内容，处理 HEAD、Range、If-Range、If-None-Match、If-Modified-Since；不是文件时抛出 Http404
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        raise Http404(f'{os.path.basename(path)} does not exist') from None
+    if not stat_module.S_ISREG(stat.st_mode):
+        raise Http404(f'{os.path.basename(path)} is not a file')
+    size = stat.st_size
+    etag = file_etag(stat)
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(stat.st_mtime),
+        'Accept-Ranges': 'bytes',
+    }
+    if _not_modified(request, etag, stat.st_mtime):
+        response = HttpResponseNotModified()
+        for header, value in headers.items():
+            response.headers[header] = value
+        return response
+
+    start, length, status = 0, size, 200
+    range_header = request.headers.get('Range')
+    if range_header and _range_applies(request, etag, stat.st_mtime):
+        try:
+            requested = parse_range(range_header, size)
+        except ValueError:
+            response = HttpResponse(status=416, headers=headers)
+            response.headers['Content-Range'] = f'bytes */{size}'
+            return response
+        if requested is not None:
+            (start, length), status = requested, 206
+            headers['Content-Range'] = f'bytes {start}-{start + length - 1}/{size}'
+
+    filename = filename or os.path.basename(path)
+    if request.method == 'HEAD':
+        # 只返回响应头，不打开文件；set_headers 按文件名设置 Content-Type、Content-Disposition
+        response = FileResponse(iter(()), status=status, as_attachment=as_attachment, filename=filename)
+        response.set_headers(None)
+    else:
+        response = FileResponse(RangeFile(path, start, length), status=status,
+                                as_attachment=as_attachment, filename=filename)
+        response.block_size = settings.DOWNLOAD_BLOCK_SIZE
+    for header, value in headers.items():
+        response.headers[header] = value
+    response.headers['Content-Length'] = length
+    return response
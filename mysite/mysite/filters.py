@@ -0,0 +1,249 @@
+"""
+查询参数 -> queryset
+把 Filters 这样的查询参数 Schema 直接拼成 filter(**params) 时，任何字段、任何排序、任意大的 limit/offset 都能传进来，
+没有索引的条件和排序都是全表扫描
+1. FilterSet 只接受 fields 中声明的参数，每个参数对应一个 ORM 查询条件；创建时检查条件和排序的字段都有索引，
+   没有索引时抛出 ImproperlyConfigured，不会等到线上才发现
+2. 支持的条件：exact、in（最多 max_in 个值）、gt、gte、lt、lte、startswith（编译成 >= 前缀 AND < 前缀的下一个值的范围条件，
+   可以使用索引，区分大小写）
+3. limit 最大为 max_limit；order 只能是 orderings 中的字段，其它排序返回 FilterError
+4. 分页：按 (排序字段, 主键) 排序，返回 next_cursor；请求带上 cursor 时使用 keyset 分页（WHERE (字段, 主键) > cursor），
+   offset 超过 keyset_threshold 时先只从索引中找到第 offset 条的 (字段, 主键)，再按 keyset 取这一页，不读取跳过的行
+5. query_plan/full_scans：SQLite 的 EXPLAIN QUERY PLAN，测试中检查生成的查询没有全表扫描
+
+使用：
+    employee_filters = FilterSet(Employee, fields={'query': 'last_name__startswith'}, orderings=['id', 'last_name'])
+
+    @api.get('/filter')
+    def filters(request, filters: Filters = Query(...)):
+        return employee_filters.paginate(Employee.objects.all(), filters.dict())
+"""
+
+import base64
+import json
+
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Q
+
+LOOKUPS = {'exact', 'in', 'gt', 'gte', 'lt', 'lte', 'startswith'}
+RESERVED = {'limit', 'offset', 'order', 'cursor'}
+
+
+class FilterError(Exception):
+    pass
+
+
+def resolve(model, path):
+    """
+    'department__title__in' -> (Department.title 字段, 'title' 前面的关联路径 'department__title', 'in')
+    """
+    parts = path.split('__')
+    lookup = 'exact'
+    if len(parts) > 1 and parts[-1] in LOOKUPS:
+        lookup = parts.pop()
+    field = None
+    for name in parts:
+        if field is not None:
+            if not field.is_relation:
+                raise ImproperlyConfigured(f'{path}: {field.name} is not a relation')
+            model = field.related_model
+        try:
+            field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            raise ImproperlyConfigured(f'{path}: {model.__name__} has no field {name!r}') from None
+    if field.is_relation and not field.concrete:
+        raise ImproperlyConfigured(f'{path}: reverse relations are not supported')
+    return field, '__'.join(parts), lookup
+
+
+def is_indexed(field):
+    """
+    字段单独有索引，或者是某个索引的第一列
+    """
+    if field.primary_key or field.unique or field.db_index:
+        return True
+    meta = field.model._meta
+    first_columns = [index.fields[0].lstrip('-') for index in meta.indexes if index.fields]
+    first_columns += [fields[0] for fields in meta.index_together + meta.unique_together]
+    first_columns += [constraint.fields[0] for constraint in meta.constraints if getattr(constraint, 'fields', None)]
+    return field.name in first_columns
+
+
+def _successor(prefix):
+    # 前缀的下一个字符串：最后一个字符加一，'abc' -> 'abd'
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def encode_cursor(value, pk):
+    data = json.dumps([value, pk], cls=DjangoJSONEncoder, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+
+def decode_cursor(cursor, field, pk_field):
+    try:
+        value, pk = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return field.to_python(value), pk_field.to_python(pk)
+    except Exception:
+        raise FilterError('invalid cursor') from None
+
+
+class FilterSet:
+
+    def __init__(self, model, fields, orderings=('pk',), max_limit=100, max_in=100, keyset_threshold=1000):
+        self.model = model
+        self.max_limit = max_limit
+        self.max_in = max_in
+        self.keyset_threshold = keyset_threshold
+        self.pk = model._meta.pk
+        self.fields = {}
+        for name, path in fields.items():
+            field, field_path, lookup = resolve(model, path)
+            if not is_indexed(field):
+                raise ImproperlyConfigured(f'{name}: {field_path} is not indexed')
+            self.fields[name] = (field, field_path, lookup)
+        self.orderings = {}
+        for name in orderings:
+            field = self.pk if name == 'pk' else resolve(model, name)[0]
+            if field.model is not model:
+                raise ImproperlyConfigured(f'ordering {name}: only fields of {model.__name__} can be used')
+            if field.null or not is_indexed(field):
+                raise ImproperlyConfigured(f'ordering {name}: {field.name} must be indexed and not null')
+            self.orderings[name] = field
+        self.default_ordering = next(iter(self.orderings))
+
+    def _condition(self, name, value):
+        field, path, lookup = self.fields[name]
+        if lookup == 'in':
+            values = list(value)
+            if len(values) > self.max_in:
+                raise FilterError(f'{name}: at most {self.max_in} values are allowed')
+            return Q(**{f'{path}__in': [field.to_python(v) for v in values]})
+        if lookup == 'startswith':
+            prefix = str(value)
+            if not prefix:
+                return Q()
+            return Q(**{f'{path}__gte': prefix, f'{path}__lt': _successor(prefix)})
+        return Q(**{f'{path}__{lookup}': field.to_python(value)})
+
+    def filter(self, queryset, params):
+        """
+        按 params 中 fields 声明过的参数过滤，值为 None 的参数忽略；未声明的参数返回 FilterError
+        """
+        conditions = Q()
+        for name, value in params.items():
+            if name in RESERVED or value is None:
+                continue
+            if name not in self.fields:
+                raise FilterError(f'unknown filter {name!r}')
+            try:
+                conditions &= self._condition(name, value)
+            except (TypeError, ValueError) as e:
+                raise FilterError(f'{name}: {e}') from None
+        return queryset.filter(conditions)
+
+    def ordering(self, order):
+        """
+        返回 (排序字段, 是否倒序)
+        """
+        order = order or self.default_ordering
+        descending = order.startswith('-')
+        field = self.orderings.get(order.lstrip('-'))
+        if field is None:
+            raise FilterError(f'cannot order by {order!r}, allowed: {", ".join(self.orderings)}')
+        return field, descending
+
+    def _after(self, field, descending, value, pk):
+        # (field, pk) 在 (value, pk) 之后；先写成 field >= value 的范围条件，OR 只在这个范围内判断，可以使用索引
+        op = 'lt' if descending else 'gt'
+        if field.primary_key:
+            return Q(**{f'pk__{op}': pk})
+        return Q(**{f'{field.attname}__{op}e': value}) & (
+            Q(**{f'{field.attname}__{op}': value}) | Q(**{f'pk__{op}': pk}))
+
+    def _key(self, item, field):
+        if isinstance(item, dict):
+            try:
+                return item[field.attname], item[self.pk.attname]
+            except KeyError as e:
+                raise ImproperlyConfigured(f'values() must include {e.args[0]!r} for keyset pagination') from None
+        return getattr(item, field.attname), item.pk
+
+    def paginate(self, queryset, params):
+        """
+        过滤、排序、分页，返回 {"items": [...], "next_cursor": 下一页的 cursor 或 None}
+        queryset 可以是 .values(...)，需要包含排序字段和主键
+        """
+        limit = params.get('limit')
+        if limit is None:
+            limit = self.max_limit
+        if limit < 1:
+            raise FilterError('limit must be positive')
+        limit = min(limit, self.max_limit)
+        offset = params.get('offset') or 0
+        if offset < 0:
+            raise FilterError('offset must not be negative')
+
+        field, descending = self.ordering(params.get('order'))
+        prefix = '-' if descending else ''
+        if field.primary_key:
+            order_by = [f'{prefix}pk']
+        else:
+            order_by = [f'{prefix}{field.attname}', f'{prefix}pk']
+        queryset = self.filter(queryset, params).order_by(*order_by)
+
+        cursor = params.get('cursor')
+        if cursor:
+            value, pk = decode_cursor(cursor, field, self.pk)
+            queryset = queryset.filter(self._after(field, descending, value, pk))
+        elif offset > self.keyset_threshold:
+            # 只读取索引中的 (排序字段, 主键) 找到第 offset 条，再按 keyset 取这一页
+            boundary = queryset.values_list(field.attname, 'pk')[offset - 1:offset]
+            boundary = list(boundary)
+            if not boundary:
+                return {"items": [], "next_cursor": None}
+            queryset = queryset.filter(self._after(field, descending, *boundary[0]))
+        elif offset:
+            queryset = queryset[offset:]
+
+        items = list(queryset[:limit + 1])
+        next_cursor = None
+        if len(items) > limit:
+            items = items[:limit]
+            next_cursor = encode_cursor(*self._key(items[-1], field))
+        return {"items": items, "next_cursor": next_cursor}
+
+
+def query_plan(query, params=(), using='default'):
+    """
+    SQLite 的 EXPLAIN QUERY PLAN，每一步一行，如 'SEARCH ninjademo_employee USING INDEX ...'
+    query 为 queryset 或 SQL（如 CaptureQueriesContext 记录的 sql）
+    """
+    if hasattr(query, 'query'):
+        using = query.db
+        query, params = query.query.sql_with_params()
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        raise NotImplementedError('query_plan only supports SQLite')
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {query}', params)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def full_scans(query, params=(), using='default'):
+    """
+    查询计划中扫描整个表或整个索引的步骤
+    有 WHERE 时任何 SCAN 都说明条件没有用上索引；没有 WHERE 时按索引顺序扫描到 LIMIT 为止是正常的，
+    只有还需要临时 B 树排序（排序字段没有索引）时才算全表扫描
+    """
+    if hasattr(query, 'query'):
+        filtered = bool(query.query.where)
+    else:
+        filtered = ' WHERE ' in query.upper()
+    steps = query_plan(query, params, using)
+    scans = [step for step in steps if step.startswith('SCAN ')]
+    if filtered:
+        return scans
+    sorts = [step for step in steps if 'TEMP B-TREE' in step]
+    return scans + sorts if sorts else []
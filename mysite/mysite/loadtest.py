@@ -0,0 +1,488 @@
+"""
+压测：每个挂载的路由在进程内按 WSGI、ASGI 两种方式并发请求，统计吞吐、延迟和每个请求的查询数
+1. seed：生成测试数据，question（每个 2-5 个 choice，5% 是未来发布的）、部门和员工，固定随机种子，每次数据相同
+2. ROUTES：polls/、api/（ninjademo）、apis/（ninjablog、ninjanews）下的路由和请求参数，
+   路径中的 {question}、{choice}、{employee} 每个请求从测试数据中随机选择；uncovered_routes 列出没有压测的路由
+3. 请求经过完整的 WSGIHandler/ASGIHandler 和所有中间件（和测试客户端一样不校验 CSRF），
+   请求结束时关闭/归还数据库连接，和线上一样；WSGI 每个并发一个线程，ASGI 每个并发一个协程
+4. 结果：每个路由的请求数、错误数（状态码和预期不一致或抛出异常，记录第一个错误）、其中抛出异常的个数、
+   每秒请求数、p50/p95/p99 延迟（毫秒）、平均查询数，保存为 JSON
+5. compare：和保存的基线比较，p95 变慢或吞吐下降超过 threshold（且超过 min_delta_ms 毫秒，避免亚毫秒级的抖动）、
+   查询数增加、错误数增加都算退化；路由抛出异常是缺陷，不管基线中有没有都算失败
+
+使用：python manage.py loadtest --concurrency 8 --requests 200 --baseline loadtest-baseline.json
+"""
+
+import asyncio
+import datetime
+import json
+import math
+import platform
+import random
+import re
+import threading
+import time
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode, urlsplit
+
+import django
+from django.contrib.auth.models import User
+from django.core.handlers.asgi import ASGIHandler, ASGIRequest
+from django.core.handlers.wsgi import WSGIHandler, WSGIRequest
+from django.db import connection
+from django.test import Client, RequestFactory
+from django.urls import URLResolver, get_resolver, resolve
+from django.utils import timezone
+
+from mysite import profiling
+from mysite.conditional import bump_version
+from ninjademo.models import Department, Employee
+from polls.cache import INDEX, bump_generation
+from polls.models import Choice, Question
+from polls.search import SEARCH
+
+WORDS = ('python django ninja api cache index query vote poll choice question answer database replica '
+         'schema router server client thread async latency throughput stream page cursor search').split()
+FIRST_NAMES = ['James', 'Mary', 'John', 'Linda', 'Wei', 'Fang', 'Hiro', 'Yuki', 'Ana', 'Luis', 'Omar', 'Sara']
+LAST_NAMES = ['Smith', 'Johnson', 'Brown', 'Wang', 'Li', 'Zhang', 'Tanaka', 'Sato', 'Garcia', 'Martin', 'Kim']
+
+
+def seed(questions=500, departments=20, employees=5000, seed=0, batch_size=1000):
+    """
+    生成测试数据，返回 Dataset
+    """
+    rng = random.Random(seed)
+    now = timezone.now()
+    Question.objects.bulk_create([
+        Question(
+            question_text=f'What is the best {rng.choice(WORDS)} for {" ".join(rng.sample(WORDS, 2))}?',
+            pub_date=now + datetime.timedelta(days=30) if rng.random() < 0.05
+            else now - datetime.timedelta(seconds=rng.randint(60, 365 * 86400)),
+        )
+        for _ in range(questions)
+    ], batch_size)
+    Choice.objects.bulk_create([
+        Choice(question_id=pk, choice_text=' '.join(rng.sample(WORDS, 3)), votes=rng.randint(0, 1000))
+        for pk in Question.objects.values_list('pk', flat=True)
+        for _ in range(rng.randint(2, 5))
+    ], batch_size)
+    Department.objects.bulk_create([Department(title=f'department {i}') for i in range(departments)], batch_size)
+    department_ids = list(Department.objects.values_list('pk', flat=True))
+    Employee.objects.bulk_create([
+        Employee(
+            first_name=rng.choice(FIRST_NAMES),
+            last_name=f'{rng.choice(LAST_NAMES)}{rng.randint(1, 999)}',
+            department_id=rng.choice(department_ids),
+            brithdate=datetime.date(1960, 1, 1) + datetime.timedelta(days=rng.randint(0, 15000)),
+        )
+        for _ in range(employees)
+    ], batch_size)
+    # bulk_create 不发送 post_save，首页、搜索、页面缓存和条件请求的版本号手动加一
+    bump_generation(INDEX, SEARCH, *Question.objects.values_list('pk', flat=True))
+    bump_version(Department, Employee)
+    return Dataset.load()
+
+
+class Dataset:
+    """
+    请求参数的取值范围：已发布的 question 和它们的 choice、员工、部门
+    """
+
+    def __init__(self, choices, employees, departments):
+        self.choices = choices  # question id -> [choice id]
+        self.questions = list(choices)
+        self.employees = employees
+        self.departments = departments
+
+    @classmethod
+    def load(cls):
+        choices = {}
+        published = Choice.objects.filter(question__pub_date__lte=timezone.now())
+        for question_id, choice_id in published.values_list('question_id', 'pk').order_by('pk'):
+            choices.setdefault(question_id, []).append(choice_id)
+        return cls(
+            choices,
+            list(Employee.objects.values_list('pk', flat=True).order_by('pk')),
+            list(Department.objects.values_list('pk', flat=True).order_by('pk')),
+        )
+
+    def __bool__(self):
+        return bool(self.questions and self.employees)
+
+    def sample(self, rng):
+        question = rng.choice(self.questions)
+        return {
+            'question': question,
+            'choice': rng.choice(self.choices[question]),
+            'employee': rng.choice(self.employees),
+            'department': rng.choice(self.departments),
+        }
+
+
+def _fill(value, params):
+    if isinstance(value, str):
+        return value.format(**params)
+    if isinstance(value, dict):
+        return {key: _fill(item, params) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_fill(item, params) for item in value]
+    return value
+
+
+class Route:
+    """
+    一个压测的请求：path 和 data 中的 {question} 等占位符在每次请求时替换
+    data 为 dict 时按表单提交（GET 为查询参数），json 不为 None 时按 JSON 提交（可以嵌套 list、dict）
+    """
+
+    def __init__(self, name, method, path, data=None, json=None, status=200):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.data = data
+        self.json = json
+        self.status = status
+
+    def build(self, params):
+        path = self.path.format(**params)
+        fill = _fill(self.data if self.data is not None else self.json or {}, params)
+        body, content_type = b'', None
+        if self.method == 'GET' and fill:
+            path = f'{path}?{urlencode(fill)}'
+        elif self.json is not None:
+            body, content_type = json.dumps(fill).encode(), 'application/json'
+        elif self.data is not None:
+            body, content_type = urlencode(fill).encode(), 'application/x-www-form-urlencoded'
+        return path, body, content_type
+
+
+ROUTES = [
+    Route('polls:index', 'GET', '/polls/'),
+    Route('polls:detail', 'GET', '/polls/{question}/'),
+    Route('polls:results', 'GET', '/polls/{question}/results/'),
+    Route('polls:vote', 'POST', '/polls/{question}/vote/', data={'choice': '{choice}'}, status=302),
+    Route('api:hello', 'GET', '/api/hello'),
+    Route('api:weapons_search', 'GET', '/api/weapons/search', data={'q': 'ka'}),
+    Route('api:filter', 'GET', '/api/filter', data={'query': 'Sm', 'limit': 20}),
+    Route('api:get_employee', 'POST', '/api/employee/{employee}'),
+    Route('api:get_employees', 'POST', '/api/employees'),
+    Route('api:get_employees_page', 'GET', '/api/employees/page', data={'limit': 100}),
+    Route('api:stream_employees', 'GET', '/api/employees/stream'),
+    Route('api:create_employee', 'POST', '/api/employee',
+          json={'first_name': 'Load', 'last_name': 'Test', 'department_id': '{department}'}),
+    Route('api:list_questions', 'GET', '/api/questions', data={'limit': 20}),
+    Route('api:get_question', 'GET', '/api/questions/{question}'),
+    Route('api:async_departments', 'GET', '/api/async/departments'),
+    Route('api:async_employees', 'GET', '/api/async/employees'),
+    Route('apis:list_blogs', 'GET', '/apis/blogs/blogs'),
+    Route('apis:blog', 'GET', '/apis/blogs/blogs/1'),
+    Route('apis:list_news', 'GET', '/apis/news/news'),
+    Route('apis:new', 'GET', '/apis/news/news/1'),
+    Route('apis:vote', 'POST', '/apis/polls/votes', json=[{'question_id': '{question}', 'choice_id': '{choice}'}] * 3),
+]
+
+
+def _mounted(patterns, prefix=''):
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            yield from _mounted(pattern.url_patterns, prefix + str(pattern.pattern))
+        else:
+            yield prefix + str(pattern.pattern)
+
+
+def uncovered_routes(routes=ROUTES, exclude=('admin/',)):
+    """
+    挂载了但没有压测的路由
+    """
+    params = {'question': 1, 'choice': 1, 'employee': 1, 'department': 1}
+    covered = {resolve(route.path.format(**params)).route for route in routes}
+    return [route for route in _mounted(get_resolver().url_patterns)
+            if route not in covered and not route.startswith(exclude)]
+
+
+class LoadTestWSGIRequest(WSGIRequest):
+    # 和测试客户端一样不校验 CSRF，其它中间件照常执行
+    _dont_enforce_csrf_checks = True
+
+
+class LoadTestWSGIHandler(WSGIHandler):
+    request_class = LoadTestWSGIRequest
+
+
+class LoadTestASGIRequest(ASGIRequest):
+    _dont_enforce_csrf_checks = True
+
+
+class LoadTestASGIHandler(ASGIHandler):
+    request_class = LoadTestASGIRequest
+
+
+def login_cookies(username='loadtest'):
+    """
+    登录后的 cookie（api/ 默认需要登录）
+    """
+    user, _ = User.objects.get_or_create(username=username)
+    client = Client()
+    client.force_login(user)
+    return client.cookies
+
+
+class Sample:
+
+    def __init__(self):
+        self.latencies = []
+        self.queries = 0
+        self.errors = 0
+        self.exceptions = 0
+        self.first_error = None
+        self._lock = threading.Lock()
+
+    def add(self, latency, queries, status, expected):
+        """
+        status 为状态码，请求抛出异常时为异常的描述
+        """
+        with self._lock:
+            self.latencies.append(latency)
+            self.queries += queries
+            if status != expected:
+                self.errors += 1
+                if isinstance(status, str):
+                    self.exceptions += 1
+                if self.first_error is None:
+                    self.first_error = status if isinstance(status, str) else f'status {status}'
+
+
+def _percentile(ordered, p):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(math.ceil(len(ordered) * p / 100) - 1, 0))]
+
+
+def summarize(sample, elapsed):
+    ordered = sorted(sample.latencies)
+    count = len(ordered)
+    return {
+        'requests': count,
+        'errors': sample.errors,
+        'exceptions': sample.exceptions,
+        'rps': round(count / elapsed, 1) if elapsed else 0.0,
+        'p50': round(_percentile(ordered, 50) * 1000, 3),
+        'p95': round(_percentile(ordered, 95) * 1000, 3),
+        'p99': round(_percentile(ordered, 99) * 1000, 3),
+        'queries': round(sample.queries / count, 2) if count else 0.0,
+        'error': sample.first_error,
+    }
+
+
+class WSGIRunner:
+    name = 'wsgi'
+
+    def __init__(self, cookies):
+        self.handler = LoadTestWSGIHandler()
+        self.factory = RequestFactory()
+        self.factory.cookies = SimpleCookie(cookies)
+
+    def request(self, route, params):
+        path, body, content_type = route.build(params)
+        url = urlsplit(path)
+        environ = self.factory._base_environ(
+            PATH_INFO=url.path,
+            QUERY_STRING=url.query,
+            REQUEST_METHOD=route.method,
+            CONTENT_LENGTH=str(len(body)),
+            CONTENT_TYPE=content_type or '',
+            **{'wsgi.input': _Input(body)},
+        )
+        status = []
+        response = self.handler(environ, lambda code, headers: status.append(int(code.split()[0])))
+        try:
+            for _ in response:
+                pass
+        finally:
+            # 请求结束（request_finished 信号）：关闭或归还数据库连接
+            response.close()
+        return status[0]
+
+    def run(self, route, dataset, concurrency, requests, seed=0):
+        sample = Sample()
+        per_worker = [requests // concurrency + (i < requests % concurrency) for i in range(concurrency)]
+        barrier = threading.Barrier(concurrency + 1)
+
+        def worker(index):
+            rng = random.Random(seed * 1000 + index)
+            try:
+                barrier.wait()
+                for _ in range(per_worker[index]):
+                    params = dataset.sample(rng)
+                    started = time.perf_counter()
+                    with profiling.profile_request() as profile:
+                        try:
+                            status = self.request(route, params)
+                        except Exception as e:
+                            status = f'{type(e).__name__}: {e}'
+                    sample.add(time.perf_counter() - started, profile.queries, status, route.status)
+            except BaseException:
+                barrier.abort()
+                raise
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        barrier.wait()
+        started = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        return summarize(sample, time.perf_counter() - started)
+
+
+class _Input:
+    """
+    wsgi.input：只需要 read
+    """
+
+    def __init__(self, body):
+        self._body = body
+        self._position = 0
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = len(self._body) - self._position
+        data = self._body[self._position:self._position + size]
+        self._position += len(data)
+        return data
+
+    def readline(self, size=-1):
+        return self.read(size)
+
+
+class ASGIRunner:
+    name = 'asgi'
+
+    def __init__(self, cookies):
+        self.handler = LoadTestASGIHandler()
+        self.cookie = '; '.join(f'{key}={morsel.value}' for key, morsel in cookies.items()).encode()
+
+    async def request(self, route, params):
+        path, body, content_type = route.build(params)
+        url = urlsplit(path)
+        headers = [(b'host', b'testserver'), (b'cookie', self.cookie), (b'content-length', str(len(body)).encode())]
+        if content_type:
+            headers.append((b'content-type', content_type.encode()))
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'scheme': 'http',
+            'method': route.method, 'path': url.path, 'raw_path': url.path.encode(), 'root_path': '',
+            'query_string': url.query.encode(), 'headers': headers,
+            'server': ('testserver', 80), 'client': ('127.0.0.1', 50000),
+        }
+        received = False
+        status = []
+
+        async def receive():
+            nonlocal received
+            if received:
+                # 请求体已经读完，等待断开
+                await asyncio.Future()
+            received = True
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                status.append(message['status'])
+
+        await self.handler(scope, receive, send)
+        return status[0]
+
+    async def _run(self, route, dataset, concurrency, requests, seed):
+        sample = Sample()
+        per_worker = [requests // concurrency + (i < requests % concurrency) for i in range(concurrency)]
+
+        async def worker(index):
+            rng = random.Random(seed * 1000 + index)
+            for _ in range(per_worker[index]):
+                params = dataset.sample(rng)
+                started = time.perf_counter()
+                with profiling.profile_request() as profile:
+                    try:
+                        status = await self.request(route, params)
+                    except Exception as e:
+                        status = f'{type(e).__name__}: {e}'
+                sample.add(time.perf_counter() - started, profile.queries, status, route.status)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(i) for i in range(concurrency)))
+        return summarize(sample, time.perf_counter() - started)
+
+    def run(self, route, dataset, concurrency, requests, seed=0):
+        return asyncio.run(self._run(route, dataset, concurrency, requests, seed))
+
+
+RUNNERS = {'wsgi': WSGIRunner, 'asgi': ASGIRunner}
+
+
+def run(routes, dataset, interfaces=('wsgi', 'asgi'), concurrency=8, requests=200, warmup=20, seed=0,
+        cookies=None, progress=None):
+    """
+    依次压测每个接口方式下的每个路由，返回可以保存为 JSON 的结果
+    """
+    profiling.install()
+    if cookies is None:
+        cookies = login_cookies()
+    results = {}
+    for interface in interfaces:
+        runner = RUNNERS[interface](cookies)
+        for route in routes:
+            if warmup:
+                runner.run(route, dataset, min(concurrency, warmup), warmup, seed)
+            key = f'{interface} {route.method} {route.name}'
+            results[key] = runner.run(route, dataset, concurrency, requests, seed)
+            if progress is not None:
+                progress(key, results[key])
+    return {
+        'meta': {
+            'created': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'concurrency': concurrency,
+            'requests': requests,
+            'seed': seed,
+        },
+        'results': results,
+    }
+
+
+def crashes(results):
+    """
+    抛出异常的路由的描述列表
+    """
+    return [f'{key}: {result["exceptions"]} requests raised {result["error"]}'
+            for key, result in results['results'].items() if result.get('exceptions')]
+
+
+def compare(results, baseline, threshold=0.2, min_delta_ms=1.0):
+    """
+    返回退化的描述列表，没有退化时为空
+    """
+    regressions = crashes(results)
+    for key, base in baseline['results'].items():
+        current = results['results'].get(key)
+        if current is None:
+            continue
+        limit = max(base['p95'] * (1 + threshold), base['p95'] + min_delta_ms)
+        if current['p95'] > limit:
+            regressions.append(f'{key}: p95 {current["p95"]:.2f}ms > {limit:.2f}ms (baseline {base["p95"]:.2f}ms)')
+        # 吞吐下降时，每个请求平均多用的时间（并发数 / 每秒请求数）也要超过 min_delta_ms
+        concurrency = results['meta']['concurrency']
+        if base['rps'] and current['rps'] < base['rps'] * (1 - threshold) and (
+                concurrency * 1000 / max(current['rps'], 1e-9) - concurrency * 1000 / base['rps'] > min_delta_ms):
+            regressions.append(f'{key}: {current["rps"]:.0f} requests/s < baseline {base["rps"]:.0f} requests/s')
+        if current['queries'] > base['queries'] + 0.5:
+            regressions.append(f'{key}: {current["queries"]} queries/request > baseline {base["queries"]}')
+        if current['errors'] > base['errors']:
+            regressions.append(f'{key}: {current["errors"]} errors > baseline {base["errors"]}')
+    return regressions
+
+
+def route_filter(pattern):
+    regex = re.compile(pattern)
+    return [route for route in ROUTES if regex.search(route.name)]
@@ -0,0 +1,443 @@
+"""
+请求级别的性能统计
+看不到每个视图/接口执行了多少条 SQL、数据库用了多久，N+1 查询和慢接口只能靠猜
+1. ProfilingMiddleware：每个请求记录 SQL 条数、数据库时间、重复的查询（相同 SQL 不同参数执行多次，通常是 N+1）、
+   响应大小和总时间，响应头 Server-Timing 中返回（浏览器开发者工具的 Timing 面板可以直接看到）
+   流式响应的内容在中间件返回之后才生成，其中的查询不计入
+2. profile_api(api)：NinjaAPI 的每个接口单独统计（同一个路径的 GET/POST 是不同的接口），并记录序列化时间
+   （Schema 校验 + 渲染，不含其间执行的查询）
+3. 统计按接口汇总到最近 PROFILING_WINDOW 秒的滚动窗口中：耗时是对数分桶的直方图（相对误差 5%），
+   可以算出 p50/p95/p99，多个进程的直方图可以直接相加
+4. 每隔 PROFILING_SNAPSHOT_INTERVAL 秒把本进程的统计写入 PROFILING_SNAPSHOT_DIR，
+   python manage.py profile_report 合并所有进程的统计，按 p95 列出最慢的接口
+5. PROFILING_ENABLED = False 时中间件不加载（MiddlewareNotUsed），也不包装数据库查询，
+   接口上只多一次 contextvar 读取
+
+使用：
+    MIDDLEWARE = ['mysite.profiling.ProfilingMiddleware', ...]
+    path('api/', profile_api(api).urls)
+"""
+
+import atexit
+import collections
+import contextvars
+import json
+import math
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+# 直方图相邻两个桶的比例，决定百分位的相对误差
+GROWTH = 1.05
+_LOG_GROWTH = math.log(GROWTH)
+# 每个接口保留的重复 SQL 条数
+MAX_FINGERPRINTS = 20
+
+_IN_LIST = re.compile(r'\((?:%s, )+%s\)')
+
+
+def fingerprint(sql):
+    """
+    SQL 的参数都是占位符，相同的 SQL 就是同一个查询；IN (%s, %s, ...) 的个数不同也算同一个
+    """
+    return _IN_LIST.sub('(%s, ...)', sql)
+
+
+class RequestProfile:
+    __slots__ = ('started', 'queries', 'db_time', 'serialization', 'fingerprints', 'operation')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.serialization = 0.0
+        self.fingerprints = collections.Counter()
+        self.operation = None
+
+    @property
+    def duplicates(self):
+        return sum(count - 1 for count in self.fingerprints.values())
+
+
+_profile = contextvars.ContextVar('request_profile', default=None)
+
+
+def current_profile():
+    return _profile.get()
+
+
+@contextmanager
+def profile_request():
+    """
+    其中执行的查询记录到返回的 RequestProfile（需要先 install()）
+    """
+    profile = RequestProfile()
+    token = _profile.set(profile)
+    try:
+        yield profile
+    finally:
+        _profile.reset(token)
+
+
+def _record_query(execute, sql, params, many, context):
+    profile = _profile.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        profile.db_time += time.perf_counter() - started
+        profile.queries += 1
+        profile.fingerprints[fingerprint(sql)] += 1
+
+
+def _install_wrapper(sender, connection, **kwargs):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+def install():
+    """
+    之后新建的数据库连接（包括其它线程、连接池中取出的）都记录查询
+    """
+    connection_created.connect(_install_wrapper, dispatch_uid='mysite.profiling')
+    for connection in connections.all():
+        if connection.connection is not None:
+            _install_wrapper(None, connection)
+
+
+class Histogram:
+    """
+    对数分桶：第 i 个桶是 [GROWTH ** i, GROWTH ** (i + 1)) 毫秒
+    """
+
+    def __init__(self, buckets=None):
+        self.buckets = collections.Counter({int(i): count for i, count in (buckets or {}).items()})
+
+    @property
+    def count(self):
+        return sum(self.buckets.values())
+
+    def record(self, value):
+        self.buckets[math.floor(math.log(max(value, 0.001)) / _LOG_GROWTH)] += 1
+
+    def merge(self, other):
+        self.buckets.update(other.buckets)
+
+    def percentile(self, p):
+        """
+        p 为 0-100，返回所在桶的中间值；没有数据时返回 0
+        """
+        total = self.count
+        if not total:
+            return 0.0
+        rank = max(math.ceil(total * p / 100), 1)
+        seen = 0
+        for i in sorted(self.buckets):
+            seen += self.buckets[i]
+            if seen >= rank:
+                return GROWTH ** (i + 0.5)
+        return GROWTH ** (max(self.buckets) + 0.5)
+
+
+class EndpointStats:
+    """
+    一个接口在一段时间内的统计，时间单位为毫秒
+    """
+    SUMS = ('count', 'queries', 'db_time', 'duplicates', 'serialization', 'size')
+
+    def __init__(self):
+        self.count = 0
+        self.queries = 0
+        self.db_time = 0.0
+        self.duplicates = 0
+        self.serialization = 0.0
+        self.size = 0
+        self.max_queries = 0
+        self.duration = Histogram()
+        self.fingerprints = collections.Counter()  # 重复的 SQL -> 重复次数
+
+    def _trim(self):
+        if len(self.fingerprints) > MAX_FINGERPRINTS:
+            self.fingerprints = collections.Counter(dict(self.fingerprints.most_common(MAX_FINGERPRINTS)))
+
+    def add(self, profile, duration, size):
+        self.count += 1
+        self.queries += profile.queries
+        self.db_time += profile.db_time * 1000
+        self.duplicates += profile.duplicates
+        self.serialization += profile.serialization * 1000
+        self.size += size or 0
+        self.max_queries = max(self.max_queries, profile.queries)
+        self.duration.record(duration)
+        for sql, count in profile.fingerprints.items():
+            if count > 1:
+                self.fingerprints[sql] += count - 1
+        self._trim()
+
+    def merge(self, other):
+        for name in self.SUMS:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        self.max_queries = max(self.max_queries, other.max_queries)
+        self.duration.merge(other.duration)
+        self.fingerprints.update(other.fingerprints)
+        self._trim()
+
+    def to_dict(self):
+        data = {name: getattr(self, name) for name in self.SUMS}
+        data['max_queries'] = self.max_queries
+        data['duration'] = dict(self.duration.buckets)
+        data['fingerprints'] = dict(self.fingerprints)
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        for name in cls.SUMS:
+            setattr(stats, name, data[name])
+        stats.max_queries = data['max_queries']
+        stats.duration = Histogram(data['duration'])
+        stats.fingerprints = collections.Counter(data['fingerprints'])
+        return stats
+
+    def summary(self):
+        count = self.count or 1
+        top = self.fingerprints.most_common(1)
+        return {
+            'count': self.count,
+            'p50': round(self.duration.percentile(50), 2),
+            'p95': round(self.duration.percentile(95), 2),
+            'p99': round(self.duration.percentile(99), 2),
+            'queries': round(self.queries / count, 2),
+            'max_queries': self.max_queries,
+            'db_time': round(self.db_time / count, 2),
+            'duplicates': round(self.duplicates / count, 2),
+            'serialization': round(self.serialization / count, 2),
+            'size': round(self.size / count),
+            'top_duplicate': top[0][0] if top else None,
+        }
+
+
+class RollingStats:
+    """
+    最近 window 秒的统计，分成 slots 段，整段过期
+    """
+
+    def __init__(self, window=300, slots=10):
+        self.window = window
+        self.slot_seconds = window / slots
+        self._lock = threading.Lock()
+        self._slots = collections.deque()  # (段的开始时间, {接口: EndpointStats})
+
+    def clear(self):
+        with self._lock:
+            self._slots.clear()
+
+    def _expire(self, now):
+        while self._slots and self._slots[0][0] <= now - self.window:
+            self._slots.popleft()
+
+    def record(self, key, profile, duration, size, now=None):
+        now = time.time() if now is None else now
+        start = now - now % self.slot_seconds
+        with self._lock:
+            self._expire(now)
+            if not self._slots or self._slots[-1][0] != start:
+                self._slots.append((start, {}))
+            endpoints = self._slots[-1][1]
+            stats = endpoints.get(key)
+            if stats is None:
+                stats = endpoints[key] = EndpointStats()
+            stats.add(profile, duration, size)
+
+    def to_dict(self, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            self._expire(now)
+            return {
+                'window': self.window,
+                'slots': [[start, {key: stats.to_dict() for key, stats in endpoints.items()}]
+                          for start, endpoints in self._slots],
+            }
+
+    def merged(self, now=None):
+        """
+        {接口: 窗口内合并后的 EndpointStats}
+        """
+        return merge_snapshots([self.to_dict(now)], now)
+
+
+def merge_snapshots(snapshots, now=None):
+    now = time.time() if now is None else now
+    merged = {}
+    for snapshot in snapshots:
+        for start, endpoints in snapshot['slots']:
+            if start <= now - snapshot['window']:
+                continue
+            for key, data in endpoints.items():
+                stats = EndpointStats.from_dict(data)
+                if key in merged:
+                    merged[key].merge(stats)
+                else:
+                    merged[key] = stats
+    return merged
+
+
+def load_snapshots(directory=None, now=None):
+    """
+    合并 directory（默认 PROFILING_SNAPSHOT_DIR）中所有进程写入的统计
+    """
+    directory = settings.PROFILING_SNAPSHOT_DIR if directory is None else directory
+    snapshots = []
+    try:
+        names = sorted(os.listdir(directory))
+    except FileNotFoundError:
+        names = []
+    for name in names:
+        if not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(directory, name)) as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            # 正在写入或已经删除
+            continue
+    return merge_snapshots(snapshots, now)
+
+
+stats = RollingStats(settings.PROFILING_WINDOW)
+
+
+class SnapshotWriter:
+
+    def __init__(self, stats, directory, interval):
+        self.stats = stats
+        self.directory = directory
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._written_at = 0.0
+
+    @property
+    def path(self):
+        return os.path.join(self.directory, f'{os.getpid()}.json')
+
+    def write(self):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path
+        temp = f'{path}.tmp'
+        with open(temp, 'w') as f:
+            json.dump(self.stats.to_dict(), f)
+        os.replace(temp, path)
+
+    def maybe_write(self, now):
+        if now - self._written_at < self.interval or not self._lock.acquire(blocking=False):
+            return
+        try:
+            self._written_at = now
+            self.write()
+        except OSError:
+            pass
+        finally:
+            self._lock.release()
+
+
+def endpoint_name(request, profile):
+    """
+    'GET polls:index'、'POST api-1.0.0:create_employee'；没有 URL 名称时使用路由，如 'GET api-1.0.0:employees/page'
+    """
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        name = 'unresolved'
+    elif profile.operation:
+        name = ':'.join(filter(None, [match.namespace, profile.operation]))
+    elif match.url_name:
+        name = match.view_name
+    else:
+        name = ':'.join(filter(None, [match.namespace, match.route]))
+    return f'{request.method} {name}'
+
+
+def server_timing(profile, duration):
+    queries = f'{profile.queries} queries'
+    if profile.duplicates:
+        queries += f', {profile.duplicates} duplicate'
+    metrics = [f'db;desc="{queries}";dur={profile.db_time * 1000:.1f}']
+    if profile.operation:
+        metrics.append(f'ser;dur={profile.serialization * 1000:.1f}')
+    metrics.append(f'total;dur={duration:.1f}')
+    return ', '.join(metrics)
+
+
+def _response_size(response):
+    if response.streaming:
+        length = response.get('Content-Length')
+        return int(length) if length and length.isdigit() else None
+    return len(response.content)
+
+
+class ProfilingMiddleware:
+    """
+    放在最前面，统计的时间包含其它中间件
+    """
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        install()
+        self.get_response = get_response
+        self.stats = stats
+        self.writer = None
+        if settings.PROFILING_SNAPSHOT_DIR:
+            self.writer = SnapshotWriter(stats, settings.PROFILING_SNAPSHOT_DIR, settings.PROFILING_SNAPSHOT_INTERVAL)
+            # 最后一次写入之后的请求在进程退出时写入
+            atexit.register(self.writer.maybe_write, float('inf'))
+
+    def __call__(self, request):
+        with profile_request() as profile:
+            response = self.get_response(request)
+        duration = (time.perf_counter() - profile.started) * 1000
+        self.stats.record(endpoint_name(request, profile), profile, duration, _response_size(response))
+        response.headers['Server-Timing'] = server_timing(profile, duration)
+        if self.writer is not None:
+            self.writer.maybe_write(time.time())
+        return response
+
+
+def _profile_operation(operation):
+    name = operation.view_func.__name__
+    result_to_response = operation._result_to_response
+
+    def profiled(request, result):
+        profile = _profile.get()
+        if profile is None:
+            return result_to_response(request, result)
+        profile.operation = name
+        started, db_time = time.perf_counter(), profile.db_time
+        try:
+            return result_to_response(request, result)
+        finally:
+            # 序列化时执行的查询（惰性 queryset 等）只计入数据库时间
+            profile.serialization += time.perf_counter() - started - (profile.db_time - db_time)
+
+    profiled.profiled = True
+    operation._result_to_response = profiled
+
+
+def profile_api(api):
+    """
+    统计 api 中每个接口的序列化时间并按接口汇总，在所有接口注册之后调用（urls.py 中），返回 api
+    """
+    for _, router in api._routers:
+        for path_view in router.path_operations.values():
+            for operation in path_view.operations:
+                if not getattr(operation._result_to_response, 'profiled', False):
+                    _profile_operation(operation)
+    return api
@@ -0,0 +1,379 @@
+"""
+限流和过载保护
+接口没有任何保护时，一个客户端的突发请求（或者 /sync-say-after?delay=... 这样长时间占用线程的请求）会占满所有 worker，
+后面的请求只能排队，排到时客户端往往已经超时
+1. RateLimit：令牌桶，每个客户端（按 IP、用户或认证结果区分）每 period 秒补充 count 个令牌，最多攒 burst 个，
+   没有令牌时返回 429，Retry-After 为补充到一个令牌的秒数
+   - @rate_limit('10/m', key='ip') 放在 @api.get 等装饰器下面，只限制这一个接口
+   - limit_router(router, RateLimit('600/m', key='user', scope='blogs'))：router 下所有接口共用一个桶
+   - 在认证之后检查，key='user'/'auth' 可以按登录用户、API 密钥限流，未认证时按 IP
+2. 令牌桶的状态只保存一个时间：桶重新装满的时间（GCRA），过期的桶等于满的桶，不需要定时补充令牌
+   - RATELIMIT_CACHE 为 None 时保存在进程内（LocalStore，按最近使用淘汰），每个进程各自计数
+   - 设置为共享缓存（redis/memcached）的别名时多进程共用（CacheStore）：缓存没有比较并交换，改用固定窗口计数，
+     cache.add + cache.incr 都是原子操作，多个进程同时到达的请求不会多放过；缓存不可用时不限流
+3. ConcurrencyLimiter：同时处理的 API 请求超过 RATELIMIT_MAX_CONCURRENT 时直接返回 503 和 Retry-After，不排队等待；
+   protect_api(api) 给 api 的所有接口加上这个限制（在所有接口注册之后调用，见 urls.py）
+4. 超过限制时抛出 RateLimited（429）/ Overloaded（503），通过 api 的异常处理返回，响应格式和其它错误一样；
+   api 没有处理 RateLimited 时 protect_api 注册 throttled_response
+5. RATELIMIT_ENABLED 为 False 时都不生效（压测时关闭）
+
+使用：
+    @api.get('/sync-say-after', auth=None)
+    @rate_limit('10/m', key='ip')
+    def sync_say_after(request, delay: int, word: str):
+        ...
+
+    path('api/', protect_api(api).urls)
+"""
+
+import hashlib
+import math
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+RATE_PERIODS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+
+
+class RateLimited(Exception):
+    status = 429
+
+    def __init__(self, retry_after, message='Too many requests'):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Overloaded(RateLimited):
+    status = 503
+
+    def __init__(self, retry_after, message='Server is busy'):
+        super().__init__(retry_after, message)
+
+
+def throttled_response(api, request, exc):
+    response = api.create_response(request, {"message": "Please retry later", "error": str(exc)}, status=exc.status)
+    response['Retry-After'] = str(max(1, math.ceil(exc.retry_after)))
+    return response
+
+
+def parse_rate(rate):
+    """
+    '10/s'、'100/m'、'1000/h'、'5/10m'，返回 (count, period 秒)
+    """
+    match = re.fullmatch(r'(\d+)/(\d*)([smhd])', rate)
+    if match is None:
+        raise ValueError(f'invalid rate {rate!r}, expected e.g. "10/s", "100/m", "5/10m"')
+    count, multiplier, unit = match.groups()
+    if not int(count):
+        raise ValueError(f'invalid rate {rate!r}, count must be positive')
+    return int(count), int(multiplier or 1) * RATE_PERIODS[unit]
+
+
+def _consume(full_at, now, interval, burst):
+    """
+    full_at：桶重新装满的时间；返回 (新的 full_at, 0) 或者令牌不够时 (None, 需要等待的秒数)
+    桶里的令牌数是 (now + burst * interval - full_at) / interval，取走一个令牌 full_at 往后推 interval
+    """
+    full_at = max(full_at or 0.0, now) + interval
+    wait = full_at - now - burst * interval
+    if wait > 0:
+        return None, wait
+    return full_at, 0.0
+
+
+class LocalStore:
+    """
+    进程内，最多保存 size 个客户端的桶，超过时淘汰最久没有请求的
+    """
+
+    def __init__(self, size=100000):
+        self.size = size
+        self._lock = threading.Lock()
+        self._data = OrderedDict()  # key -> full_at
+
+    def consume(self, key, now, interval, burst):
+        with self._lock:
+            full_at, wait = _consume(self._data.get(key), now, interval, burst)
+            if full_at is not None:
+                self._data[key] = full_at
+                self._data.move_to_end(key)
+                while len(self._data) > self.size:
+                    self._data.popitem(last=False)
+            return wait
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class CacheStore:
+    """
+    django cache 中，固定窗口计数：每 burst * interval 秒一个窗口，窗口内最多 burst 次，平均速率和令牌桶相同
+    计数只用原子的 add 和 incr，不会读出同一个值后各自写回；代价是窗口交界处前后短时间内最多 2 * burst 次
+    """
+
+    def __init__(self, cache_alias):
+        self.cache_alias = cache_alias
+
+    def consume(self, key, now, interval, burst):
+        cache = caches[self.cache_alias]
+        window = burst * interval
+        index = math.floor(now / window)
+        window_key = f'{key}:{index}'
+        timeout = math.ceil(window) + 1
+        try:
+            cache.add(window_key, 0, timeout=timeout)
+            try:
+                count = cache.incr(window_key)
+            except ValueError:
+                # add 之后刚好过期或被淘汰
+                count = 1 if cache.add(window_key, 1, timeout=timeout) else cache.incr(window_key)
+        except Exception:
+            # 共享缓存出问题时不影响正常请求
+            return 0.0
+        if count > burst:
+            return (index + 1) * window - now
+        return 0.0
+
+    def clear(self):
+        pass
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store():
+    alias = settings.RATELIMIT_CACHE
+    with _stores_lock:
+        if alias not in _stores:
+            _stores[alias] = LocalStore(settings.RATELIMIT_LOCAL_SIZE) if alias is None else CacheStore(alias)
+        return _stores[alias]
+
+
+def client_ip(request):
+    """
+    只使用 REMOTE_ADDR；在反向代理后面部署时由代理设置（X-Forwarded-For 可以被客户端伪造）
+    """
+    return request.META.get('REMOTE_ADDR') or 'unknown'
+
+
+def _user_key(request):
+    user = getattr(request, 'auth', None)
+    if not getattr(user, 'is_authenticated', False):
+        # 会加载 session，auth=None 的接口按 IP 限流更合适
+        user = getattr(request, 'user', None)
+    if getattr(user, 'is_authenticated', False):
+        return f'user:{user.pk}'
+    return f'ip:{client_ip(request)}'
+
+
+def _auth_key(request):
+    auth = getattr(request, 'auth', None)
+    if not auth:
+        return f'ip:{client_ip(request)}'
+    if getattr(auth, '_meta', None) is not None:
+        return f'{auth._meta.label_lower}:{auth.pk}'
+    # 认证器返回的 token 等，不把明文写入缓存
+    return 'auth:' + hashlib.sha256(str(auth).encode()).hexdigest()[:32]
+
+
+KEY_FUNCTIONS = {
+    'ip': lambda request: f'ip:{client_ip(request)}',
+    'user': _user_key,
+    'auth': _auth_key,
+}
+
+
+class RateLimit:
+    """
+    rate：'100/m' 这样的速率；burst：最多连续请求多少次，默认等于 count
+    key：'ip'、'user'、'auth' 或者 request -> str 的函数
+    scope：桶的名称，同一个 scope 的接口共用一个桶（多进程共用缓存时各进程的 scope 要相同）
+    """
+
+    def __init__(self, rate, key='ip', burst=None, scope=None, store=None):
+        self.rate = rate
+        self.count, self.period = parse_rate(rate)
+        self.interval = self.period / self.count
+        self.burst = burst or self.count
+        self.key = KEY_FUNCTIONS[key] if isinstance(key, str) else key
+        self.scope = scope
+        self.store = store
+        self.allowed = 0
+        self.throttled = 0
+
+    def check(self, request):
+        """
+        令牌不够时抛出 RateLimited
+        """
+        if not settings.RATELIMIT_ENABLED:
+            return
+        store = self.store or get_store()
+        wait = store.consume(f'ratelimit:{self.scope}:{self.key(request)}', time.time(), self.interval, self.burst)
+        if wait:
+            self.throttled += 1
+            raise RateLimited(wait, f'Rate limit {self.rate} exceeded')
+        self.allowed += 1
+
+    def metrics(self):
+        return {'scope': self.scope, 'rate': self.rate, 'burst': self.burst,
+                'allowed': self.allowed, 'throttled': self.throttled}
+
+
+limits = []
+
+
+def _limit_operation(operation, limit):
+    run_checks = operation._run_checks
+
+    def _run_checks(request):
+        # 认证、CSRF 检查通过之后再限流，按用户限流时才知道是哪个用户
+        error = run_checks(request)
+        if error:
+            return error
+        try:
+            limit.check(request)
+        except RateLimited as exc:
+            return operation.api.on_exception(request, exc)
+        return None
+
+    operation._run_checks = _run_checks
+
+
+def rate_limit(rate, key='ip', burst=None, scope=None):
+    """
+    限制一个接口，放在 @api.get 等装饰器下面；scope 默认为视图函数的完整名称
+    """
+    def decorator(view_func):
+        limit = RateLimit(rate, key, burst, scope or f'{view_func.__module__}.{view_func.__qualname__}')
+        limits.append(limit)
+        contribute = getattr(view_func, '_ninja_contribute_to_operation', None)
+
+        def contribute_to_operation(operation):
+            if contribute is not None:
+                contribute(operation)
+            _limit_operation(operation, limit)
+
+        view_func._ninja_contribute_to_operation = contribute_to_operation
+        view_func.rate_limit = limit
+        return view_func
+
+    return decorator
+
+
+def limit_router(router, limit):
+    """
+    router 下已经注册的所有接口（包括子 router）共用 limit 的桶，在接口注册之后调用
+    """
+    if limit.scope is None:
+        raise ValueError('limit_router needs a RateLimit with a scope')
+    limits.append(limit)
+    routers = [router]
+    while routers:
+        router = routers.pop()
+        for path_view in router.path_operations.values():
+            for operation in path_view.operations:
+                _limit_operation(operation, limit)
+        routers.extend(child for _, child in router._routers)
+    return router
+
+
+class ConcurrencyLimiter:
+    """
+    limit 为 None 时使用 RATELIMIT_MAX_CONCURRENT，0 表示不限制
+    """
+
+    def __init__(self, limit=None, retry_after=None):
+        self._limit = limit
+        self._retry_after = retry_after
+        self._lock = threading.Lock()
+        self.active = 0
+        self.peak = 0
+        self.rejected = 0
+
+    @property
+    def limit(self):
+        return settings.RATELIMIT_MAX_CONCURRENT if self._limit is None else self._limit
+
+    def acquire(self):
+        """
+        不等待：超过上限时抛出 Overloaded
+        """
+        limit = self.limit if settings.RATELIMIT_ENABLED else 0
+        with self._lock:
+            if limit and self.active >= limit:
+                self.rejected += 1
+                retry_after = settings.RATELIMIT_RETRY_AFTER if self._retry_after is None else self._retry_after
+                raise Overloaded(retry_after, f'{self.active} requests in progress')
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+
+    def release(self):
+        with self._lock:
+            self.active -= 1
+
+    def metrics(self):
+        return {'limit': self.limit, 'active': self.active, 'peak': self.peak, 'rejected': self.rejected}
+
+
+concurrency = ConcurrencyLimiter()
+
+
+def _protect_operation(operation, limiter):
+    run = operation.run
+
+    def acquire(request):
+        try:
+            limiter.acquire()
+        except Overloaded as exc:
+            return operation.api.on_exception(request, exc)
+        return None
+
+    if operation.is_async:
+        async def protected(request, *args, **kwargs):
+            error = acquire(request)
+            if error:
+                return error
+            try:
+                return await run(request, *args, **kwargs)
+            finally:
+                limiter.release()
+    else:
+        def protected(request, *args, **kwargs):
+            error = acquire(request)
+            if error:
+                return error
+            try:
+                return run(request, *args, **kwargs)
+            finally:
+                limiter.release()
+
+    protected.limiter = limiter
+    operation.run = protected
+
+
+def protect_api(api, limiter=concurrency):
+    """
+    api 的所有接口共用 limiter 的并发上限，在所有接口注册之后调用（urls.py 中），返回 api
+    """
+    # ninja 默认有 Exception 的处理（抛给 django 返回 500）
+    if api._lookup_exception_handler(RateLimited(0)) is api._exception_handlers.get(Exception):
+        api.add_exception_handler(RateLimited, lambda request, exc: throttled_response(api, request, exc))
+    for _, router in api._routers:
+        for path_view in router.path_operations.values():
+            for operation in path_view.operations:
+                if getattr(operation.run, 'limiter', None) is None:
+                    _protect_operation(operation, limiter)
+    return api
+
+
+def metrics():
+    return {
+        'concurrency': concurrency.metrics(),
+        'rate_limits': [limit.metrics() for limit in limits],
+    }
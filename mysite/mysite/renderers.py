@@ -0,0 +1,204 @@
+"""
+NinjaAPI 的请求解析和响应渲染
+1. 安装了 orjson 时使用 orjson 编解码 JSON，否则使用标准库 json，两种方式的输出一致
+   date/datetime/UUID 由 orjson 直接处理（datetime 为 ISO 格式，保留微秒，UTC 以 Z 结尾），
+   Decimal 输出为字符串，pydantic Schema 转为 dict
+2. 根据请求头 Accept 选择响应格式：JSON、msgpack（安装了 msgpack 时）、XML，默认 JSON
+3. 根据请求头 Content-Type 解析请求体：JSON 或 msgpack
+4. NinjaAPI 默认使用上面的解析器和渲染器，响应的 Content-Type 随协商结果变化
+
+使用：from mysite.renderers import NinjaAPI 替换 from ninja import NinjaAPI
+"""
+
+import datetime
+import json
+from io import StringIO
+
+from django.utils.encoding import force_str
+from django.utils.xmlutils import SimplerXMLGenerator
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+from ninja import NinjaAPI as BaseNinjaAPI
+from ninja.parser import Parser
+from ninja.renderers import BaseRenderer
+from ninja.responses import NinjaJSONEncoder
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class JSONEncoder(NinjaJSONEncoder):
+    """
+    标准库 json 使用的编码器，datetime/time 的格式和 orjson 保持一致
+    """
+
+    def default(self, o):
+        if isinstance(o, (datetime.datetime, datetime.time)):
+            r = o.isoformat()
+            return r[:-6] + 'Z' if r.endswith('+00:00') else r
+        return super().default(o)
+
+
+_encoder = JSONEncoder()
+
+
+def json_dumps(data):
+    """
+    序列化为 JSON，返回 bytes
+    """
+    if orjson is not None:
+        return orjson.dumps(data, default=_encoder.default, option=orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, cls=JSONEncoder, separators=(',', ':')).encode()
+
+
+def json_loads(content):
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+class JSONRenderer(BaseRenderer):
+    media_type = 'application/json'
+
+    def render(self, request, data, *, response_status):
+        return json_dumps(data)
+
+
+class MsgpackRenderer(BaseRenderer):
+    media_type = 'application/msgpack'
+    charset = None
+
+    def render(self, request, data, *, response_status):
+        # msgpack 不支持的类型按 JSON 的方式转换，日期为 ISO 格式字符串
+        return msgpack.packb(data, default=_encoder.default)
+
+
+class XMLRenderer(BaseRenderer):
+    media_type = 'text/xml'
+
+    def render(self, request, data, *, response_status):
+        stream = StringIO()
+        xml = SimplerXMLGenerator(stream, 'utf-8')
+        xml.startDocument()
+        xml.startElement('data', {})
+        self._to_xml(xml, data)
+        xml.endElement('data')
+        xml.endDocument()
+        return stream.getvalue()
+
+    def _to_xml(self, xml, data):
+        if isinstance(data, BaseModel):
+            data = data.dict()
+        if isinstance(data, (list, tuple)):
+            for item in data:
+                xml.startElement('item', {})
+                self._to_xml(xml, item)
+                xml.endElement('item')
+        elif isinstance(data, dict):
+            for key, value in data.items():
+                xml.startElement(str(key), {})
+                self._to_xml(xml, value)
+                xml.endElement(str(key))
+        elif data is None:
+            pass
+        elif isinstance(data, (str, int, float)):
+            xml.characters(force_str(data))
+        else:
+            xml.characters(force_str(_encoder.default(data)))
+
+
+def parse_accept(accept):
+    """
+    解析 Accept 请求头，返回按 q 值从大到小排序的 media type 列表
+    """
+    media_types = []
+    for i, item in enumerate(accept.split(',')):
+        media_type, *params = [part.strip() for part in item.split(';')]
+        if not media_type:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            media_types.append((-q, i, media_type.lower()))
+    return [media_type for _, _, media_type in sorted(media_types)]
+
+
+class NegotiatingRenderer(BaseRenderer):
+    """
+    根据 Accept 选择渲染器，没有匹配的格式时使用第一个渲染器（JSON）
+    """
+    media_type = JSONRenderer.media_type
+
+    def __init__(self, renderers=None):
+        if renderers is None:
+            renderers = [JSONRenderer(), XMLRenderer()]
+            if msgpack is not None:
+                renderers.insert(1, MsgpackRenderer())
+        self.renderers = renderers
+        self.media_types = {renderer.media_type: renderer for renderer in renderers}
+        if msgpack is not None:
+            self.media_types.setdefault('application/x-msgpack', self.media_types.get('application/msgpack'))
+        self.media_types.setdefault('application/xml', self.media_types.get('text/xml'))
+
+    def select_renderer(self, request):
+        for media_type in parse_accept(request.META.get('HTTP_ACCEPT', '')):
+            renderer = self.media_types.get(media_type)
+            if renderer is not None:
+                return renderer
+            if media_type in ('*/*', 'application/*'):
+                break
+        return self.renderers[0]
+
+    def render(self, request, data, *, response_status):
+        return self.select_renderer(request).render(request, data, response_status=response_status)
+
+
+class NegotiatingParser(Parser):
+    """
+    根据 Content-Type 解析请求体，msgpack 以外的都按 JSON 解析
+    """
+
+    def parse_body(self, request):
+        if msgpack is not None and request.content_type in ('application/msgpack', 'application/x-msgpack'):
+            return msgpack.unpackb(request.body)
+        return json_loads(request.body)
+
+
+class NinjaAPI(BaseNinjaAPI):
+    """
+    默认使用 NegotiatingRenderer、NegotiatingParser 的 NinjaAPI
+    """
+
+    def __init__(self, *args, renderer=None, parser=None, **kwargs):
+        super().__init__(
+            *args,
+            renderer=renderer or NegotiatingRenderer(),
+            parser=parser or NegotiatingParser(),
+            **kwargs,
+        )
+
+    def create_response(self, request, data, *, status=200):
+        negotiating = isinstance(self.renderer, NegotiatingRenderer)
+        renderer = self.renderer.select_renderer(request) if negotiating else self.renderer
+        content = renderer.render(request, data, response_status=status)
+        content_type = renderer.media_type
+        if renderer.charset:
+            content_type = '{}; charset={}'.format(content_type, renderer.charset)
+        response = HttpResponse(content, status=status, content_type=content_type)
+        if negotiating:
+            patch_vary_headers(response, ['Accept'])
+        return response
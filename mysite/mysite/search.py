@@ -0,0 +1,149 @@
+"""
+进程内的全文索引
+对列表逐个 q in text.lower() 是线性扫描，数据量大时每次搜索都要把所有文本比较一遍
+1. 倒排索引：每个文本切成 n-gram（默认 3 个字符），gram -> 包含它的 doc_id 列表；
+   搜索词长度 >= n 时只需要检查其中最短的一个列表，再用 term in text 校验，结果和子串匹配完全一致
+2. 短于 n 的搜索词（前缀/单个字母）：合并包含它的 gram 的列表（gram 的种类远少于文本数），再加上长度不足 n 的文本
+3. 多个词之间是 AND；排序：整个文本相同 > 完整的词 > 词的前缀 > 词中间，再按出现位置、文本长度
+4. add/remove 增量更新：倒排列表只追加，删除或修改后旧条目在查询时被校验过滤，过期条目超过一半时重建
+5. search 返回 (匹配总数, offset 开始的 limit 个 doc_id)，只对需要的部分排序
+
+使用：
+    index = SearchIndex()
+    index.add_many(enumerate(weapons))
+    total, ids = index.search('kat', offset=0, limit=10)
+"""
+
+import heapq
+import threading
+
+
+def _score(text, terms):
+    quality = position = 0
+    for term in terms:
+        start = text.find(term)
+        end = start + len(term)
+        word_start = start == 0 or not text[start - 1].isalnum()
+        word_end = end == len(text) or not text[end].isalnum()
+        if text == term:
+            pass
+        elif word_start and word_end:
+            quality += 1
+        elif word_start:
+            quality += 2
+        else:
+            quality += 3
+        position += start
+    return quality, position, len(text)
+
+
+class SearchIndex:
+
+    def __init__(self, n=3):
+        self.n = n
+        self._lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._texts = {}  # doc_id -> 小写文本
+            self._postings = {}  # gram -> [doc_id]，只追加
+            self._short = set()  # 文本长度不足 n 的 doc_id
+            self._size = 0  # 倒排列表中的条目数
+            self._stale = 0  # 其中已删除或修改的条目数
+
+    def __len__(self):
+        return len(self._texts)
+
+    def _grams(self, text):
+        n = self.n
+        return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+    def _add(self, doc_id, text):
+        if doc_id in self._texts:
+            self._discard(doc_id)
+        text = text.lower()
+        self._texts[doc_id] = text
+        grams = self._grams(text)
+        if not grams:
+            self._short.add(doc_id)
+        postings = self._postings
+        for gram in grams:
+            doc_ids = postings.get(gram)
+            if doc_ids is None:
+                postings[gram] = [doc_id]
+            else:
+                doc_ids.append(doc_id)
+        self._size += len(grams)
+
+    def _discard(self, doc_id):
+        text = self._texts.pop(doc_id, None)
+        if text is None:
+            return False
+        self._short.discard(doc_id)
+        self._stale += len(self._grams(text))
+        return True
+
+    def _compact(self):
+        if self._stale > 1000 and self._stale * 2 > self._size:
+            texts = self._texts
+            self.clear()
+            for doc_id, text in texts.items():
+                self._add(doc_id, text)
+
+    def add(self, doc_id, text):
+        """
+        新增或修改 doc_id 的文本
+        """
+        with self._lock:
+            self._add(doc_id, text)
+            self._compact()
+
+    def add_many(self, items):
+        """
+        items 为 (doc_id, text) 的可迭代对象
+        """
+        with self._lock:
+            for doc_id, text in items:
+                self._add(doc_id, text)
+            self._compact()
+
+    def remove(self, doc_id):
+        with self._lock:
+            if self._discard(doc_id):
+                self._compact()
+
+    def _candidates(self, term):
+        n = self.n
+        if len(term) >= n:
+            doc_ids = None
+            for i in range(len(term) - n + 1):
+                postings = self._postings.get(term[i:i + n])
+                if postings is None:
+                    return ()
+                if doc_ids is None or len(postings) < len(doc_ids):
+                    doc_ids = postings
+            return doc_ids
+        return self._short.union(*(postings for gram, postings in self._postings.items() if term in gram))
+
+    def search(self, query, offset=0, limit=10):
+        """
+        返回 (匹配总数, 按相关度排序后 offset 开始的 limit 个 doc_id)，limit 为 None 时返回全部
+        """
+        terms = query.lower().split()
+        if not terms:
+            return 0, []
+        with self._lock:
+            candidates = min((self._candidates(term) for term in terms), key=len)
+            texts = self._texts
+            matches = []
+            # 倒排列表中可能有重复和过期的条目
+            for doc_id in dict.fromkeys(candidates):
+                text = texts.get(doc_id)
+                if text is not None and all(term in text for term in terms):
+                    matches.append((_score(text, terms), doc_id))
+        if limit is None:
+            top = sorted(matches)[offset:]
+        else:
+            top = heapq.nsmallest(offset + limit, matches)[offset:]
+        return len(matches), [doc_id for _, doc_id in top]
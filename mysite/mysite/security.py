@@ -0,0 +1,175 @@
+"""
+多个认证器的接口：auth=[QueryKey(), HeaderKey()]
+ninja 按顺序逐个调用认证器，每个认证器各自从请求中取一遍凭证，顺序固定，不知道哪种方式用得最多
+1. CompositeAuth：每个请求只解析一次凭证（query、header、cookie、Authorization: Bearer），
+   请求中没有某个认证器需要的凭证时直接跳过，不调用 authenticate
+2. 自适应顺序：某个认证器成功的次数超过排在它前面的认证器时交换位置，最常用的方式逐渐排到最前面
+3. stats()：每个认证器的调用、成功、失败、跳过次数和平均耗时
+4. @composite_auth 放在 @api.get 等装饰器下面，使用 operation 的 auth 列表创建 CompositeAuth，
+   OpenAPI 文档中列出的认证方式不变
+
+使用：
+    @api.get('/multipleauth', auth=[QueryKey(), HeaderKey()])
+    @composite_auth
+    def multiple_auth(request):
+        ...
+"""
+
+import threading
+import time
+
+from ninja.security import APIKeyCookie, APIKeyHeader, APIKeyQuery, HttpBearer
+
+
+def credential_source(auth):
+    """
+    认证器从请求的什么位置取凭证，返回 (位置, 名称)，不是这几种认证器时返回 None
+    """
+    if isinstance(auth, APIKeyQuery):
+        return 'query', auth.param_name
+    if isinstance(auth, APIKeyHeader):
+        return 'header', auth.param_name
+    if isinstance(auth, APIKeyCookie):
+        return 'cookie', auth.param_name
+    if isinstance(auth, HttpBearer):
+        return auth.openapi_scheme, auth.header
+    return None
+
+
+def parse_credentials(request, sources):
+    credentials = {}
+    for location, name in sources:
+        if location == 'query':
+            value = request.GET.get(name)
+        elif location == 'header':
+            value = request.headers.get(name)
+        elif location == 'cookie':
+            value = request.COOKIES.get(name)
+        else:
+            # Authorization: <scheme> <token>
+            scheme, _, value = request.headers.get(name, '').partition(' ')
+            if scheme.lower() != location:
+                value = None
+        if value:
+            credentials[location, name] = value
+    return credentials
+
+
+class AuthStats:
+    """
+    一个认证器的计数，多个请求线程同时更新，加锁避免 += 丢失计数
+    """
+    __slots__ = ('calls', 'hits', 'misses', 'skipped', 'total_ns', '_lock')
+
+    def __init__(self):
+        self.calls = self.hits = self.misses = self.skipped = self.total_ns = 0
+        self._lock = threading.Lock()
+
+    def skip(self):
+        with self._lock:
+            self.skipped += 1
+
+    def record(self, elapsed_ns, hit):
+        """
+        hit 为 None 时认证器抛出了异常，只计调用次数和耗时
+        """
+        with self._lock:
+            self.calls += 1
+            self.total_ns += elapsed_ns
+            if hit:
+                self.hits += 1
+            elif hit is not None:
+                self.misses += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'hits': self.hits,
+                'misses': self.misses,
+                'skipped': self.skipped,
+                'avg_us': round(self.total_ns / self.calls / 1000, 3) if self.calls else 0,
+            }
+
+
+class CompositeAuth:
+
+    def __init__(self, authenticators):
+        self.authenticators = list(authenticators)
+        self.sources = [credential_source(auth) for auth in self.authenticators]
+        self._needed = list(dict.fromkeys(source for source in self.sources if source is not None))
+        self._stats = [AuthStats() for _ in self.authenticators]
+        self._order = tuple(range(len(self.authenticators)))
+        self._lock = threading.Lock()
+
+    def __call__(self, request):
+        credentials = parse_credentials(request, self._needed)
+        order = self._order
+        for position, i in enumerate(order):
+            auth, source, stats = self.authenticators[i], self.sources[i], self._stats[i]
+            if source is not None and source not in credentials:
+                stats.skip()
+                continue
+            hit = None
+            start = time.perf_counter_ns()
+            try:
+                if source is None:
+                    result = auth(request)
+                else:
+                    result = auth.authenticate(request, credentials[source])
+                hit = bool(result)
+            finally:
+                stats.record(time.perf_counter_ns() - start, hit)
+            if hit:
+                if position:
+                    self._promote(i)
+                return result
+        return None
+
+    def _promote(self, i):
+        with self._lock:
+            order = list(self._order)
+            position = order.index(i)
+            if position and self._stats[i].hits > self._stats[order[position - 1]].hits:
+                order[position - 1], order[position] = order[position], order[position - 1]
+                self._order = tuple(order)
+
+    @property
+    def order(self):
+        return [self.authenticators[i] for i in self._order]
+
+    def stats(self):
+        return [
+            {'authenticator': type(self.authenticators[i]).__name__, **self._stats[i].snapshot()}
+            for i in self._order
+        ]
+
+
+def composite_auth(view_func):
+    """
+    使用 CompositeAuth 执行 operation 的认证，创建的 CompositeAuth 保存在 view_func.composite_auth
+    """
+    contribute = getattr(view_func, '_ninja_contribute_to_operation', None)
+
+    def contribute_to_operation(operation):
+        if contribute is not None:
+            contribute(operation)
+
+        def _run_authentication(request):
+            # api 级别的 auth 在 operation 创建之后才设置，第一次请求时再创建
+            composite = getattr(view_func, 'composite_auth', None)
+            if composite is None:
+                composite = view_func.composite_auth = CompositeAuth(operation.auth_callbacks)
+            try:
+                result = composite(request)
+            except Exception as exc:
+                return operation.api.on_exception(request, exc)
+            if result:
+                request.auth = result
+                return None
+            return operation.api.create_response(request, {"detail": "Unauthorized"}, status=401)
+
+        operation._run_authentication = _run_authentication
+
+    view_func._ninja_contribute_to_operation = contribute_to_operation
+    return view_func
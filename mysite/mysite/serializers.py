@@ -0,0 +1,174 @@
+"""
+可信输出（trusted output）：ORM 查出来的数据类型本身就是对的，响应时不再经过 pydantic 逐个字段校验
+1. compile_serializer(schema)：按 Schema 的字段生成一个专用的序列化函数，每个 Schema 只生成一次
+   - from_obj：直接读取模型实例的属性；外键读取 <name>_id，多对多返回主键列表，嵌套 Schema 递归处理
+   - from_row：读取 queryset.values() 返回的 dict，字段名一致时直接返回原 dict
+   - many(data)：data 为 QuerySet 且 Schema 中没有嵌套/多对多字段时，使用 .values() 查询，不再创建模型实例
+2. @trusted_output 放在 @api.get/post 等装饰器下面，该接口的响应跳过 pydantic 校验，输出结构与原来一致
+   Schema 中有 resolve_ 方法、validator，或接口设置了 by_alias/exclude_* 时自动回退到原来的处理方式
+
+使用：
+    @api.post('/employees', response=List[EmployeeOut])
+    @trusted_output
+    def get_employees(request):
+        return Employee.objects.all()
+"""
+
+from django.db.models import Manager, QuerySet
+from django.http.response import HttpResponseBase
+from ninja import Schema
+from pydantic.fields import SHAPE_LIST, SHAPE_SINGLETON
+
+
+class SerializerError(TypeError):
+    pass
+
+
+class CompiledSerializer:
+
+    def __init__(self, schema, from_obj, from_row, sources, identity_row):
+        self.schema = schema
+        self.from_obj = from_obj
+        self.from_row = from_row
+        self.sources = sources  # values() 需要的字段，为 None 时不支持 values()
+        self.identity_row = identity_row
+
+    def many(self, data):
+        if isinstance(data, Manager):
+            data = data.all()
+        if isinstance(data, QuerySet):
+            if self.sources is not None:
+                rows = data.values(*self.sources)
+                return list(rows) if self.identity_row else [self.from_row(row) for row in rows]
+        return [self.from_row(item) if isinstance(item, dict) else self.from_obj(item) for item in data]
+
+    def one(self, data):
+        return self.from_row(data) if isinstance(data, dict) else self.from_obj(data)
+
+
+def _is_m2m_link(type_):
+    # ninja 为 ModelSchema 中的多对多字段生成的类型，校验时取关联对象的 pk
+    return getattr(type_, '__name__', '') == 'M2MLink'
+
+
+def _is_schema(type_):
+    return isinstance(type_, type) and issubclass(type_, Schema)
+
+
+def _related(value):
+    if isinstance(value, Manager):
+        return value.all()
+    return value
+
+
+_compiled = {}
+
+
+def compile_serializer(schema):
+    """
+    为 schema 生成序列化函数，结果会缓存
+    """
+    if schema in _compiled:
+        return _compiled[schema]
+    if getattr(schema, '_ninja_resolvers', None) or schema.__validators__ or schema.__pre_root_validators__ \
+            or schema.__post_root_validators__:
+        raise SerializerError(f'{schema.__name__} has resolvers or validators')
+
+    namespace = {'_related': _related}
+    obj_items, row_items, sources = [], [], []
+    identity_row = True
+    for i, (name, field) in enumerate(schema.__fields__.items()):
+        source = field.alias
+        if field.shape == SHAPE_SINGLETON and _is_schema(field.type_):
+            nested = compile_serializer(field.type_)
+            namespace[f'_nested{i}'] = nested.from_obj
+            obj_items.append(f'{name!r}: (None if obj.{source} is None else _nested{i}(obj.{source}))')
+            sources = None
+        elif field.shape == SHAPE_LIST and _is_schema(field.type_):
+            nested = compile_serializer(field.type_)
+            namespace[f'_nested{i}'] = nested.from_obj
+            obj_items.append(f'{name!r}: [_nested{i}(item) for item in _related(obj.{source})]')
+            sources = None
+        elif field.shape == SHAPE_LIST and _is_m2m_link(field.type_):
+            obj_items.append(f'{name!r}: [item.pk for item in _related(obj.{source})]')
+            sources = None
+        elif field.shape == SHAPE_LIST and not field.sub_fields[0].sub_fields:
+            obj_items.append(f'{name!r}: list(obj.{source})')
+            sources = None
+        elif field.shape == SHAPE_SINGLETON and not field.sub_fields:
+            obj_items.append(f'{name!r}: obj.{source}')
+            row_items.append(f'{name!r}: row[{source!r}]')
+            if sources is not None:
+                sources.append(source)
+            identity_row = identity_row and name == source
+        else:
+            raise SerializerError(f'{schema.__name__}.{name}: unsupported field type {field.outer_type_}')
+        if not source.isidentifier():
+            raise SerializerError(f'{schema.__name__}.{name}: unsupported alias {source!r}')
+
+    code = (
+        'def from_obj(obj):\n'
+        f'    return {{{", ".join(obj_items)}}}\n'
+        'def from_row(row):\n'
+        f'    return {{{", ".join(row_items)}}}\n'
+    )
+    exec(compile(code, f'<serializer {schema.__name__}>', 'exec'), namespace)
+    serializer = CompiledSerializer(schema, namespace['from_obj'], namespace['from_row'], sources, identity_row)
+    _compiled[schema] = serializer
+    return serializer
+
+
+def _response_serializer(response_model):
+    """
+    ninja 的响应模型为 {"response": <声明的类型>}，返回 (序列化器, 是否为列表)，不支持时返回 None
+    """
+    if response_model is None:
+        return None
+    field = getattr(response_model, '__fields__', {}).get('response')
+    if field is None or not _is_schema(field.type_) or field.shape not in (SHAPE_SINGLETON, SHAPE_LIST):
+        return None
+    try:
+        return compile_serializer(field.type_), field.shape == SHAPE_LIST
+    except SerializerError:
+        return None
+
+
+def trusted_output(view_func):
+    """
+    接口响应跳过 pydantic 校验，使用 compile_serializer 生成的序列化函数
+    """
+
+    contribute = getattr(view_func, '_ninja_contribute_to_operation', None)
+
+    def contribute_to_operation(operation):
+        if contribute is not None:
+            contribute(operation)
+        if operation.by_alias or operation.exclude_unset or operation.exclude_defaults or operation.exclude_none:
+            return
+        serializers = {}
+        for status, response_model in operation.response_models.items():
+            serializer = _response_serializer(response_model)
+            if serializer is not None:
+                serializers[status] = serializer
+        if not serializers:
+            return
+        result_to_response = operation._result_to_response
+
+        def _result_to_response(request, result):
+            if isinstance(result, HttpResponseBase):
+                return result
+            status = next(iter(operation.response_models)) if len(operation.response_models) == 1 else 200
+            data = result
+            if isinstance(result, tuple) and len(result) == 2:
+                status, data = result
+            serializer = serializers.get(status)
+            if serializer is None:
+                return result_to_response(request, result)
+            serializer, many = serializer
+            data = serializer.many(data) if many else serializer.one(data)
+            return operation.api.create_response(request, data, status=status)
+
+        operation._result_to_response = _result_to_response
+
+    view_func._ninja_contribute_to_operation = contribute_to_operation
+    return view_func
@@ -0,0 +1,9 @@
+"""
+session 引擎和用户缓存
+django_auth 认证的接口每次请求都要从数据库读取 session 和用户（两条 SELECT），session 修改后还有一条 UPDATE
+1. local：在 cached_db 前面加一层进程内缓存，正常情况下读取 session 不查询数据库也不访问共享缓存中的 session 数据
+2. signed：session 数据签名后保存在 cookie 中，服务端只保存吊销列表（退出登录、更换 session key 时加入）
+3. middleware.SessionMiddleware：按请求路径选择 session 引擎（settings.SESSION_ENGINES），没有匹配时使用 SESSION_ENGINE
+4. users.CachedModelBackend：request.user 从进程内缓存读取，用户修改或删除后失效
+进程内缓存的条目在共享的 django cache 中有版本号，其它进程修改后版本号变化，本进程重新加载，见 cache.LocalCache
+"""
@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class SessionsConfig(AppConfig):
+    name = 'mysite.sessions'
+    label = 'mysite_sessions'
+
+    def ready(self):
+        # 注册用户的信号，修改后让用户缓存失效
+        from . import users
@@ -0,0 +1,69 @@
+"""
+进程内 LRU 缓存，条目带过期时间和版本号
+版本号保存在共享的 django cache 中，任何进程修改数据后调用 invalidate 更新版本号，
+其它进程读取时发现版本号不一致就丢弃本地的条目；共享缓存中的版本号被淘汰时也按不一致处理
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+
+
+class LocalCache:
+
+    def __init__(self, prefix, size=10000, ttl=60, cache_alias='default'):
+        self.prefix = prefix
+        self.size = size
+        self.ttl = ttl
+        self.cache_alias = cache_alias
+        self._lock = threading.Lock()
+        self._data = OrderedDict()  # key -> (过期时间, 版本号, value)
+
+    def _version_key(self, key):
+        return f'{self.prefix}:v:{key}'
+
+    def version(self, key):
+        """
+        读取数据前先取版本号，读取期间数据被修改时 set 保存的是旧版本号，下次 get 会重新加载
+        """
+        cache = caches[self.cache_alias]
+        version_key = self._version_key(key)
+        version = cache.get(version_key)
+        if version is None:
+            cache.add(version_key, time.time_ns(), timeout=None)
+            version = cache.get(version_key)
+        return version
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires, version, value = entry
+        if expires <= time.monotonic() or caches[self.cache_alias].get(self._version_key(key)) != version:
+            with self._lock:
+                if self._data.get(key) is entry:
+                    del self._data[key]
+            return None
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value, version):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, version, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        caches[self.cache_alias].set(self._version_key(key), time.time_ns(), timeout=None)
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
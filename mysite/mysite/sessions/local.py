@@ -0,0 +1,48 @@
+"""
+在 cached_db 前面加一层进程内缓存的 session 引擎：SESSION_ENGINE = 'mysite.sessions.local'
+读取顺序：进程内缓存 -> SESSION_CACHE_ALIAS 缓存 -> 数据库
+进程内缓存最多 SESSION_LOCAL_CACHE_SIZE 个 session，每个最多保存 SESSION_LOCAL_CACHE_TTL 秒；
+session 保存或删除（退出登录）后版本号更新，所有进程的进程内缓存立即失效
+"""
+
+from django.conf import settings
+from django.contrib.sessions.backends.cached_db import SessionStore as CachedDBStore
+
+from .cache import LocalCache
+
+KEY_PREFIX = 'mysite.sessions.local'
+
+local_sessions = LocalCache(
+    KEY_PREFIX,
+    size=settings.SESSION_LOCAL_CACHE_SIZE,
+    ttl=settings.SESSION_LOCAL_CACHE_TTL,
+    cache_alias=settings.SESSION_CACHE_ALIAS,
+)
+
+
+class SessionStore(CachedDBStore):
+    cache_key_prefix = KEY_PREFIX
+
+    def load(self):
+        session_key = self.session_key
+        if session_key is None:
+            return super().load()
+        data = local_sessions.get(session_key)
+        if data is not None:
+            return dict(data)
+        version = local_sessions.version(session_key)
+        data = super().load()
+        if self.session_key == session_key:
+            local_sessions.set(session_key, dict(data), version)
+        return data
+
+    def save(self, must_create=False):
+        super().save(must_create)
+        local_sessions.invalidate(self.session_key)
+
+    def delete(self, session_key=None):
+        if session_key is None:
+            session_key = self.session_key
+        super().delete(session_key)
+        if session_key is not None:
+            local_sessions.invalidate(session_key)
@@ -0,0 +1,53 @@
+"""
+按请求路径选择 session 引擎
+settings.SESSION_ENGINES = {'/api/': 'mysite.sessions.local', '/apis/': 'mysite.sessions.signed'}
+路径前缀最长的优先，没有匹配时使用 SESSION_ENGINE；引擎的 SessionStore 可以用 cookie_name 指定单独的 cookie，
+不同引擎的 session 不会互相覆盖
+"""
+
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.sessions.middleware import SessionMiddleware as BaseSessionMiddleware
+
+
+class SessionMiddleware(BaseSessionMiddleware):
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.engines = sorted(
+            ((prefix, import_module(engine).SessionStore) for prefix, engine in settings.SESSION_ENGINES.items()),
+            key=lambda item: len(item[0]),
+            reverse=True,
+        )
+
+    def get_session_store(self, path):
+        for prefix, session_store in self.engines:
+            if path.startswith(prefix):
+                return session_store
+        return self.SessionStore
+
+    def process_request(self, request):
+        session_store = self.get_session_store(request.path_info)
+        cookie_name = getattr(session_store, 'cookie_name', settings.SESSION_COOKIE_NAME)
+        request.session = session_store(request.COOKIES.get(cookie_name))
+
+    def process_response(self, request, response):
+        session = getattr(request, 'session', None)
+        cookie_name = getattr(session, 'cookie_name', settings.SESSION_COOKIE_NAME)
+        if cookie_name == settings.SESSION_COOKIE_NAME:
+            return super().process_response(request, response)
+        # 父类按 SESSION_COOKIE_NAME 读写 cookie，处理前后换成引擎自己的 cookie
+        cookies = request.COOKIES
+        request.COOKIES = {k: v for k, v in cookies.items() if k != settings.SESSION_COOKIE_NAME}
+        if cookie_name in cookies:
+            request.COOKIES[settings.SESSION_COOKIE_NAME] = cookies[cookie_name]
+        try:
+            response = super().process_response(request, response)
+        finally:
+            request.COOKIES = cookies
+        morsel = response.cookies.pop(settings.SESSION_COOKIE_NAME, None)
+        if morsel is not None:
+            response.cookies[cookie_name] = morsel.value
+            response.cookies[cookie_name].update(dict(morsel))
+        return response
@@ -0,0 +1,68 @@
+"""
+签名 cookie 的 session 引擎：SESSION_ENGINE = 'mysite.sessions.signed'
+session 数据签名后保存在 cookie（SIGNED_SESSION_COOKIE_NAME）中，读取 session 不查询数据库
+django 自带的 signed_cookies 引擎退出登录后，之前复制出去的 cookie 仍然有效，这里增加吊销列表：
+1. 每个 session 有一个随机的 _sid
+2. 退出登录（flush）、删除、更换 session key（登录）时，把旧的 _sid 加入吊销列表，
+   吊销列表保存在 SESSION_CACHE_ALIAS 缓存中，保存时间为 cookie 的有效期，之后签名本身就过期了
+3. 读取 session 时 _sid 在吊销列表中则视为没有 session
+吊销列表需要多进程共享，生产环境 SESSION_CACHE_ALIAS 应使用 redis/memcached 等共享缓存
+"""
+
+import secrets
+
+from django.conf import settings
+from django.contrib.sessions.backends.signed_cookies import SessionStore as SignedCookieStore
+from django.core.cache import caches
+
+SID = '_sid'
+KEY_PREFIX = 'mysite.sessions.signed:revoked:'
+
+
+def revoke(sid):
+    caches[settings.SESSION_CACHE_ALIAS].set(KEY_PREFIX + sid, True, settings.SESSION_COOKIE_AGE)
+
+
+def is_revoked(sid):
+    return caches[settings.SESSION_CACHE_ALIAS].get(KEY_PREFIX + sid) is not None
+
+
+class SessionStore(SignedCookieStore):
+    cookie_name = settings.SIGNED_SESSION_COOKIE_NAME
+
+    def load(self):
+        data = super().load()
+        sid = data.get(SID)
+        if sid is not None and is_revoked(sid):
+            self.create()
+            return {}
+        return data
+
+    def _revoke_current(self):
+        sid = self._session.get(SID)
+        if sid is not None:
+            revoke(sid)
+
+    def save(self, must_create=False):
+        session = self._get_session(no_load=must_create)
+        session.setdefault(SID, secrets.token_urlsafe(16))
+        super().save(must_create)
+
+    def delete(self, session_key=None):
+        if session_key is None or session_key == self.session_key:
+            self._revoke_current()
+        else:
+            sid = SessionStore(session_key).load().get(SID)
+            if sid is not None:
+                revoke(sid)
+        super().delete(session_key)
+
+    def flush(self):
+        self._revoke_current()
+        super().flush()
+
+    def cycle_key(self):
+        # 登录时更换 _sid，旧 cookie 失效
+        self._revoke_current()
+        self._session.pop(SID, None)
+        super().cycle_key()
@@ -0,0 +1,40 @@
+"""
+进程内缓存用户的认证后端：AUTHENTICATION_BACKENDS = ['mysite.sessions.users.CachedModelBackend', ...]
+AuthenticationMiddleware 每个请求都会按 session 中的用户 id 查询一次用户，这里先从进程内缓存读取，
+每次返回一个副本，请求中修改 user 的属性不会影响其它请求；用户保存或删除后缓存失效（包括修改密码）
+"""
+
+import copy
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import LocalCache
+
+local_users = LocalCache(
+    'mysite.sessions.users',
+    size=settings.USER_LOCAL_CACHE_SIZE,
+    ttl=settings.USER_LOCAL_CACHE_TTL,
+    cache_alias=settings.SESSION_CACHE_ALIAS,
+)
+
+
+class CachedModelBackend(ModelBackend):
+
+    def get_user(self, user_id):
+        user = local_users.get(user_id)
+        if user is None:
+            version = local_users.version(user_id)
+            user = super().get_user(user_id)
+            if user is None:
+                return None
+            local_users.set(user_id, copy.copy(user), version)
+        return copy.copy(user)
+
+
+@receiver([post_save, post_delete], sender=get_user_model())
+def user_changed(sender, instance, **kwargs):
+    local_users.invalidate(instance.pk)
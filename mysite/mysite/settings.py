@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.0/ref/settings/
 """
 import os.path
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -39,12 +40,22 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'polls.apps.PollsConfig',
     'ninjademo.apps.NinjademoConfig',
+    'mysite.sessions.apps.SessionsConfig',
     'ninja',
 ]
 
 MIDDLEWARE = [
+    # 请求级别的查询数、数据库时间、序列化时间统计和 Server-Timing 响应头，见 PROFILING_ENABLED
+    'mysite.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
+    # 按 Accept-Encoding 压缩响应（br/gzip），见 mysite/compression.py；放在修改响应内容的中间件前面
+    'mysite.compression.CompressionMiddleware',
+    # 写过数据库的请求之后一段时间内读主库，见 mysite/db/routers.py；放在 session 前面，保存 session 也算写
+    'mysite.db.routers.ReplicaRoutingMiddleware',
+    # 大文件上传：STREAMING_UPLOAD_PATHS 中的路径边接收边写入临时文件，见 mysite/uploads.py
+    'mysite.uploads.StreamingUploadMiddleware',
+    # 按路径选择 session 引擎，见 SESSION_ENGINES
+    'mysite.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -76,13 +87,50 @@ WSGI_APPLICATION = 'mysite.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.0/ref/settings/#databases
 
+# mysite.db.sqlite3：连接时设置 PRAGMA，连接在进程内的连接池中复用（见 mysite/db/sqlite3/base.py）
+# CONN_MAX_AGE = 0：每个请求结束时把连接还给连接池，连接数由连接池的 max_size 限制，不随线程数增长
+# pool：max_size 最大连接数，timeout 等待连接的秒数，空闲 health_check_interval 秒后取出时先 SELECT 1 检查
+# pragmas：WAL 模式下读写互不阻塞；busy_timeout 毫秒；mmap_size 字节；cache_size 为负数时单位是 KiB
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'mysite.db.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'CONN_MAX_AGE': 0,
+        'OPTIONS': {
+            'pool': {
+                'max_size': 10,
+                'timeout': 10,
+                'max_idle': 300,
+                'max_lifetime': 3600,
+                'health_check_interval': 30,
+            },
+            'pragmas': {
+                'journal_mode': 'wal',
+                'synchronous': 'normal',
+                'busy_timeout': 5000,
+                'mmap_size': 256 * 1024 ** 2,
+                'cache_size': -64 * 1024,
+                'temp_store': 'memory',
+            },
+        },
     }
 }
 
+# 读写分离（见 mysite/db/routers.py）：读发到 DATABASE_REPLICAS 中的从库，写发到 default
+# 本地测试：REPLICAS=2 python manage.py runserver 增加 replica1、replica2 两个从库（db.replica1.sqlite3 等），
+# 另外运行 REPLICAS=2 python manage.py replicate --interval 1 每秒从主库复制一次；测试时从库就是主库（TEST MIRROR）
+# 写过数据库的客户端在 DATABASE_REPLICA_STICKY_SECONDS 秒内读主库，应大于从库的复制延迟
+DATABASE_REPLICAS = [f'replica{i}' for i in range(1, int(os.environ.get('REPLICAS', 0)) + 1)]
+for alias in DATABASE_REPLICAS:
+    DATABASES[alias] = {
+        **DATABASES['default'],
+        'NAME': BASE_DIR / f'db.{alias}.sqlite3',
+        'TEST': {'MIRROR': 'default'},
+    }
+DATABASE_ROUTERS = ['mysite.db.routers.PrimaryReplicaRouter']
+DATABASE_REPLICA_STICKY_SECONDS = 5
+
+# MySQL 没有使用连接池，设置 CONN_MAX_AGE 保持长连接
 # DATABASES = {
 #     'default': {
 #         'ENGINE': 'django.db.backends.mysql',
@@ -95,6 +143,147 @@ DATABASES = {
 # }
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.0/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# 多进程部署时使用共享缓存，页面缓存的版本号才能在进程间同步
+# CACHES = {
+#     'default': {
+#         'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+#         'LOCATION': 'redis://127.0.0.1:6379',
+#     }
+# }
+
+# 投票页面缓存：POLLS_CACHE_ALIAS 为使用的缓存，页面按 question 版本号失效，超时时间只是兜底
+POLLS_CACHE_ALIAS = 'default'
+POLLS_PAGE_CACHE_TIMEOUT = 60 * 60
+
+# 首页最新问题列表在进程内维护，每隔 POLLS_FEED_REFRESH_INTERVAL 秒从数据库重新加载一次
+POLLS_FEED_REFRESH_INTERVAL = 60
+
+
+# 投票计数：开启 POLLS_VOTE_BUFFERING 后，投票先在内存中分片计数，累计到 POLLS_VOTE_FLUSH_THRESHOLD 票
+# 或距离上次写入超过 POLLS_VOTE_FLUSH_INTERVAL 秒后再批量写入数据库，适合热点投票；默认每票直接原子自增
+
+POLLS_VOTE_BUFFERING = False
+POLLS_VOTE_SHARDS = 16
+POLLS_VOTE_FLUSH_THRESHOLD = 1000
+POLLS_VOTE_FLUSH_INTERVAL = 1.0
+# 投票接口 /apis/polls/votes 一次最多提交的票数
+POLLS_VOTE_BATCH_SIZE = 1000
+
+# question_text 搜索（见 polls/search.py）：memory 为进程内的倒排索引，fts5 使用 SQLite FTS5 全文索引
+# memory 后端时后台搜索最多返回 POLLS_SEARCH_ADMIN_LIMIT 条（fts5 不限制）
+POLLS_SEARCH_BACKEND = 'memory'
+POLLS_SEARCH_ADMIN_LIMIT = 1000
+# memory：修改日志在缓存中保存的秒数，落后超过 POLLS_SEARCH_LOG_MAX 条时重建索引
+POLLS_SEARCH_LOG_TTL = 24 * 60 * 60
+POLLS_SEARCH_LOG_MAX = 1000
+
+
+# 异步接口的数据库查询在线程池中执行（见 mysite/asyncdb.py）
+# ASYNC_DB_WORKERS 为线程数，也是异步接口最多同时占用的数据库连接数；排队超过 ASYNC_DB_MAX_PENDING 个时返回 503
+# 单次查询超过 ASYNC_DB_TIMEOUT 秒返回 504
+ASYNC_DB_WORKERS = 8
+ASYNC_DB_MAX_PENDING = 1000
+ASYNC_DB_TIMEOUT = 10
+
+
+# 后台任务队列（见 mysite/tasks.py）：concurrency 为同时执行的任务数，排队 + 执行中的任务超过 max_pending 时拒绝提交
+# 进程退出或 ASGI lifespan shutdown 时最多等待 BACKGROUND_TASK_DRAIN_TIMEOUT 秒
+BACKGROUND_TASK_QUEUES = {
+    'default': {'concurrency': 10, 'max_pending': 1000},
+    'mail': {'concurrency': 2, 'max_pending': 1000},
+    'search': {'concurrency': 4, 'max_pending': 10000},
+}
+BACKGROUND_TASK_DRAIN_TIMEOUT = 30
+
+
+# API 密钥校验结果的进程内缓存（见 ninjademo/apikeys.py）：最多缓存 API_KEY_CACHE_SIZE 个，
+# 有效的密钥缓存 API_KEY_CACHE_TTL 秒，无效的缓存 API_KEY_NEGATIVE_TTL 秒；吊销密钥的通知通过 API_KEY_CACHE_ALIAS 缓存传递
+API_KEY_CACHE_ALIAS = 'default'
+API_KEY_CACHE_SIZE = 10000
+API_KEY_CACHE_TTL = 5 * 60
+API_KEY_NEGATIVE_TTL = 30
+
+
+# session 引擎（见 mysite/sessions）：SESSION_ENGINE 为默认引擎（后台、投票页面），SESSION_ENGINES 按路径前缀选择引擎
+# mysite.sessions.local：cached_db 前面加一层进程内缓存，和默认引擎共用数据库中的 session，后台登录后也可以访问 /api/
+# mysite.sessions.signed：session 保存在签名的 cookie（SIGNED_SESSION_COOKIE_NAME）中，服务端只保存吊销列表，
+#   需要通过使用该引擎的接口登录，例如 SESSION_ENGINES = {'/api/': 'mysite.sessions.local', '/apis/': 'mysite.sessions.signed'}
+SESSION_ENGINE = 'django.contrib.sessions.backends.db'
+SESSION_ENGINES = {
+    '/api/': 'mysite.sessions.local',
+}
+SESSION_LOCAL_CACHE_SIZE = 10000
+SESSION_LOCAL_CACHE_TTL = 60
+SIGNED_SESSION_COOKIE_NAME = 'ssessionid'
+
+# request.user 在进程内缓存，用户修改或删除后失效
+# ModelBackend 保留在后面：之前登录的 session 中保存的是它的路径，去掉后这些用户都会被登出；
+# 重新登录后使用 CachedModelBackend（登录失败时 ModelBackend 会再校验一次密码）
+AUTHENTICATION_BACKENDS = [
+    'mysite.sessions.users.CachedModelBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+USER_LOCAL_CACHE_SIZE = 10000
+USER_LOCAL_CACHE_TTL = 60
+
+
+# 上传的文件保存在 MEDIA_ROOT；FILE_UPLOAD_TEMP_DIR 和 MEDIA_ROOT 在同一个文件系统时，保存文件只需要移动临时文件
+MEDIA_ROOT = BASE_DIR / 'media'
+MEDIA_URL = 'media/'
+FILE_UPLOAD_TEMP_DIR = None
+
+# 大文件上传（见 mysite/uploads.py）：单个文件和整个请求的大小上限，每次读取 UPLOAD_CHUNK_SIZE 字节，
+# 多个文件最多 UPLOAD_PARALLELISM 个同时保存
+STREAMING_UPLOAD_PATHS = ['/api/upload']
+UPLOAD_MAX_FILE_SIZE = 5 * 1024 ** 3
+UPLOAD_MAX_REQUEST_SIZE = 10 * 1024 ** 3
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+UPLOAD_PARALLELISM = 4
+
+# 下载（见 mysite/downloads.py）：服务器不支持 sendfile 时，每次从 mmap 中读取 DOWNLOAD_BLOCK_SIZE 字节
+DOWNLOAD_BLOCK_SIZE = 256 * 1024
+
+# 请求级别的性能统计（见 mysite/profiling.py）：每个视图/接口的查询数、数据库时间、重复查询、序列化时间、响应大小，
+# 响应头中返回 Server-Timing；关闭时中间件不加载，没有额外开销
+# 最近 PROFILING_WINDOW 秒的统计每隔 PROFILING_SNAPSHOT_INTERVAL 秒写入 PROFILING_SNAPSHOT_DIR，
+# python manage.py profile_report 查看最慢的接口
+PROFILING_ENABLED = DEBUG
+PROFILING_WINDOW = 5 * 60
+PROFILING_SNAPSHOT_INTERVAL = 5
+PROFILING_SNAPSHOT_DIR = os.path.join(tempfile.gettempdir(), 'mysite-profiling')
+
+# 限流和过载保护（见 mysite/ratelimit.py）：计数保存在 RATELIMIT_CACHE 缓存中，None 为进程内的令牌桶（最多 RATELIMIT_LOCAL_SIZE 个客户端），
+# 多进程部署时设置为共享缓存的别名（固定窗口计数）；API 同时处理的请求超过 RATELIMIT_MAX_CONCURRENT 时返回 503，客户端 RATELIMIT_RETRY_AFTER 秒后重试
+RATELIMIT_ENABLED = True
+RATELIMIT_CACHE = None
+RATELIMIT_LOCAL_SIZE = 100000
+RATELIMIT_MAX_CONCURRENT = 32
+RATELIMIT_RETRY_AFTER = 1
+
+# 条件请求（见 mysite/conditional.py）：每张表的版本号和最后修改时间保存在 CONDITIONAL_CACHE_ALIAS 缓存中，多进程部署时使用共享缓存
+CONDITIONAL_CACHE_ALIAS = 'default'
+
+# 响应压缩（见 mysite/compression.py）：COMPRESSION_TYPES 开头的类型、不小于 COMPRESSION_MIN_SIZE 字节的响应才压缩；
+# 动态响应使用较快的级别（bench_compression：5000 个员工的 JSON，gzip 1 节省 85%、3.3ms，gzip 6 节省 88%、10ms），
+# collectstatic 预先压缩的静态文件使用最高级别
+COMPRESSION_MIN_SIZE = 512
+COMPRESSION_GZIP_LEVEL = 1
+COMPRESSION_BROTLI_QUALITY = 4
+COMPRESSION_TYPES = [
+    'text/', 'application/json', 'application/javascript', 'application/xml', 'application/x-ndjson',
+    'image/svg+xml',
+]
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
 
@@ -130,6 +319,10 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/4.0/howto/static-files/
 
 STATIC_URL = 'static/'
+# collectstatic 收集到 STATIC_ROOT，文件名带内容哈希并预先压缩，带哈希的文件缓存 STATIC_MAX_AGE 秒，见 mysite/compression.py
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+STATICFILES_STORAGE = 'mysite.compression.CompressedManifestStaticFilesStorage'
+STATIC_MAX_AGE = 365 * 24 * 60 * 60
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.0/ref/settings/#default-auto-field
@@ -0,0 +1,252 @@
+"""
+进程内的后台任务：发邮件、计数、更新搜索索引等不需要在请求中等待结果的工作
+asyncio.create_task 创建后不保存引用，任务可能在执行中被垃圾回收，也没有并发限制、错误记录，进程退出时直接丢失
+1. 任务在独立线程的事件循环中执行，和处理请求的事件循环无关，WSGI（runserver）下也能使用
+2. 每个队列有并发上限 concurrency，排队 + 执行中的任务超过 max_pending 时 submit 抛出 TaskRejected
+3. 执行中的任务保存在队列的集合中（强引用），结束后移除；异常写入日志 mysite.tasks
+4. 协程函数直接在事件循环中执行，普通函数在线程池中执行（可以使用 ORM）
+5. drain：停止接收新任务，等待已提交的任务执行完，超时后取消；ASGI lifespan shutdown 和进程退出时调用
+6. metrics：每个队列的排队数、执行数、成功/失败/拒绝次数，排队等待时间和执行时间（最近 1000 个任务）
+
+使用：
+    from mysite.tasks import background
+    background.submit('mail', send_mail, subject, message, from_email, [to])
+    background.submit('default', some_coroutine_function, arg)
+"""
+
+import asyncio
+import atexit
+import functools
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+SAMPLES = 1000
+
+
+class TaskRejected(Exception):
+    pass
+
+
+def _call_sync(func, args, kwargs):
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+def _summary(samples):
+    if not samples:
+        return {'avg': 0, 'p95': 0, 'max': 0}
+    ordered = sorted(samples)
+    return {
+        'avg': round(sum(ordered) / len(ordered) * 1000, 3),
+        'p95': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 3),
+        'max': round(ordered[-1] * 1000, 3),
+    }
+
+
+class TaskQueue:
+
+    def __init__(self, name, concurrency=10, max_pending=1000):
+        self.name = name
+        self.concurrency = concurrency
+        self.max_pending = max_pending
+        self.tasks = set()  # 已开始调度的 asyncio.Task，保持强引用
+        self.waiting = 0
+        self.running = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self._semaphore = None
+        self._wait_times = deque(maxlen=SAMPLES)
+        self._run_times = deque(maxlen=SAMPLES)
+
+    def _reserve(self):
+        with self._lock:
+            if self.waiting + self.running >= self.max_pending:
+                self.rejected += 1
+                raise TaskRejected(f'queue {self.name!r} is full ({self.max_pending} tasks pending)')
+            self.waiting += 1
+            self.submitted += 1
+
+    def _release(self):
+        with self._lock:
+            self.waiting -= 1
+            self.submitted -= 1
+            self.rejected += 1
+
+    async def _run(self, executor, func, args, kwargs, submitted_at):
+        task = asyncio.current_task()
+        self.tasks.add(task)
+        started = None
+        try:
+            async with self._semaphore:
+                started = time.monotonic()
+                self._wait_times.append(started - submitted_at)
+                with self._lock:
+                    self.waiting -= 1
+                    self.running += 1
+                if asyncio.iscoroutinefunction(func):
+                    result = await func(*args, **kwargs)
+                else:
+                    loop = asyncio.get_running_loop()
+                    result = await loop.run_in_executor(executor, functools.partial(_call_sync, func, args, kwargs))
+        except BaseException as e:
+            with self._lock:
+                if started is None:
+                    self.waiting -= 1
+                self.failed += 1
+            if not isinstance(e, asyncio.CancelledError):
+                logger.exception('background task %r failed in queue %r', func, self.name)
+            raise
+        else:
+            with self._lock:
+                self.completed += 1
+            return result
+        finally:
+            self.tasks.discard(task)
+            if started is not None:
+                self._run_times.append(time.monotonic() - started)
+                with self._lock:
+                    self.running -= 1
+
+    def metrics(self):
+        with self._lock:
+            data = {
+                'waiting': self.waiting,
+                'running': self.running,
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'failed': self.failed,
+                'rejected': self.rejected,
+            }
+        data['wait_ms'] = _summary(list(self._wait_times))
+        data['run_ms'] = _summary(list(self._run_times))
+        return data
+
+
+class TaskRunner:
+
+    def __init__(self, queues, drain_timeout=30):
+        self.queues = {name: TaskQueue(name, **options) for name, options in queues.items()}
+        self.drain_timeout = drain_timeout
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._executor = None
+        self._closed = False
+
+    def start(self):
+        with self._lock:
+            if self._loop is not None:
+                return
+            self._closed = False
+            self._loop = asyncio.new_event_loop()
+            self._executor = ThreadPoolExecutor(
+                sum(queue.concurrency for queue in self.queues.values()), thread_name_prefix='tasks')
+            for queue in self.queues.values():
+                queue._semaphore = asyncio.Semaphore(queue.concurrency)
+            self._thread = threading.Thread(target=self._loop.run_forever, name='tasks', daemon=True)
+            self._thread.start()
+
+    def submit(self, queue_name, func, *args, **kwargs):
+        """
+        提交任务，返回 concurrent.futures.Future，可以不保存
+        """
+        queue = self.queues[queue_name]
+        if not self._closed:
+            self.start()
+        with self._lock:
+            if self._closed or self._loop is None:
+                raise TaskRejected('task runner is shutting down')
+            queue._reserve()
+            loop, executor = self._loop, self._executor
+        coro = queue._run(executor, func, args, kwargs, time.monotonic())
+        try:
+            return asyncio.run_coroutine_threadsafe(coro, loop)
+        except RuntimeError:
+            coro.close()
+            queue._release()
+            raise TaskRejected('task runner is shutting down') from None
+
+    async def _drain(self, timeout):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            # 让刚提交、还没开始调度的任务先进入 tasks
+            await asyncio.sleep(0)
+            if not any(queue.waiting or queue.running for queue in self.queues.values()):
+                return True
+            tasks = set().union(*(queue.tasks for queue in self.queues.values()))
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                logger.warning('cancelling %d background tasks that did not finish in %ss', len(tasks), timeout)
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                return False
+            if tasks:
+                await asyncio.wait(tasks, timeout=remaining)
+            else:
+                await asyncio.sleep(0.01)
+
+    def drain(self, timeout=None):
+        """
+        停止接收新任务，等待已提交的任务执行完，返回是否全部完成；之后可以再次 start
+        """
+        with self._lock:
+            if self._closed or self._loop is None:
+                return True
+            self._closed = True
+            loop, thread, executor = self._loop, self._thread, self._executor
+        timeout = self.drain_timeout if timeout is None else timeout
+        try:
+            return asyncio.run_coroutine_threadsafe(self._drain(timeout), loop).result()
+        finally:
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
+            executor.shutdown(wait=False)
+            with self._lock:
+                self._loop = self._thread = self._executor = None
+
+    async def adrain(self, timeout=None):
+        return await asyncio.get_running_loop().run_in_executor(None, self.drain, timeout)
+
+    def metrics(self):
+        return {name: queue.metrics() for name, queue in self.queues.items()}
+
+
+background = TaskRunner(settings.BACKGROUND_TASK_QUEUES, drain_timeout=settings.BACKGROUND_TASK_DRAIN_TIMEOUT)
+atexit.register(background.drain)
+
+
+def with_lifespan(app, runner=background):
+    """
+    处理 ASGI lifespan：启动时开始执行后台任务，关闭时等待后台任务执行完；其它请求交给 app
+    """
+
+    async def application(scope, receive, send):
+        if scope['type'] != 'lifespan':
+            return await app(scope, receive, send)
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                runner.start()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await runner.adrain()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    return application
@@ -0,0 +1,112 @@
+"""
+大文件上传
+django 默认的上传处理：小于 2.5M 的文件放在内存中，大文件写入临时文件；接口中再 file.read() 就会把整个文件读进内存
+1. StreamingUploadHandler：每收到一块（UPLOAD_CHUNK_SIZE）就写入临时文件，同时累计大小和 sha256，内存占用与文件大小无关
+2. 请求体超过 UPLOAD_MAX_REQUEST_SIZE（Content-Length 或实际收到的字节数）、单个文件超过 UPLOAD_MAX_FILE_SIZE 时
+   立即停止接收并抛出 UploadTooLarge，返回 413，已写入的临时文件删除
+3. StreamingUploadMiddleware：STREAMING_UPLOAD_PATHS 中的路径使用上面的处理器
+4. store_uploads：把上传的文件保存到 default_storage，多个文件在固定大小的线程池中并行保存（UPLOAD_PARALLELISM），
+   FileSystemStorage 保存时直接移动临时文件（FILE_UPLOAD_TEMP_DIR 和 MEDIA_ROOT 在同一个文件系统时不复制）
+
+使用：
+    @api.post('/upload')
+    def upload(request, file: UploadedFile = File(...)):
+        return store_uploads([file])[0]
+"""
+
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.http import JsonResponse
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class StreamingUploadHandler(TemporaryFileUploadHandler):
+
+    def __init__(self, request=None, max_file_size=None, max_request_size=None, chunk_size=None):
+        super().__init__(request)
+        self.max_file_size = settings.UPLOAD_MAX_FILE_SIZE if max_file_size is None else max_file_size
+        self.max_request_size = settings.UPLOAD_MAX_REQUEST_SIZE if max_request_size is None else max_request_size
+        self.chunk_size = chunk_size or settings.UPLOAD_CHUNK_SIZE
+        self.received = 0
+        self.completed = []
+
+    def _abort(self, message):
+        for file in self.completed + ([self.file] if hasattr(self, 'file') else []):
+            file.close()
+        raise UploadTooLarge(message)
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        # 还没开始读取请求体，Content-Length 超出时直接拒绝
+        if content_length > self.max_request_size:
+            raise UploadTooLarge(f'request body exceeds {self.max_request_size} bytes')
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.size = 0
+        self.hasher = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.size += len(raw_data)
+        self.received += len(raw_data)
+        if self.size > self.max_file_size:
+            self._abort(f'{self.file_name} exceeds {self.max_file_size} bytes')
+        if self.received > self.max_request_size:
+            self._abort(f'request body exceeds {self.max_request_size} bytes')
+        self.hasher.update(raw_data)
+        self.file.write(raw_data)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        file.sha256 = self.hasher.hexdigest()
+        self.completed.append(file)
+        return file
+
+
+class StreamingUploadMiddleware:
+    """
+    放在 CsrfViewMiddleware 前面，读取 request.POST/FILES 之前设置上传处理器
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.paths = tuple(settings.STREAMING_UPLOAD_PATHS)
+
+    def __call__(self, request):
+        if request.path_info.startswith(self.paths):
+            request.upload_handlers = [StreamingUploadHandler(request)]
+        return self.get_response(request)
+
+    def process_exception(self, request, exception):
+        if isinstance(exception, UploadTooLarge):
+            return JsonResponse({"detail": str(exception)}, status=413)
+
+
+# 所有请求共用，同时保存的文件数不超过 UPLOAD_PARALLELISM
+_executor = ThreadPoolExecutor(settings.UPLOAD_PARALLELISM, thread_name_prefix='uploads')
+
+
+def _store(file, directory):
+    name = default_storage.save(os.path.join(directory, os.path.basename(file.name)), file)
+    return {
+        "name": file.name,
+        "len": file.size,
+        "sha256": getattr(file, 'sha256', None),
+        "path": name,
+    }
+
+
+def store_uploads(files, directory='uploads'):
+    """
+    保存上传的文件，返回每个文件的 name、len、sha256、path，顺序和 files 一致
+    """
+    if len(files) == 1:
+        return [_store(files[0], directory)]
+    return list(_executor.map(lambda file: _store(file, directory), files))
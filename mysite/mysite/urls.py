@@ -13,17 +13,26 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from ninjademo.api import api
 from .apis import apis
+from .compression import serve_static
+from .profiling import profile_api
+from .ratelimit import protect_api
 
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('polls/', include('polls.urls')),
-    path('api/', api.urls),
-    path('apis/', apis.urls)
+    # profile_api：按接口统计查询数和序列化时间，见 mysite/profiling.py
+    # protect_api：同时处理的请求数超过上限时直接返回 503，见 mysite/ratelimit.py
+    path('api/', protect_api(profile_api(api)).urls),
+    path('apis/', protect_api(profile_api(apis)).urls),
+    # collectstatic 之后的静态文件，优先返回预先压缩的 .br/.gz，见 mysite/compression.py
+    # DEBUG 时 runserver 在这之前直接从各应用的 static 目录返回
+    re_path(rf'^{settings.STATIC_URL.strip("/")}/(?P<path>.+)$', serve_static),
 ]
 
 # path('apis/', apis.urls)，通过 apps 实现多个应用共用一个 NinjaAPI 总路由
\ No newline at end of file
@@ -1,13 +1,20 @@
 from ninja import Router
 
+from mysite.conditional import conditional
+
 router = Router()
 
+# 数据写在代码里：@conditional 按 VERSION 生成 ETag，修改数据时把 VERSION 加一
+VERSION = 1
+
 
 @router.get('/blogs')
+@conditional(version=VERSION)
 def list_blogs(request):
     return {"blog_id": 1, "blog_title": "title1"}
 
 
 @router.get('/blogs/{blog_id}')
+@conditional(version=VERSION)
 def blog(request, blog_id):
     return {"blog_id": blog_id, "blog_title": "title1"}
\ No newline at end of file
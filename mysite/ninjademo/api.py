@@ -3,17 +3,27 @@ import random
 from datetime import date
 from typing import List, Generic, TypeVar, Optional
 
+from django.core.files.storage import default_storage
 from django.shortcuts import get_object_or_404
 from django.urls import reverse_lazy
 from pydantic import Field
 from pydantic.fields import ModelField
 
 from django.contrib.auth.models import User, Group
-from ninja import NinjaAPI, Schema, Path, Query, Form, File, ModelSchema, Router
+from ninja import Schema, Path, Query, Form, File, ModelSchema, Router
 from ninja.files import UploadedFile
 from ninja.responses import codes_4xx
 from ninja.security import django_auth, HttpBearer, HttpBasicAuth, APIKeyQuery, APIKeyHeader, APIKeyCookie
 
+from mysite.renderers import NinjaAPI, json_dumps
+from mysite.search import SearchIndex
+from mysite.security import composite_auth
+from mysite.downloads import serve_file
+from mysite.ratelimit import Overloaded, RateLimited, rate_limit, throttled_response
+from mysite.conditional import bump_version, conditional
+from mysite.uploads import store_uploads
+from mysite.serializers import trusted_output
+
 
 """
 Ninja 可定义请求解析器，比如：YAML XML CSV 更快的 JSON 解析
@@ -143,6 +153,9 @@ from ninja.renderers import BaseRenderer
 # api = NinjaAPI(renderer=XMLRenderer())
 
 
+# 上面的 ORJSONParser、ORJSONRenderer、XMLRenderer 已在 mysite/renderers.py 中实现：
+# 安装了 orjson 时使用 orjson，否则使用标准库 json；根据 Accept 返回 JSON、msgpack 或 XML
+# 这里的 NinjaAPI 来自 mysite.renderers，默认使用这些解析器和渲染器
 api = NinjaAPI(auth=django_auth, csrf=True)
 
 
@@ -227,6 +240,9 @@ ninja 使用查询参数，如果参数没有声明类型，ninja 会默认为 s
 """
 
 weapons = ["Ninjato", "Shuriken", "Katana", "Kama", "Kunai", "Naginata", "Yari"]
+# 按 n-gram 建立倒排索引，搜索时不用逐个比较，见 mysite/search.py；修改 weapons 后调用 add/remove 更新
+weapons_index = SearchIndex()
+weapons_index.add_many(enumerate(weapons))
 
 
 @api.get('/weapons')
@@ -236,9 +252,11 @@ def list_weapons(request, limit: int = 10, offset: int = 0):
 
 @api.get('weapons/search')
 def weapons_search(request, q: str, offset: int = 0):
-    results = [w for w in weapons if q in w.lower()]
-    print(q, results)
-    return results[offset: offset + 10]
+    if not q:
+        # 空字符串是所有名称的子串，和原来逐个比较一样返回全部
+        return weapons[offset: offset + 10]
+    _, ids = weapons_index.search(q, offset, 10)
+    return [weapons[i] for i in ids]
 
 
 @api.get('/example')
@@ -251,11 +269,37 @@ class Filters(Schema):
     offset: int = None
     query: str = None
     category__in: List[str] = Field(None, alias='categories')
+    order: str = None
+    cursor: str = None
+
+
+"""
+Filters 编译成员工查询，见 mysite/filters.py
+1. query 为姓氏前缀，categories 为部门名称，都有索引
+2. limit 最大 100，order 只能是 id、last_name、department（前面加 - 倒序），其它参数或排序返回 400
+3. 响应中的 next_cursor 作为下一页的 cursor 参数；offset 很大时自动改为 keyset 分页
+"""
+
+from mysite.filters import FilterError, FilterSet
+from .models import Employee
+
+employee_filters = FilterSet(
+    Employee,
+    fields={'query': 'last_name__startswith', 'category__in': 'department__title__in'},
+    orderings=['id', 'last_name', 'department'],
+    max_limit=100,
+)
+
+
+@api.exception_handler(FilterError)
+def filter_error(request, exc):
+    return api.create_response(request, {"detail": str(exc)}, status=400)
 
 
 @api.get('/filter')
 def filters(request, filters: Filters = Query(...)):
-    return {"filter": filters.dict()}
+    employees = Employee.objects.values('id', 'first_name', 'last_name', 'department_id', 'brithdate')
+    return {"filter": filters.dict(), **employee_filters.paginate(employees, filters.dict())}
 
 
 """
@@ -356,15 +400,22 @@ ninja 实现文件/图片上传
 """
 
 
+# 不要 file.read()：会把整个文件读进内存
+# 上传时已经边接收边写入临时文件并计算了大小和 sha256，超出大小限制返回 413，见 mysite/uploads.py
 @api.post('/upload')
 def upload(request, file: UploadedFile = File(...)):
-    data = file.read()
-    return {"name": file.name, "len": len(data)}
+    return store_uploads([file])[0]
 
 
 @api.post('/uploadmulti')
 def upload_multi(request, file: List[UploadedFile] = File(...)):
-    return [f.name for f in file]
+    return store_uploads(file)
+
+
+# 下载上传的文件，name 为上传接口返回的 path；支持 Range 断点续传和 ETag，见 mysite/downloads.py
+@api.api_operation(['GET', 'HEAD'], '/download/{path:name}')
+def download(request, name: str, attachment: bool = False):
+    return serve_file(request, default_storage.path(name), as_attachment=attachment)
 
 
 """
@@ -435,6 +486,14 @@ ninja 实现增删改查功能
 django models：Departmen, Employee
 """
 
+import itertools
+
+from django.db import transaction
+from django.http import StreamingHttpResponse
+
+from mysite.asyncdb import DatabaseBusy, QueryTimeout, read_ahead
+
+from .apikeys import api_keys
 from .models import Employee, Department
 
 
@@ -468,19 +527,101 @@ def create_employee(request, payload: EmployeeIn):
 
 
 # 查询结果，empolyee 数据，返回单个
-@api.post('/employee/{employee_id}', response=EmployeeOut)
+# @trusted_output：返回的是数据库中的数据，不需要 pydantic 逐个字段校验，使用预先生成的序列化函数，见 mysite/serializers.py
+# @conditional：GET 时带上 ETag，员工表没有修改时返回 304，不查询数据库，见 mysite/conditional.py；POST 保留兼容原来的调用
+@api.api_operation(['GET', 'POST'], '/employee/{employee_id}', response=EmployeeOut)
+@conditional(Employee)
+@trusted_output
 def get_employee(request, employee_id: int):
     employee = get_object_or_404(Employee, id=employee_id)
     return employee
 
 
 # 返回全部
-@api.post('/employees', response=List[EmployeeOut])
+@api.api_operation(['GET', 'POST'], '/employees', response=List[EmployeeOut])
+@conditional(Employee)
+@trusted_output
 def get_employees(request):
     employees = Employee.objects.all()
     return employees
 
 
+"""
+员工数据量很大时，一次返回全部会把所有行加载到内存、逐个创建 pydantic 对象，再序列化成一个很大的 JSON
+1. 游标分页（keyset）：按 id 排序，返回 id > cursor 的 limit 条，下一页的 cursor 为本页最后一条的 id，
+   不使用 OFFSET，翻到多后面都只需要走主键索引
+2. 流式返回：使用 .values() + .iterator(chunk_size) 分批从数据库读取，每批序列化后立即发送，
+   内存占用和首字节时间都不随数据量增长；format=ndjson 每行一个 JSON 对象，format=json 为一个 JSON 数组
+"""
+
+EMPLOYEE_FIELDS = ['id', 'first_name', 'last_name', 'department_id', 'brithdate']
+
+
+class EmployeePage(Schema):
+    items: List[EmployeeOut]
+    next_cursor: int = None
+
+
+@api.get('/employees/page', response=EmployeePage)
+@conditional(Employee)
+def get_employees_page(request, cursor: int = 0, limit: int = Query(100, ge=1, le=1000)):
+    items = list(Employee.objects.filter(id__gt=cursor).order_by('id').values(*EMPLOYEE_FIELDS)[:limit])
+    next_cursor = items[-1]['id'] if len(items) == limit else None
+    return {"items": items, "next_cursor": next_cursor}
+
+
+def stream_json_rows(rows, fmt, chunk_size):
+    # 每 chunk_size 行拼接成一段发送，减少小块写入的次数
+    if fmt == 'json':
+        yield b'['
+    first = True
+    try:
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if not chunk:
+                break
+            if fmt == 'json':
+                yield (b'' if first else b',') + b','.join(json_dumps(row) for row in chunk)
+            else:
+                yield b''.join(json_dumps(row) + b'\n' for row in chunk)
+            first = False
+    except (DatabaseBusy, QueryTimeout) as e:
+        # 200 已经发出，不能再改成错误响应：ndjson 最后一行是错误信息，json 不输出结尾的 ]，客户端解析时就会出错
+        if fmt == 'ndjson':
+            yield json_dumps({"error": str(e)}) + b'\n'
+        return
+    if fmt == 'json':
+        yield b']'
+
+
+STREAM_CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'json': 'application/json',
+}
+
+
+def employee_rows(chunk_size):
+    """
+    按 id 分块读取，每块一条查询（id > 上一块最后的 id），不用在整个响应期间占着一个数据库游标；
+    第一块在视图中查询，出错时还能返回错误状态码，之后的块由 read_ahead 读取（ASGI 下在线程池中提前查询）
+    """
+    queryset = Employee.objects.order_by('id').values(*EMPLOYEE_FIELDS)
+
+    def next_chunk(chunk):
+        if len(chunk) < chunk_size:
+            return []
+        return list(queryset.filter(id__gt=chunk[-1]['id'])[:chunk_size])
+
+    return itertools.chain.from_iterable(read_ahead(list(queryset[:chunk_size]), next_chunk))
+
+
+@api.get('/employees/stream')
+def stream_employees(request, format: str = Query('ndjson', regex='^(ndjson|json)$'),
+                     chunk_size: int = Query(2000, ge=1, le=10000)):
+    rows = employee_rows(chunk_size)
+    return StreamingHttpResponse(stream_json_rows(rows, format, chunk_size), content_type=STREAM_CONTENT_TYPES[format])
+
+
 # 更新接口，employee 数据
 @api.put('/employeeupdate/{employee_id}')
 def update_employee(request, employee_id: int, payload: EmployeeIn):
@@ -500,6 +641,108 @@ def delete_employee(request, employee_id: int):
     return {"success": True}
 
 
+"""
+批量接口：一次请求处理多条数据，替代大量单条的创建/更新/删除请求
+1. 每个接口只查询一次需要校验的数据（部门、员工），在一个事务内使用 bulk_create、bulk_update、filter().delete() 批量写入
+2. bulk_update 只更新有变化的字段，没有变化的员工不会写入
+3. 某一条数据有问题时不影响其它数据，在 errors 中返回出错数据的下标 index 和原因
+"""
+
+
+class EmployeeBulkUpdate(EmployeeIn):
+    id: int
+
+
+class BulkError(Schema):
+    index: int
+    error: str
+
+
+class BulkResult(Schema):
+    ids: List[int] = []
+    errors: List[BulkError] = []
+
+
+BULK_BATCH_SIZE = 500
+
+
+def existing_department_ids(payload):
+    department_ids = {item.department_id for item in payload if item.department_id is not None}
+    return set(Department.objects.filter(id__in=department_ids).values_list('id', flat=True))
+
+
+def check_department(item, department_ids):
+    if item.department_id is None:
+        return 'department_id is required'
+    if item.department_id not in department_ids:
+        return f'Department {item.department_id} does not exist'
+    return None
+
+
+@api.post('/departments/bulk', response=BulkResult)
+def bulk_create_departments(request, titles: List[str]):
+    with transaction.atomic():
+        departments = Department.objects.bulk_create(
+            [Department(title=title) for title in titles], batch_size=BULK_BATCH_SIZE
+        )
+        # bulk_create、bulk_update 不发送 post_save，条件请求的版本号手动加一
+        bump_version(Department)
+    return {"ids": [department.id for department in departments]}
+
+
+@api.post('/employees/bulk', response=BulkResult)
+def bulk_create_employees(request, payload: List[EmployeeIn]):
+    department_ids = existing_department_ids(payload)
+    employees, errors = [], []
+    for index, item in enumerate(payload):
+        error = check_department(item, department_ids)
+        if error:
+            errors.append({"index": index, "error": error})
+        else:
+            employees.append(Employee(**item.dict()))
+    with transaction.atomic():
+        employees = Employee.objects.bulk_create(employees, batch_size=BULK_BATCH_SIZE)
+        bump_version(Employee)
+    return {"ids": [employee.id for employee in employees], "errors": errors}
+
+
+@api.put('/employees/bulk', response=BulkResult)
+def bulk_update_employees(request, payload: List[EmployeeBulkUpdate]):
+    department_ids = existing_department_ids(payload)
+    employees = Employee.objects.in_bulk([item.id for item in payload])
+    changed, fields, errors = {}, set(), []
+    for index, item in enumerate(payload):
+        employee = employees.get(item.id)
+        error = check_department(item, department_ids)
+        if employee is None:
+            error = f'Employee {item.id} does not exist'
+        if error:
+            errors.append({"index": index, "error": error})
+            continue
+        for attr, value in item.dict(exclude={'id'}).items():
+            if getattr(employee, attr) != value:
+                setattr(employee, attr, value)
+                fields.add(attr)
+                changed[employee.id] = employee
+    if changed:
+        with transaction.atomic():
+            Employee.objects.bulk_update(changed.values(), sorted(fields), batch_size=BULK_BATCH_SIZE)
+            bump_version(Employee)
+    return {"ids": list(changed), "errors": errors}
+
+
+@api.delete('/employees/bulk', response=BulkResult)
+def bulk_delete_employees(request, ids: List[int]):
+    with transaction.atomic():
+        existing = set(Employee.objects.filter(id__in=ids).values_list('id', flat=True))
+        Employee.objects.filter(id__in=existing).delete()
+    errors = [
+        {"index": index, "error": f'Employee {employee_id} does not exist'}
+        for index, employee_id in enumerate(ids) if employee_id not in existing
+    ]
+    return {"ids": sorted(existing), "errors": errors}
+
+
 """
 ninja 可提供继承 django 模型的 Schema 定义方式
 1. 使用 ModelSchema，来定义 User Schema
@@ -566,16 +809,16 @@ def pets(request):
 
 
 # 基于 http 参数认证
+# token、api_key 都是 ninjademo/apikeys.py 中保存的 API 密钥，校验结果有缓存，正常情况下认证不查询数据库
 class AuthBearer(HttpBearer):
     def authenticate(self, request, token: str):
-        if token == 'supersecret':
-            return token
+        return api_keys.verify(token)
 
 
 # 单个 NinjaAPI，基于 HTTP 请求参数的认证
 @api.get('/bearer', auth=AuthBearer())
 def bearer(request):
-    return {"token": request.auth}
+    return {"token": request.auth.name}
 
 
 # 基于 htt 基本身份认证
@@ -608,19 +851,14 @@ def ipwhitelist(request):
 # 作为 cookie 携带：GET /something HTTP/1.1， Cookie: X-API-KEY=abcdef12345
 
 
-# 在 query 中携带：
-Model_Client = {"ninja": "ninja"}
-
-
+# 在 query 中携带：返回密钥的 id
 class ApiKeyQuery(APIKeyQuery):
     param_name = 'api_key'
 
     def authenticate(self, request, key):
-        try:
-            print(Model_Client[key])
-            return Model_Client[key]
-        except KeyError:
-            pass
+        api_key = api_keys.verify(key)
+        if api_key is not None:
+            return api_key.id
 
 
 api_key_query = ApiKeyQuery()
@@ -628,7 +866,6 @@ api_key_query = ApiKeyQuery()
 
 @api.get('/apikeyquery', auth=api_key_query)
 def apikeyquery(request):
-    print(request.auth)
     assert isinstance(request.auth, int)
     return f"Hello {request.auth}"
 
@@ -638,8 +875,7 @@ class ApiKeyHeader(APIKeyHeader):
     param_name = 'X-API-Key'
 
     def authenticate(self, request, key):
-        if key == 'supersecret':
-            return key
+        return api_keys.verify(key)
 
 
 api_key_header = ApiKeyHeader()
@@ -647,15 +883,14 @@ api_key_header = ApiKeyHeader()
 
 @api.get('/apikeyheader', auth=api_key_header)
 def apikeyheader(request):
-    return f"Token = {request.auth}"
+    return f"Token = {request.auth.name}"
 
 
 # 在 cookie 中携带
 class ApiKeyCookie(APIKeyCookie):
 
     def authenticate(self, request, key):
-        if key == 'supersecret':
-            return key
+        return api_keys.verify(key)
 
 
 api_key_cookie = ApiKeyCookie()
@@ -663,7 +898,7 @@ api_key_cookie = ApiKeyCookie()
 
 @api.get('/apikeycookie', auth=api_key_cookie)
 def apikeycookie(request):
-    return f"Cookie = {request.auth}"
+    return f"Cookie = {request.auth.name}"
 
 
 # 同时设置多个身份认证器，只要其中一个认证通过即可，按顺序校验
@@ -671,8 +906,7 @@ def apikeycookie(request):
 class AuthCheck:
 
     def authenticate(self, request, key):
-        if key == 'supersecret':
-            return key
+        return api_keys.verify(key)
 
 
 class QueryKey(AuthCheck, APIKeyQuery):
@@ -683,9 +917,18 @@ class HeaderKey(AuthCheck, APIKeyHeader):
     pass
 
 
+# @composite_auth：每个请求只解析一次凭证，成功次数多的认证器排到前面，见 mysite/security.py
 @api.get('/multipleauth', auth=[QueryKey(), HeaderKey()])
+@composite_auth
 def multiple_auth(request):
-    return f"Token = {request.auth}"
+    return f"Token = {request.auth.name}"
+
+
+# 各认证器的命中次数和耗时
+@api.get('/multipleauth/stats')
+def multiple_auth_stats(request):
+    composite = getattr(multiple_auth, 'composite_auth', None)
+    return composite.stats() if composite is not None else []
 
 
 # 路由认证/标签：可以通过请求的路由设置 auth 认证
@@ -709,14 +952,15 @@ def on_invalid_token(request, exc):
 class AuthBearer1(HttpBearer):
 
     def authenticate(self, request, token):
-        if token == 'supersecret':
-            return token
+        api_key = api_keys.verify(token)
+        if api_key is not None:
+            return api_key
         raise InvalidToken
 
 
 @api.get('/bearer1', auth=AuthBearer1())
 def bearer1(request):
-    return {"token": request.auth}
+    return {"token": request.auth.name}
 
 
 """
@@ -832,17 +1076,16 @@ Ninja 处理程序异常
 
 
 # 自定义异常
-class ServiceUnavailableError(Exception):
-    pass
+# 限流（429）、过载（503）的异常也在这里处理，响应带 Retry-After，见 mysite/ratelimit.py
+class ServiceUnavailableError(Overloaded):
+
+    def __init__(self, message='', retry_after=1):
+        super().__init__(retry_after, message)
 
 
-@api.exception_handler(ServiceUnavailableError)
+@api.exception_handler(RateLimited)
 def service_unavailable(request, exc):
-    return api.create_response(
-        request,
-        {"message": "Please retry late","error": str(exc)},
-        status=503
-    )
+    return throttled_response(api, request, exc)
 
 
 @api.get('/exc')
@@ -859,7 +1102,7 @@ from django.http import HttpResponse
 
 @api.exception_handler(ValidationError)
 def validation_errors(reqeust, exc):
-    return HttpResponse("Invalid input", status_code=422)
+    return HttpResponse("Invalid input", status=422)
 
 
 # 抛出带有异常的 HTTP 相应
@@ -884,6 +1127,10 @@ import time
 import asyncio
 from elasticsearch import Elasticsearch
 
+from mysite import compression, ratelimit
+from mysite.db.pool import pool_metrics
+from mysite.tasks import TaskRejected, background
+
 
 async def task1(num):
     await asyncio.sleep(1)
@@ -893,22 +1140,54 @@ async def task1(num):
 
 
 # 同步 API
+# 请求执行期间一直占用一个线程：delay 最多 10 秒，每个 IP 每分钟最多 10 次
 @api.get('/sync-say-after', tags=['sync&async'], auth=None)
-def sync_say_after(request, delay: int, word: str):
+@rate_limit('10/m', key='ip')
+def sync_say_after(request, word: str, delay: int = Query(..., ge=0, le=10)):
     time.sleep(delay)
     return {"saying": word}
 
 
 # 异步 API
+# asyncio.create_task(task1(num=delay)) 不保存返回的 task，任务可能执行到一半被垃圾回收，
+# 请求结束后事件循环关闭（runserver 下每个请求一个事件循环）任务也会丢失
+# 改为提交到后台任务队列，见 mysite/tasks.py
 @api.get('/async-say-after', tags=['sync&async'], auth=None)
 async def asnyc_say_after(request, delay: int, word: str):
-    # loop = asyncio.get_event_loop()
-    # loop.create_task(task1(num=delay)) # 写法一
-    asyncio.create_task(task1(num=delay))
+    background.submit('default', task1, num=delay)
     print("------其他立即打印-------")
     return {"saying": word}
 
 
+@api.exception_handler(TaskRejected)
+def task_rejected(request, exc):
+    return api.create_response(request, {"message": "Please retry later", "error": str(exc)}, status=503)
+
+
+# 后台任务队列的排队数、执行数和耗时
+@api.get('/tasks/metrics', tags=['sync&async'])
+def task_metrics(request):
+    return background.metrics()
+
+
+# 数据库连接池的连接数、等待时间等，见 mysite/db/pool.py
+@api.get('/db/metrics', tags=['sync&async'])
+def db_metrics(request):
+    return pool_metrics()
+
+
+# 同时处理的请求数、被拒绝的次数和各个限流的计数，见 mysite/ratelimit.py
+@api.get('/ratelimit/metrics', tags=['sync&async'])
+def ratelimit_metrics(request):
+    return ratelimit.metrics()
+
+
+# 按压缩方式和响应大小统计的压缩率和 CPU 时间，见 mysite/compression.py
+@api.get('/compression/metrics', tags=['sync&async'])
+def compression_metrics(request):
+    return compression.stats.metrics()
+
+
 # es = Elasticsearch()
 #
 #
@@ -923,33 +1202,103 @@ async def asnyc_say_after(request, delay: int, word: str):
 #     return resp["hits"]
 
 
-from asgiref.sync import sync_to_async
-from polls.models import Question
+"""
+异步使用 ORM：Django 4.0 的 ORM 只能同步执行
+原来的写法 sync_to_async(lambda: Question.objects.all()) 返回的是惰性的 queryset，
+在线程里没有真正查询，回到事件循环中再取数据就会抛出 SynchronousOnlyOperation
+mysite/asyncdb.py 在固定大小的线程池中把 queryset 全部取完再返回，并支持超时、取消和排队限制
+"""
 
+from django.db.models import Prefetch
+from django.utils import timezone
 
-@sync_to_async
-def get_questions():
-    return Question.objects.all()
+from mysite.asyncdb import (DatabaseBusy, QueryTimeout, aget_object_or_404, async_auth, database, fetch_all,
+                            fetch_page)
+from polls.models import Question, Choice
+from polls.search import question_search
 
 
-# 没搞懂运行报错
-@api.get("/questions", tags=['sync&async'], auth=None)
-async def search(request):
-    questions = get_questions()
-    print(questions.throw())
-    return {"question": "1"}
+@api.exception_handler(DatabaseBusy)
+def database_busy(request, exc):
+    return api.create_response(request, {"message": "Please retry later", "error": str(exc)}, status=503)
 
 
+@api.exception_handler(QueryTimeout)
+def query_timeout(request, exc):
+    return api.create_response(request, {"message": "Query timeout", "error": str(exc)}, status=504)
 
 
+class ChoiceOut(Schema):
+    id: int
+    choice_text: str
+    votes: int
 
 
+class QuestionOut(Schema):
+    id: int
+    question_text: str
+    pub_date: datetime.datetime
 
 
+class QuestionDetail(QuestionOut):
+    choices: List[ChoiceOut]
 
 
+class QuestionPage(Schema):
+    count: int
+    items: List[QuestionOut]
 
 
+class DepartmentOut(Schema):
+    id: int
+    title: str
 
 
+class DepartmentPage(Schema):
+    count: int
+    items: List[DepartmentOut]
 
+
+def search_page(q, offset, limit):
+    """
+    q 通过 question_search 的索引（fts5 或内存 n-gram 索引）搜索，按相关度排序；
+    去掉还没有发布的 question（通常很少），再按 id 取出这一页
+    """
+    _, ids = question_search.search(q, limit=None)
+    scheduled = set(Question.objects.filter(pub_date__gt=timezone.now()).values_list('pk', flat=True))
+    ids = [pk for pk in ids if pk not in scheduled]
+    page = ids[offset:offset + limit]
+    questions = Question.objects.in_bulk(page)
+    return {'count': len(ids), 'items': [questions[pk] for pk in page if pk in questions]}
+
+
+# 已发布的问题，按发布时间倒序分页；q 按标题搜索，按相关度排序
+@api.get("/questions", response=QuestionPage, tags=['sync&async'], auth=None)
+async def search(request, q: str = None, offset: int = Query(0, ge=0), limit: int = Query(20, ge=1, le=100)):
+    if q:
+        return await database.run(search_page, q, offset, limit)
+    questions = Question.objects.filter(pub_date__lte=timezone.now()).order_by('-pub_date', '-pk')
+    return await fetch_page(questions, offset, limit)
+
+
+@api.get("/questions/{question_id}", response=QuestionDetail, tags=['sync&async'], auth=None)
+async def get_question(request, question_id: int):
+    questions = Question.objects.filter(pub_date__lte=timezone.now()).prefetch_related(
+        Prefetch('choice_set', queryset=Choice.objects.order_by('pk'), to_attr='choices'))
+    return await aget_object_or_404(questions, pk=question_id)
+
+
+# 需要登录的异步接口加上 @async_auth，session 和用户在线程池中加载
+@api.get("/async/departments", response=DepartmentPage, tags=['sync&async'])
+@async_auth
+async def async_departments(request, offset: int = Query(0, ge=0), limit: int = Query(100, ge=1, le=1000)):
+    return await fetch_page(Department.objects.order_by('id'), offset, limit)
+
+
+@api.get("/async/employees", response=EmployeePage, tags=['sync&async'])
+@async_auth
+async def async_employees(request, cursor: int = 0, limit: int = Query(100, ge=1, le=1000)):
+    employees = Employee.objects.filter(id__gt=cursor).order_by('id').values(*EMPLOYEE_FIELDS)[:limit]
+    items = await fetch_all(employees)
+    next_cursor = items[-1]['id'] if len(items) == limit else None
+    return {"items": items, "next_cursor": next_cursor}
@@ -0,0 +1,132 @@
+"""
+API 密钥的保存和校验
+1. 密钥格式为 <prefix>.<secret>，prefix 为 8 位十六进制，用来在数据库中查找；数据库只保存整个密钥的 HMAC-SHA256（以 SECRET_KEY 为密钥），
+   明文只在创建时返回一次
+2. 校验结果缓存在进程内的 LRU 中（按摘要索引，不保存明文）：有效的密钥缓存 API_KEY_CACHE_TTL 秒，
+   无效的密钥缓存 API_KEY_NEGATIVE_TTL 秒，反复使用错误的密钥也不会每次查询数据库
+3. 摘要比较使用 hmac.compare_digest，耗时与内容无关
+4. 密钥修改、吊销、删除时（包括后台修改，见 signals.py）版本号加一，各进程发现版本号变化后清空自己的缓存；
+   版本号保存在 django cache 中，多进程部署时使用 redis/memcached 等共享缓存
+"""
+
+import hashlib
+import hmac
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import IntegrityError, transaction
+
+from .models import APIKey
+
+PREFIX_LENGTH = 8
+GENERATION_KEY = 'ninjademo:apikeys:gen'
+
+
+def hash_key(raw_key):
+    return hmac.new(settings.SECRET_KEY.encode(), raw_key.encode(), hashlib.sha256).hexdigest()
+
+
+class APIKeyStore:
+
+    def __init__(self, cache_size=10000, ttl=300, negative_ttl=30, cache_alias='default'):
+        self.cache_size = cache_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.cache_alias = cache_alias
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()  # 摘要 -> (过期时间, APIKey 或 None)
+        self._generation = None
+
+    def _get_generation(self):
+        cache = caches[self.cache_alias]
+        generation = cache.get(GENERATION_KEY)
+        if generation is None:
+            cache.add(GENERATION_KEY, time.time_ns(), timeout=None)
+            generation = cache.get(GENERATION_KEY)
+        return generation
+
+    def invalidate(self, api_key=None):
+        """
+        api_key 修改后调用：清除本进程中的缓存，并让其它进程的缓存失效
+        """
+        cache = caches[self.cache_alias]
+        try:
+            cache.incr(GENERATION_KEY)
+        except ValueError:
+            cache.add(GENERATION_KEY, time.time_ns(), timeout=None)
+        with self._lock:
+            if api_key is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(api_key.hashed_key, None)
+
+    def create(self, name, user=None):
+        """
+        创建密钥，返回 (APIKey, 明文密钥)
+        """
+        while True:
+            prefix = secrets.token_hex(PREFIX_LENGTH // 2)
+            raw_key = f'{prefix}.{secrets.token_urlsafe(32)}'
+            try:
+                with transaction.atomic():
+                    api_key = APIKey.objects.create(name=name, prefix=prefix, hashed_key=hash_key(raw_key), user=user)
+            except IntegrityError:
+                # prefix 重复，重新生成
+                continue
+            return api_key, raw_key
+
+    def revoke(self, api_key):
+        # 保存后由 signals.py 调用 invalidate
+        api_key.revoked = True
+        api_key.save(update_fields=['revoked'])
+
+    def _lookup(self, prefix, digest):
+        api_key = APIKey.objects.filter(prefix=prefix, revoked=False).select_related('user').first()
+        if api_key is None or not hmac.compare_digest(api_key.hashed_key, digest):
+            return None
+        return api_key
+
+    def verify(self, raw_key):
+        """
+        返回密钥对应的 APIKey，无效或已吊销时返回 None
+        """
+        if not raw_key:
+            return None
+        prefix, dot, _ = raw_key.partition('.')
+        if not dot or len(prefix) != PREFIX_LENGTH:
+            return None
+        digest = hash_key(raw_key)
+        generation = self._get_generation()
+        now = time.monotonic()
+        with self._lock:
+            if generation != self._generation:
+                self._cache.clear()
+                self._generation = generation
+            entry = self._cache.get(digest)
+            if entry is not None and entry[0] > now:
+                self._cache.move_to_end(digest)
+                api_key = entry[1]
+                if api_key is not None and hmac.compare_digest(api_key.hashed_key, digest):
+                    return api_key
+                return None
+        api_key = self._lookup(prefix, digest)
+        with self._lock:
+            if generation == self._generation:
+                ttl = self.ttl if api_key is not None else self.negative_ttl
+                self._cache[digest] = (now + ttl, api_key)
+                self._cache.move_to_end(digest)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return api_key
+
+
+api_keys = APIKeyStore(
+    cache_size=settings.API_KEY_CACHE_SIZE,
+    ttl=settings.API_KEY_CACHE_TTL,
+    negative_ttl=settings.API_KEY_NEGATIVE_TTL,
+    cache_alias=settings.API_KEY_CACHE_ALIAS,
+)
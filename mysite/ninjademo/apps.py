@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class NinjademoConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'ninjademo'
+
+    def ready(self):
+        # 注册 API 密钥的信号，修改后让校验缓存失效
+        from . import signals
@@ -0,0 +1,45 @@
+"""
+管理 API 密钥
+python manage.py apikey create <name> [--user <username>]：创建密钥，明文只显示这一次
+python manage.py apikey revoke <prefix>：吊销密钥
+python manage.py apikey list
+"""
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from ninjademo.apikeys import api_keys
+from ninjademo.models import APIKey
+
+
+class Command(BaseCommand):
+    help = 'Create, revoke or list API keys'
+
+    def add_arguments(self, parser):
+        subparsers = parser.add_subparsers(dest='action', required=True)
+        create = subparsers.add_parser('create')
+        create.add_argument('name')
+        create.add_argument('--user')
+        revoke = subparsers.add_parser('revoke')
+        revoke.add_argument('prefix')
+        subparsers.add_parser('list')
+
+    def handle(self, *args, **options):
+        if options['action'] == 'create':
+            user = None
+            if options['user']:
+                try:
+                    user = User.objects.get(username=options['user'])
+                except User.DoesNotExist:
+                    raise CommandError(f"user {options['user']!r} does not exist")
+            api_key, raw_key = api_keys.create(options['name'], user=user)
+            self.stdout.write(raw_key)
+        elif options['action'] == 'revoke':
+            try:
+                api_key = APIKey.objects.get(prefix=options['prefix'])
+            except APIKey.DoesNotExist:
+                raise CommandError(f"API key {options['prefix']!r} does not exist")
+            api_keys.revoke(api_key)
+        else:
+            for api_key in APIKey.objects.order_by('id'):
+                self.stdout.write(f"{api_key.prefix}  {api_key.name}  {'revoked' if api_key.revoked else 'active'}")
@@ -0,0 +1,83 @@
+"""
+响应压缩的压缩率和 CPU 耗时（见 mysite/compression.py）
+python manage.py bench_compression：不同大小的员工列表 JSON、流式 ndjson（每块 flush）和 polls 的 css，
+分别使用 gzip 1/6/9、brotli 1/4/11（已安装时）压缩，输出压缩后字节数、节省的比例、每个响应的 CPU 时间和吞吐
+"""
+
+import datetime
+import itertools
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from mysite import compression
+from mysite.renderers import json_dumps
+
+
+def employees(count):
+    return [
+        {'id': i, 'first_name': f'first{i % 97}', 'last_name': f'last{i % 1013}', 'department_id': i % 20,
+         'brithdate': (datetime.date(1970, 1, 1) + datetime.timedelta(days=i * 37 % 15000)).isoformat()}
+        for i in range(count)
+    ]
+
+
+def ndjson_chunks(count, chunk_size=2000):
+    rows = iter(employees(count))
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield b''.join(json_dumps(row) + b'\n' for row in chunk)
+
+
+def compress_once(compressor_class, level, payload):
+    compressor = compressor_class(level)
+    if not isinstance(payload, list):
+        return compressor.finish(payload)
+    # 流式响应：每块压缩后 flush
+    chunks = [compressor.compress(chunk) for chunk in payload]
+    chunks.append(compressor.finish())
+    return b''.join(chunks)
+
+
+class Command(BaseCommand):
+    help = 'Benchmark gzip/brotli compression ratio and CPU cost per response size'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='5,50,500,5000,50000', help='employees per JSON payload')
+        parser.add_argument('--budget', type=float, default=0.2, help='seconds spent per payload and level')
+
+    def handle(self, *args, **options):
+        payloads = [(f'json x {count}', json_dumps(employees(count))) for count in map(int, options['sizes'].split(','))]
+        payloads.append(('ndjson stream x 50000', list(ndjson_chunks(50000))))
+        css = os.path.join(settings.BASE_DIR, 'polls', 'static', 'polls', 'style.css')
+        with open(css, 'rb') as f:
+            payloads.append(('polls/style.css', f.read()))
+
+        levels = [(compression.GzipCompressor, level) for level in (1, 6, 9)]
+        if compression.brotli is not None:
+            levels += [(compression.BrotliCompressor, quality) for quality in (1, 4, 11)]
+        else:
+            self.stdout.write('brotli is not installed, only gzip is measured')
+
+        self.stdout.write(f'{"payload":<24} {"encoding":<8} {"bytes":>10} {"compressed":>10} {"saved":>7} '
+                          f'{"cpu/resp":>12} {"MB/s":>8}')
+        for name, payload in payloads:
+            size = sum(map(len, payload)) if isinstance(payload, list) else len(payload)
+            for compressor_class, level in levels:
+                compressed = len(compress_once(compressor_class, level, payload))
+                # 在 budget 秒内尽量多压缩几次，取平均的 CPU 时间
+                runs, started, deadline = 0, time.thread_time_ns(), time.perf_counter() + options['budget']
+                while not runs or time.perf_counter() < deadline:
+                    compress_once(compressor_class, level, payload)
+                    runs += 1
+                cpu = (time.thread_time_ns() - started) / runs / 1e9
+                self.stdout.write(f'{name:<24} {compressor_class.name + " " + str(level):<8} {size:>10} '
+                                  f'{compressed:>10} {1 - compressed / size:>7.1%} {cpu * 1e6:>9.1f} us '
+                                  f'{size / cpu / 1e6 if cpu else 0:>8.1f}')
+            if size < settings.COMPRESSION_MIN_SIZE:
+                self.stdout.write(f'{"":<24} below COMPRESSION_MIN_SIZE ({settings.COMPRESSION_MIN_SIZE}), '
+                                  'sent uncompressed')
@@ -0,0 +1,97 @@
+"""
+数据库连接管理的性能对比：python manage.py bench_db_pool --threads 8 --requests 20000
+每个"请求"和 Django 处理请求时一样：取连接、按主键查询一行、请求结束时 close_if_unusable_or_obsolete
+1. reconnect：django.db.backends.sqlite3，CONN_MAX_AGE = 0，每个请求都重新连接
+2. persistent：django.db.backends.sqlite3，CONN_MAX_AGE = None，每个线程一个长连接，连接数等于线程数
+3. pool：mysite.db.sqlite3，CONN_MAX_AGE = 0，连接池最多 --pool-size 个连接，连接时设置 PRAGMA
+使用临时目录中的数据库文件，结束后删除
+"""
+
+import random
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+from django.db.utils import ConnectionHandler
+
+from mysite.db.pool import pools
+
+PRAGMAS = {'journal_mode': 'wal', 'synchronous': 'normal', 'busy_timeout': 5000,
+           'mmap_size': 256 * 1024 ** 2, 'cache_size': -64 * 1024}
+
+
+class Command(BaseCommand):
+    help = 'Benchmark requests/sec with per-request connections, persistent connections and the pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--requests', type=int, default=20000, help='total requests per mode')
+        parser.add_argument('--pool-size', type=int, default=4)
+        parser.add_argument('--rows', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        directory = tempfile.mkdtemp()
+        try:
+            name = str(Path(directory) / 'bench.sqlite3')
+            self.seed(name, options['rows'])
+            reconnect = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': name, 'CONN_MAX_AGE': 0}
+            handler = ConnectionHandler({
+                'default': reconnect,
+                'reconnect': reconnect,
+                'persistent': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': name, 'CONN_MAX_AGE': None},
+                'pool': {
+                    'ENGINE': 'mysite.db.sqlite3', 'NAME': name, 'CONN_MAX_AGE': 0,
+                    'OPTIONS': {'pool': {'max_size': options['pool_size']}, 'pragmas': PRAGMAS},
+                },
+            })
+            for alias in ('reconnect', 'persistent', 'pool'):
+                elapsed = self.run(handler, alias, options['threads'], options['requests'], options['rows'])
+                self.stdout.write(f'{alias:<12} {options["requests"] / elapsed:10.0f} requests/s')
+            pool = pools.pop(f'pool:{name}')
+            self.stdout.write(f'pool metrics: {pool.metrics()}')
+            pool.close()
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def seed(self, name, rows):
+        conn = sqlite3.connect(name)
+        conn.execute('CREATE TABLE item (id INTEGER PRIMARY KEY, name TEXT NOT NULL)')
+        conn.executemany('INSERT INTO item (id, name) VALUES (?, ?)', ((i, f'item {i}') for i in range(1, rows + 1)))
+        conn.commit()
+        conn.close()
+
+    def run(self, handler, alias, threads, requests, rows):
+        per_thread = requests // threads
+        barrier = threading.Barrier(threads + 1)
+
+        def worker():
+            rng = random.Random()
+            barrier.wait()
+            try:
+                for _ in range(per_thread):
+                    connection = handler[alias]
+                    with connection.cursor() as cursor:
+                        cursor.execute('SELECT id, name FROM item WHERE id = %s', [rng.randint(1, rows)])
+                        cursor.fetchone()
+                    # 请求结束（request_finished 信号）
+                    connection.close_if_unusable_or_obsolete()
+            except BaseException:
+                barrier.abort()
+                raise
+            barrier.wait()
+            handler[alias].close()
+
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        for thread in workers:
+            thread.start()
+        barrier.wait()
+        start = time.perf_counter()
+        barrier.wait()
+        elapsed = time.perf_counter() - start
+        for thread in workers:
+            thread.join()
+        return elapsed
@@ -0,0 +1,64 @@
+"""
+批量接口和单条接口的吞吐对比：python manage.py bench_employee_bulk --count 2000
+分别通过单条接口和批量接口创建、更新、删除 count 个员工，输出每秒处理的条数
+测试数据在事务中创建，结束后回滚，不会留在数据库中
+"""
+
+import json
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import Client
+
+from ninjademo.models import Department, Employee
+
+
+class Command(BaseCommand):
+    help = 'Benchmark bulk employee endpoints against the single-row endpoints'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=2000, help='number of employees')
+
+    def handle(self, *args, **options):
+        count = options['count']
+        with transaction.atomic():
+            user = User.objects.create_user(username='bench_employee_bulk')
+            client = Client(HTTP_HOST='localhost')
+            client.force_login(user)
+            department = Department.objects.create(title='bench')
+            payload = [
+                {"first_name": f'first{i}', "last_name": f'last{i}', "department_id": department.id}
+                for i in range(count)
+            ]
+
+            def single():
+                ids = [client.post('/api/employee', item, content_type='application/json').json()['id']
+                       for item in payload]
+                yield 'create'
+                for employee_id in ids:
+                    client.put(f'/api/employeeupdate/{employee_id}', {**payload[0], "first_name": 'new'},
+                               content_type='application/json')
+                yield 'update'
+                for employee_id in ids:
+                    client.delete(f'/api/employeedelete/{employee_id}')
+                yield 'delete'
+
+            def bulk():
+                ids = client.post('/api/employees/bulk', payload, content_type='application/json').json()['ids']
+                yield 'create'
+                client.put('/api/employees/bulk', [{**payload[0], "id": i, "first_name": 'new'} for i in ids],
+                           content_type='application/json')
+                yield 'update'
+                client.delete('/api/employees/bulk', json.dumps(ids), content_type='application/json')
+                yield 'delete'
+
+            for name, steps in (('single', single), ('bulk', bulk)):
+                start = time.perf_counter()
+                for step in steps():
+                    elapsed = time.perf_counter() - start
+                    self.stdout.write(f'{name:<7} {step:<7} {count / elapsed:12.0f} rows/s')
+                    start = time.perf_counter()
+                assert not Employee.objects.filter(department=department).exists()
+            transaction.set_rollback(True)
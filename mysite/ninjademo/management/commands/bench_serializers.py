@@ -0,0 +1,59 @@
+"""
+序列化性能对比：python manage.py bench_serializers --count 10000
+对 EmployeeOut 列表和 Filters 查询参数两种数据，分别测试标准库 json（ninja 默认）、json_dumps（有 orjson 时使用 orjson）、
+msgpack（已安装时）、XML 的编码和解码耗时
+"""
+
+import datetime
+import json
+import timeit
+
+from django.core.management.base import BaseCommand
+from ninja.responses import NinjaJSONEncoder
+
+from mysite import renderers
+from mysite.renderers import XMLRenderer, json_dumps, json_loads
+from ninjademo.api import EmployeeOut, Filters
+
+
+class Command(BaseCommand):
+    help = 'Benchmark JSON/msgpack/XML encode and decode cost'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=10000, help='employees in the list payload')
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        employees = [
+            EmployeeOut(id=i, first_name=f'first{i}', last_name=f'last{i}', department_id=i % 10,
+                        brithdate=datetime.date(1990, 1, 1) + datetime.timedelta(days=i % 10000)).dict()
+            for i in range(options['count'])
+        ]
+        filters = Filters(limit=100, offset=200, query='ninja', categories=['a', 'b', 'c']).dict()
+        xml = XMLRenderer()
+
+        encoders = [
+            ('stdlib json', lambda data: json.dumps(data, cls=NinjaJSONEncoder), json.loads),
+            ('json_dumps' + (' (orjson)' if renderers.orjson else ' (stdlib)'), json_dumps, json_loads),
+        ]
+        if renderers.msgpack is not None:
+            msgpack = renderers.msgpack
+            encoders.append(('msgpack', lambda data: msgpack.packb(data, default=NinjaJSONEncoder().default),
+                             msgpack.unpackb))
+        encoders.append(('xml', lambda data: xml.render(None, data, response_status=200), None))
+
+        self.stdout.write(f'{"payload":<22} {"format":<20} {"encode":>12} {"decode":>12} {"bytes":>10}')
+        for payload_name, payload, number in (
+                (f'EmployeeOut x {len(employees)}', employees, 1),
+                ('Filters', filters, 10000)):
+            for name, encode, decode in encoders:
+                content = encode(payload)
+                encode_time = min(timeit.repeat(lambda: encode(payload), number=number,
+                                                repeat=options['repeat'])) / number
+                decode_time = '-'
+                if decode is not None:
+                    decode_time = min(timeit.repeat(lambda: decode(content), number=number,
+                                                    repeat=options['repeat'])) / number
+                    decode_time = f'{decode_time * 1e6:9.1f} us'
+                self.stdout.write(f'{payload_name:<22} {name:<20} {encode_time * 1e6:9.1f} us '
+                                  f'{decode_time:>12} {len(content):>10}')
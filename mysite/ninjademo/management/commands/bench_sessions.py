@@ -0,0 +1,73 @@
+"""
+session 引擎的数据库查询对比：python manage.py bench_sessions --requests 1000
+登录后连续请求 /api/pets（django_auth），统计每个请求的数据库查询数和耗时
+1. db：django 默认的数据库 session + ModelBackend
+2. cached_db：django 自带的 cached_db + ModelBackend
+3. local：mysite.sessions.local + CachedModelBackend
+4. signed：mysite.sessions.signed + CachedModelBackend
+测试数据在事务中创建，结束后回滚
+"""
+
+import time
+
+from django.conf import settings
+from django.contrib.auth import login
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.http import HttpRequest
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from mysite.sessions import signed
+
+MODEL_BACKEND = 'django.contrib.auth.backends.ModelBackend'
+CACHED_BACKEND = 'mysite.sessions.users.CachedModelBackend'
+
+ENGINES = [
+    ('db', 'django.contrib.sessions.backends.db', MODEL_BACKEND),
+    ('cached_db', 'django.contrib.sessions.backends.cached_db', MODEL_BACKEND),
+    ('local', 'mysite.sessions.local', CACHED_BACKEND),
+    ('signed', 'mysite.sessions.signed', CACHED_BACKEND),
+]
+
+
+class Command(BaseCommand):
+    help = 'Benchmark database queries per request for each session engine'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            user = User.objects.create_user(username='bench', password='bench')
+            baseline = None
+            for name, engine, backend in ENGINES:
+                with override_settings(SESSION_ENGINES={'/api/': engine}, AUTHENTICATION_BACKENDS=[backend]):
+                    queries, elapsed = self.run(user, engine, backend, options['requests'])
+                per_request = queries / options['requests']
+                baseline = baseline or per_request
+                ratio = f'x{baseline / per_request:.0f}' if per_request else 'no queries'
+                self.stdout.write(f'{name:<10} {per_request:6.3f} queries/request ({ratio:>10})  '
+                                  f'{elapsed / options["requests"] * 1e6:7.1f} us/request')
+            transaction.set_rollback(True)
+
+    def run(self, user, engine, backend, count):
+        client = Client(HTTP_HOST='localhost')
+        if engine == 'mysite.sessions.signed':
+            request = HttpRequest()
+            request.session = signed.SessionStore()
+            login(request, user, backend)
+            request.session.save()
+            client.cookies[settings.SIGNED_SESSION_COOKIE_NAME] = request.session.session_key
+        else:
+            with override_settings(SESSION_ENGINE=engine):
+                client.force_login(user, backend)
+        with CaptureQueriesContext(connection) as ctx:
+            start = time.perf_counter()
+            for _ in range(count):
+                response = client.get('/api/pets')
+                assert response.status_code == 200, response.content
+            elapsed = time.perf_counter() - start
+        queries = [q for q in ctx.captured_queries if 'SAVEPOINT' not in q['sql']]
+        return len(queries), elapsed
@@ -0,0 +1,54 @@
+"""
+可信输出的性能对比：python manage.py bench_trusted_output --count 10000
+1. pydantic：ninja 原来的处理方式，List[EmployeeOut] 逐个对象、逐个字段校验
+2. compiled (objects)：预先生成的序列化函数读取模型实例属性
+3. compiled (values)：预先生成的序列化函数，使用 .values() 查询，不创建模型实例
+每种方式都包含数据库查询的耗时；测试数据在事务中创建，结束后回滚
+"""
+
+import time
+from typing import List
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from ninja.operation import ResponseObject
+from ninja import Schema
+
+from mysite.serializers import compile_serializer
+from ninjademo.api import EmployeeOut
+from ninjademo.models import Department, Employee
+
+
+class Command(BaseCommand):
+    help = 'Benchmark compiled trusted-output serializers against pydantic validation'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=10000, help='number of employees')
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        response_model = type('NinjaResponseSchema', (Schema,), {'__annotations__': {'response': List[EmployeeOut]}})
+        serializer = compile_serializer(EmployeeOut)
+        with transaction.atomic():
+            department = Department.objects.create(title='bench')
+            Employee.objects.bulk_create([
+                Employee(first_name=f'first{i}', last_name=f'last{i}', department=department)
+                for i in range(options['count'])
+            ], batch_size=2000)
+            paths = [
+                ('pydantic', lambda: response_model.from_orm(ResponseObject(Employee.objects.all())).dict()['response']),
+                ('compiled (objects)', lambda: [serializer.from_obj(e) for e in Employee.objects.all()]),
+                ('compiled (values)', lambda: serializer.many(Employee.objects.all())),
+            ]
+            baseline = None
+            for name, func in paths:
+                assert func() == paths[0][1]()
+                elapsed = min(self.timeit(func) for _ in range(options['repeat']))
+                baseline = baseline or elapsed
+                self.stdout.write(f'{name:<20} {elapsed * 1000:9.1f} ms  x{baseline / elapsed:.1f}')
+            transaction.set_rollback(True)
+
+    def timeit(self, func):
+        start = time.perf_counter()
+        func()
+        return time.perf_counter() - start
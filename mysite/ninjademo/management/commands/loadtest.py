@@ -0,0 +1,131 @@
+"""
+压测所有挂载的路由（见 mysite/loadtest.py）
+python manage.py loadtest：在临时数据库中生成测试数据，WSGI、ASGI 各压测一遍，结束后删除临时数据库
+python manage.py loadtest --route 'polls:' --interface wsgi --concurrency 16 --requests 1000
+python manage.py loadtest --output result.json --baseline loadtest-baseline.json：有退化时以非零状态退出
+有路由抛出异常时总是以非零状态退出，也不会保存为基线
+python manage.py loadtest --update-baseline --baseline loadtest-baseline.json：保存为新的基线
+python manage.py loadtest --list：列出压测的路由和没有压测的路由
+压测时 DEBUG、PROFILING_ENABLED 关闭（记录 SQL 的开销不计入结果），不限流，读写都使用主库
+"""
+
+import json
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from mysite import loadtest
+from mysite.db.pool import pools
+
+
+class Command(BaseCommand):
+    help = 'Load test every mounted route in-process over WSGI and ASGI and compare with a baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interface', choices=['wsgi', 'asgi', 'both'], default='both')
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--requests', type=int, default=200, help='requests per route and interface')
+        parser.add_argument('--warmup', type=int, default=20, help='unrecorded requests before each route')
+        parser.add_argument('--route', default='', help='regex matched against route names, e.g. "polls:|api:get_"')
+        parser.add_argument('--questions', type=int, default=500)
+        parser.add_argument('--employees', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--keepdb', action='store_true', help='keep and reuse the seeded database')
+        parser.add_argument('--output', help='write results to this JSON file')
+        parser.add_argument('--baseline', help='baseline JSON file to compare with')
+        parser.add_argument('--threshold', type=float, default=0.2, help='allowed relative slowdown')
+        parser.add_argument('--min-delta-ms', type=float, default=1.0, help='ignore slowdowns smaller than this')
+        parser.add_argument('--update-baseline', action='store_true', help='write results to --baseline')
+        parser.add_argument('--list', action='store_true', help='list covered and uncovered routes')
+
+    def handle(self, *args, **options):
+        routes = loadtest.route_filter(options['route'])
+        if options['list']:
+            for route in routes:
+                self.stdout.write(f'{route.name:<28} {route.method:<5} {route.path}')
+            uncovered = loadtest.uncovered_routes()
+            self.stdout.write(f'\n{len(uncovered)} mounted routes without a load test:')
+            for route in uncovered:
+                self.stdout.write(f'  {route}')
+            return
+        if not routes:
+            raise CommandError(f'no route matches {options["route"]!r}')
+        if options['update_baseline'] and not options['baseline']:
+            raise CommandError('--update-baseline needs --baseline')
+        baseline = None
+        if options['baseline'] and not options['update_baseline']:
+            try:
+                with open(options['baseline']) as f:
+                    baseline = json.load(f)
+            except FileNotFoundError:
+                raise CommandError(f'baseline {options["baseline"]} does not exist, create it with --update-baseline')
+
+        interfaces = ['wsgi', 'asgi'] if options['interface'] == 'both' else [options['interface']]
+        with override_settings(DEBUG=False, PROFILING_ENABLED=False, RATELIMIT_ENABLED=False,
+                               ALLOWED_HOSTS=['testserver'], DATABASE_REPLICAS=[]):
+            with self.database(options['keepdb']):
+                dataset = loadtest.Dataset.load()
+                if not dataset:
+                    self.stdout.write('seeding...')
+                    dataset = loadtest.seed(options['questions'], employees=options['employees'],
+                                            seed=options['seed'])
+                self.stdout.write(f'{"route":<40} {"requests/s":>10} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} '
+                                  f'{"queries":>8} {"errors":>7}')
+                results = loadtest.run(routes, dataset, interfaces, options['concurrency'], options['requests'],
+                                       options['warmup'], options['seed'], progress=self.progress)
+
+        if options['output']:
+            self.write(options['output'], results)
+        crashes = loadtest.crashes(results)
+        if crashes:
+            raise CommandError('routes raised exceptions:\n  ' + '\n  '.join(crashes))
+        if options['update_baseline']:
+            self.write(options['baseline'], results)
+            self.stdout.write(f'baseline written to {options["baseline"]}')
+        if baseline is not None:
+            regressions = loadtest.compare(results, baseline, options['threshold'], options['min_delta_ms'])
+            if regressions:
+                raise CommandError('regressions against baseline:\n  ' + '\n  '.join(regressions))
+            self.stdout.write(self.style.SUCCESS(f'no regressions against {options["baseline"]}'))
+
+    def progress(self, key, result):
+        line = (f'{key:<40} {result["rps"]:>10.1f} {result["p50"]:>8.2f} {result["p95"]:>8.2f} '
+                f'{result["p99"]:>8.2f} {result["queries"]:>8.2f} {result["errors"]:>7}')
+        if result['errors']:
+            line = self.style.ERROR(f'{line}  {result["error"][:120]}')
+        self.stdout.write(line)
+
+    def write(self, path, results):
+        with open(path, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    @contextmanager
+    def database(self, keepdb):
+        """
+        和测试一样创建单独的数据库；SQLite 使用文件（内存数据库不经过连接池，和线上不一样）
+        """
+        old_name = connection.settings_dict['NAME']
+        directory = None
+        if connection.vendor == 'sqlite':
+            directory = settings.BASE_DIR if keepdb else tempfile.mkdtemp()
+            connection.settings_dict['TEST']['NAME'] = os.path.join(directory, 'db.loadtest.sqlite3')
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False, keepdb=keepdb)
+        name = connection.settings_dict['NAME']
+        self.stdout.write(f'database {name}')
+        try:
+            yield
+        finally:
+            connection.close()
+            pool = pools.pop(f'{connection.alias}:{name}', None)
+            if pool is not None:
+                pool.close()
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=keepdb)
+            if directory is not None and not keepdb:
+                # 还有 WAL 模式的 -wal、-shm 文件
+                shutil.rmtree(directory, ignore_errors=True)
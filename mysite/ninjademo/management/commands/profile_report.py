@@ -0,0 +1,59 @@
+"""
+最慢的接口（见 mysite/profiling.py）
+python manage.py profile_report：合并所有进程最近 PROFILING_WINDOW 秒的统计，按 p95 从慢到快列出
+python manage.py profile_report --sort queries --limit 10
+python manage.py profile_report --json
+"""
+
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from mysite.profiling import load_snapshots
+
+COLUMNS = [
+    ('count', 'count', '{:>7}'),
+    ('p50', 'p50 ms', '{:>8.1f}'),
+    ('p95', 'p95 ms', '{:>8.1f}'),
+    ('p99', 'p99 ms', '{:>8.1f}'),
+    ('queries', 'queries', '{:>8.1f}'),
+    ('max_queries', 'max', '{:>5}'),
+    ('db_time', 'db ms', '{:>8.1f}'),
+    ('duplicates', 'dup', '{:>6.1f}'),
+    ('serialization', 'ser ms', '{:>8.1f}'),
+    ('size', 'bytes', '{:>9}'),
+]
+
+
+class Command(BaseCommand):
+    help = 'Show per-endpoint query counts, database time and latency percentiles'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sort', default='p95', choices=[name for name, _, _ in COLUMNS])
+        parser.add_argument('--limit', type=int, default=20)
+        parser.add_argument('--dir', default=None, help='snapshot directory, default PROFILING_SNAPSHOT_DIR')
+        parser.add_argument('--json', action='store_true')
+
+    def handle(self, *args, **options):
+        rows = [{'endpoint': key, **stats.summary()} for key, stats in load_snapshots(options['dir']).items()]
+        rows.sort(key=lambda row: row[options['sort']], reverse=True)
+        rows = rows[:options['limit']]
+        if options['json']:
+            self.stdout.write(json.dumps(rows, indent=2))
+            return
+        if not rows:
+            self.stdout.write(f'no requests recorded in {options["dir"] or settings.PROFILING_SNAPSHOT_DIR}, '
+                              'is PROFILING_ENABLED on?')
+            return
+        width = max(len(row['endpoint']) for row in rows)
+        self.stdout.write(f'{"endpoint":<{width}}' + ''.join(f' {title:>{len(fmt.format(0))}}'
+                                                            for _, title, fmt in COLUMNS))
+        for row in rows:
+            self.stdout.write(f'{row["endpoint"]:<{width}}' + ''.join(' ' + fmt.format(row[name])
+                                                                      for name, _, fmt in COLUMNS))
+        duplicated = [row for row in rows if row['top_duplicate']]
+        if duplicated:
+            self.stdout.write('\nmost repeated query (possible N+1):')
+            for row in duplicated:
+                self.stdout.write(f'  {row["endpoint"]}: {row["top_duplicate"][:200]}')
@@ -0,0 +1,37 @@
+"""
+把主库复制到从库（本地模拟读写分离，见 mysite/db/replication.py）
+python manage.py replicate：复制一次
+python manage.py replicate --interval 1：每秒复制一次，直到 Ctrl-C
+"""
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.connection import ConnectionDoesNotExist
+
+from mysite.db.replication import replicate_databases
+
+
+class Command(BaseCommand):
+    help = 'Copy the primary SQLite database to the replicas in DATABASE_REPLICAS'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0, help='seconds between copies, 0 copies once')
+        parser.add_argument('replicas', nargs='*', help='replica aliases, default DATABASE_REPLICAS')
+
+    def handle(self, *args, **options):
+        replicas = options['replicas'] or None
+        while True:
+            try:
+                elapsed = replicate_databases(replicas=replicas)
+            except (ConnectionDoesNotExist, ValueError) as e:
+                raise CommandError(str(e))
+            if not elapsed:
+                raise CommandError('no replicas to copy to, set REPLICAS=n or pass replica aliases')
+            self.stdout.write(', '.join(f'{alias} {seconds * 1000:.1f}ms' for alias, seconds in elapsed.items()))
+            if not options['interval']:
+                return
+            try:
+                time.sleep(options['interval'])
+            except KeyboardInterrupt:
+                return
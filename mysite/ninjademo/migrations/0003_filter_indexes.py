@@ -0,0 +1,23 @@
+# Generated by Django 4.0.1 on 2026-10-18 18:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ninjademo', '0002_apikey'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='department',
+            name='title',
+            field=models.CharField(db_index=True, max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='employee',
+            name='last_name',
+            field=models.CharField(db_index=True, max_length=100),
+        ),
+    ]
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.db import models
 
 # Create your models here.
@@ -7,11 +8,27 @@ from django.db import models
 
 
 class Department(models.Model):
-    title = models.CharField(max_length=100)
+    # /filter 按部门名称过滤、按姓氏前缀搜索，见 api.py 中的 employee_filters
+    title = models.CharField(max_length=100, db_index=True)
 
 
 class Employee(models.Model):
     first_name = models.CharField(max_length=100)
-    last_name = models.CharField(max_length=100)
+    last_name = models.CharField(max_length=100, db_index=True)
     department = models.ForeignKey(Department, on_delete=models.CASCADE)
-    brithdate = models.DateField(null=True, blank=True)
\ No newline at end of file
+    brithdate = models.DateField(null=True, blank=True)
+
+
+class APIKey(models.Model):
+    """
+    API 密钥，格式为 <prefix>.<secret>，数据库中只保存 prefix 和整个密钥的 HMAC-SHA256，见 apikeys.py
+    """
+    name = models.CharField(max_length=100)
+    prefix = models.CharField(max_length=8, unique=True)
+    hashed_key = models.CharField(max_length=64)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.CASCADE)
+    created = models.DateTimeField(auto_now_add=True)
+    revoked = models.BooleanField(default=False)
+
+    def __str__(self):
+        return f'{self.name} ({self.prefix})'
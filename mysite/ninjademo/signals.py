@@ -0,0 +1,23 @@
+"""
+API 密钥修改、吊销或删除（包括后台修改）时让校验缓存失效
+部门、员工修改或删除时条件请求的版本号加一（见 mysite/conditional.py）
+"""
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from mysite.conditional import bump_version
+
+from .apikeys import api_keys
+from .models import APIKey, Department, Employee
+
+
+@receiver([post_save, post_delete], sender=APIKey)
+def api_key_changed(sender, instance, **kwargs):
+    api_keys.invalidate(instance)
+
+
+@receiver([post_save, post_delete], sender=Department)
+@receiver([post_save, post_delete], sender=Employee)
+def table_changed(sender, using, **kwargs):
+    bump_version(sender, using=using)
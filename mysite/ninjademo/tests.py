@@ -1,3 +1,1895 @@
-from django.test import TestCase
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
 
 # Create your tests here.
+
+import asyncio
+import contextlib
+import datetime
+import decimal
+import gzip
+import hashlib
+import hmac
+import json
+import os
+import random
+import shutil
+import sqlite3
+import string
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+import zlib
+from io import StringIO
+from unittest import mock, skipIf
+
+from django.contrib.auth.models import Group, User
+from django.conf import settings
+from django.contrib.auth import login
+from django.contrib.sessions.backends.base import SessionBase
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.http import HttpRequest, HttpResponse
+from django.urls import resolve
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connection, connections
+from django.db.models import Sum
+from django.db.utils import ConnectionHandler
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from ninja import Router, Schema
+
+from mysite import compression, conditional, loadtest, profiling, ratelimit, renderers
+from mysite.asyncdb import DatabaseBusy, DatabaseExecutor, QueryTimeout, database
+from mysite.db.pool import ConnectionPool, PoolTimeout, pools
+from mysite.db.replication import replicate
+from mysite.ratelimit import (CacheStore, ConcurrencyLimiter, LocalStore, RateLimit, RateLimited, limit_router,
+                              parse_rate, protect_api)
+from mysite.db.routers import (COOKIE_NAME, PrimaryReplicaRouter, ReplicaRoutingMiddleware, routing_state,
+                                use_primary)
+from mysite.tasks import TaskRejected, TaskRunner, background, with_lifespan
+from mysite.renderers import json_dumps
+from mysite.search import SearchIndex
+from mysite.security import CompositeAuth, parse_credentials
+from mysite.sessions import local, signed
+from mysite.sessions.cache import LocalCache
+from mysite.sessions.middleware import SessionMiddleware
+from mysite.downloads import RangeFile, parse_range
+from mysite.filters import FilterError, FilterSet, full_scans
+from mysite.serializers import SerializerError, compile_serializer
+from mysite.uploads import StreamingUploadHandler, UploadTooLarge
+
+from .api import (EmployeeIn, EmployeeOut, UserSchema, UserSchemaDjango, UserSchemaDjangoAll,
+                  UserSchemaDjangoExclude, UserSchemaDjangoUpdate, weapons)
+from polls.models import Choice, Question
+from polls.search import FTS5QuestionSearch, MemoryQuestionSearch, QuestionSearch, fts5_available
+
+from .management.commands.bench_uploads import SyntheticUpload, post_upload
+from .apikeys import APIKeyStore, api_keys, hash_key
+from .models import APIKey, Department, Employee
+
+
+class EmployeeApiTestCase(TestCase):
+    """
+    api 默认使用 django_auth 认证，测试前先登录
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='ninja', password='ninja')
+        cls.department = Department.objects.create(title='dev')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def create_employees(self, count):
+        return Employee.objects.bulk_create([
+            Employee(first_name=f'first{i}', last_name=f'last{i}', department=self.department)
+            for i in range(count)
+        ])
+
+
+class EmployeeListTest(EmployeeApiTestCase):
+
+    def test_page(self):
+        """
+        按 cursor 翻页，直到 next_cursor 为空
+        """
+        self.create_employees(25)
+        ids, cursor = [], 0
+        while cursor is not None:
+            response = self.client.get('/api/employees/page', {'cursor': cursor, 'limit': 10})
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            ids.extend(item['id'] for item in data['items'])
+            cursor = data['next_cursor']
+        self.assertEqual(ids, list(Employee.objects.order_by('id').values_list('id', flat=True)))
+
+    def test_page_limit(self):
+        response = self.client.get('/api/employees/page', {'limit': 10001})
+        self.assertEqual(response.status_code, 422)
+
+    def test_stream_ndjson(self):
+        self.create_employees(25)
+        response = self.client.get('/api/employees/stream', {'chunk_size': 10})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        rows = [json.loads(line) for line in lines]
+        self.assertEqual(len(rows), 25)
+        self.assertEqual(set(rows[0]), {'id', 'first_name', 'last_name', 'department_id', 'brithdate'})
+
+    def test_stream_json(self):
+        for count in (0, 1, 25):
+            Employee.objects.all().delete()
+            self.create_employees(count)
+            response = self.client.get('/api/employees/stream', {'format': 'json', 'chunk_size': 10})
+            rows = json.loads(b''.join(response.streaming_content))
+            self.assertEqual([row['id'] for row in rows],
+                             list(Employee.objects.order_by('id').values_list('id', flat=True)))
+
+    def test_stream_requires_login(self):
+        self.client.logout()
+        response = self.client.get('/api/employees/stream')
+        self.assertEqual(response.status_code, 401)
+
+
+def statements(ctx):
+    # 去掉事务的 SAVEPOINT 语句
+    return [q['sql'] for q in ctx.captured_queries if not q['sql'].startswith(('SAVEPOINT', 'RELEASE SAVEPOINT'))]
+
+
+class EmployeeBulkTest(EmployeeApiTestCase):
+
+    def test_bulk_create(self):
+        payload = [
+            {"first_name": "a", "last_name": "a", "department_id": self.department.id},
+            {"first_name": "b", "last_name": "b", "department_id": 0},
+            {"first_name": "c", "last_name": "c"},
+            {"first_name": "d", "last_name": "d", "department_id": self.department.id, "brithdate": "2000-01-02"},
+        ]
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post('/api/employees/bulk', payload, content_type='application/json')
+        # session、user + 部门校验、bulk_create
+        self.assertEqual(len(statements(ctx)), 2 + 2)
+        data = response.json()
+        self.assertEqual(len(data['ids']), 2)
+        self.assertEqual([e['index'] for e in data['errors']], [1, 2])
+        self.assertEqual(Employee.objects.count(), 2)
+
+    def test_bulk_create_departments(self):
+        response = self.client.post('/api/departments/bulk', ['hr', 'ops'], content_type='application/json')
+        self.assertEqual(len(response.json()['ids']), 2)
+        self.assertEqual(Department.objects.count(), 3)
+
+    def test_bulk_update(self):
+        e1, e2 = self.create_employees(2)
+        other = Department.objects.create(title='ops')
+        payload = [
+            {"id": e1.id, "first_name": "new", "last_name": e1.last_name, "department_id": self.department.id},
+            {"id": e2.id, "first_name": e2.first_name, "last_name": e2.last_name, "department_id": self.department.id},
+            {"id": 0, "first_name": "x", "last_name": "x", "department_id": self.department.id},
+            {"id": e2.id, "first_name": "x", "last_name": "x", "department_id": 0},
+        ]
+        response = self.client.put('/api/employees/bulk', payload, content_type='application/json')
+        data = response.json()
+        self.assertEqual(data['ids'], [e1.id])
+        self.assertEqual([e['index'] for e in data['errors']], [2, 3])
+        e1.refresh_from_db()
+        e2.refresh_from_db()
+        self.assertEqual(e1.first_name, 'new')
+        self.assertEqual(e2.first_name, 'first1')
+
+        # 只更新有变化的字段
+        payload = [{"id": e1.id, "first_name": "new", "last_name": e1.last_name, "department_id": other.id}]
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.put('/api/employees/bulk', payload, content_type='application/json')
+        # 部门、员工、bulk_update；session 和 user 已在进程内缓存
+        self.assertEqual(len(statements(ctx)), 3)
+        e1.refresh_from_db()
+        self.assertEqual(e1.department_id, other.id)
+
+    def test_bulk_update_only_changed_fields(self):
+        e1, = self.create_employees(1)
+        payload = [{"id": e1.id, "first_name": "new", "last_name": e1.last_name, "department_id": self.department.id}]
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.put('/api/employees/bulk', payload, content_type='application/json')
+        updates = [sql for sql in statements(ctx) if sql.startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        self.assertIn('"first_name"', updates[0])
+        self.assertNotIn('"last_name"', updates[0])
+
+    def test_bulk_delete(self):
+        e1, e2, e3 = self.create_employees(3)
+        response = self.client.delete('/api/employees/bulk', [e1.id, 0, e3.id], content_type='application/json')
+        data = response.json()
+        self.assertEqual(data['ids'], [e1.id, e3.id])
+        self.assertEqual(data['errors'], [{"index": 1, "error": "Employee 0 does not exist"}])
+        self.assertEqual(list(Employee.objects.values_list('id', flat=True)), [e2.id])
+
+
+class SerializationTest(EmployeeApiTestCase):
+
+    payload = {
+        "datetime": datetime.datetime(2022, 3, 2, 23, 1, 2, 345678, tzinfo=datetime.timezone.utc),
+        "date": datetime.date(2022, 3, 2),
+        "decimal": decimal.Decimal('1.10'),
+        "uuid": uuid.UUID('12345678-1234-5678-1234-567812345678'),
+        "schema": EmployeeIn(first_name='a', last_name='b'),
+        1: [None, True, 1.5],
+    }
+
+    def test_json_dumps(self):
+        self.assertEqual(json.loads(json_dumps(self.payload)), {
+            "datetime": "2022-03-02T23:01:02.345678Z",
+            "date": "2022-03-02",
+            "decimal": "1.10",
+            "uuid": "12345678-1234-5678-1234-567812345678",
+            "schema": {"first_name": "a", "last_name": "b", "department_id": None, "brithdate": None},
+            "1": [None, True, 1.5],
+        })
+
+    @skipIf(renderers.orjson is None, 'orjson is not installed')
+    def test_stdlib_fallback_same_output(self):
+        fast = json_dumps(self.payload)
+        with mock.patch.object(renderers, 'orjson', None):
+            self.assertEqual(json_dumps(self.payload), fast)
+
+    def test_default_json(self):
+        employee, = self.create_employees(1)
+        response = self.client.post(f'/api/employee/{employee.id}')
+        self.assertEqual(response['Content-Type'], 'application/json; charset=utf-8')
+        self.assertIn('Accept', response['Vary'])
+        self.assertEqual(response.json()['first_name'], 'first0')
+
+    def test_accept_xml(self):
+        employee, = self.create_employees(1)
+        response = self.client.post(f'/api/employee/{employee.id}', HTTP_ACCEPT='text/html, application/xml;q=0.9')
+        self.assertEqual(response['Content-Type'], 'text/xml; charset=utf-8')
+        self.assertIn(b'<first_name>first0</first_name>', response.content)
+
+    def test_unsupported_accept_falls_back_to_json(self):
+        response = self.client.get('/api/hello', HTTP_ACCEPT='text/html')
+        self.assertEqual(response.json(), 'Hello world')
+
+    @skipIf(renderers.msgpack is None, 'msgpack is not installed')
+    def test_msgpack(self):
+        body = renderers.msgpack.packb({"name": "ninja", "price": 1.5, "quantity": 2})
+        response = self.client.post('/api/item', body, content_type='application/msgpack',
+                                    HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(renderers.msgpack.unpackb(response.content),
+                         {"name": "ninja", "description": None, "price": 1.5, "quantity": 2})
+
+    def test_apis_negotiation(self):
+        response = self.client.get('/apis/blogs/blogs', HTTP_ACCEPT='text/xml')
+        self.assertIn(b'<blog_title>title1</blog_title>', response.content)
+
+
+class TrustedOutputTest(EmployeeApiTestCase):
+    """
+    随机生成数据，比较预先生成的序列化函数和 pydantic 的输出是否一致
+    """
+    rounds = 50
+
+    def setUp(self):
+        super().setUp()
+        self.random = random.Random(20220302)
+
+    def random_text(self, max_length=100):
+        alphabet = string.ascii_letters + string.digits + ' 中文"\\\'<>&'
+        return ''.join(self.random.choice(alphabet) for _ in range(self.random.randint(0, max_length)))
+
+    def random_employee(self, departments):
+        brithdate = None
+        if self.random.random() < 0.7:
+            brithdate = datetime.date(1900, 1, 1) + datetime.timedelta(days=self.random.randint(0, 50000))
+        return Employee.objects.create(first_name=self.random_text(), last_name=self.random_text(),
+                                       department=self.random.choice(departments), brithdate=brithdate)
+
+    def test_employee_out(self):
+        departments = [self.department, Department.objects.create(title='ops')]
+        serializer = compile_serializer(EmployeeOut)
+        for _ in range(self.rounds):
+            employee = self.random_employee(departments)
+            expected = EmployeeOut.from_orm(employee).dict()
+            self.assertEqual(serializer.from_obj(employee), expected)
+            row = Employee.objects.filter(pk=employee.pk).values(*serializer.sources).get()
+            self.assertEqual(serializer.from_row(row), expected)
+        expected = [EmployeeOut.from_orm(e).dict() for e in Employee.objects.all()]
+        self.assertEqual(serializer.many(Employee.objects.all()), expected)
+        self.assertEqual(serializer.many(list(Employee.objects.all())), expected)
+
+    def test_model_schemas(self):
+        groups = [Group.objects.create(name=self.random_text(20) + str(i)) for i in range(5)]
+        for i in range(self.rounds):
+            user = User.objects.create(username=f'user{i}', first_name=self.random_text(30),
+                                       last_name=self.random_text(30), email=f'user{i}@example.com',
+                                       is_staff=self.random.random() < 0.5,
+                                       last_login=timezone.now() if self.random.random() < 0.5 else None)
+            user.groups.set(self.random.sample(groups, self.random.randint(0, len(groups))))
+            for schema in (UserSchema, UserSchemaDjango, UserSchemaDjangoAll, UserSchemaDjangoExclude,
+                           UserSchemaDjangoUpdate):
+                self.assertEqual(compile_serializer(schema).from_obj(user), schema.from_orm(user).dict(),
+                                 schema.__name__)
+
+    def test_values_rows_without_model_instances(self):
+        self.create_employees(3)
+        serializer = compile_serializer(EmployeeOut)
+        self.assertTrue(serializer.identity_row)
+        with CaptureQueriesContext(connection) as ctx:
+            serializer.many(Employee.objects.all())
+        self.assertNotIn('"ninjademo_department"', ctx.captured_queries[0]['sql'])
+        self.assertIsNone(compile_serializer(UserSchemaDjangoUpdate).sources)
+
+    def test_endpoints(self):
+        departments = [self.department]
+        for _ in range(10):
+            self.random_employee(departments)
+        expected = [EmployeeOut.from_orm(e).dict() for e in Employee.objects.all()]
+        response = self.client.post('/api/employees')
+        self.assertEqual(response.content, json_dumps(expected))
+        employee = Employee.objects.first()
+        response = self.client.post(f'/api/employee/{employee.id}')
+        self.assertEqual(response.content, json_dumps(EmployeeOut.from_orm(employee).dict()))
+        self.assertEqual(self.client.post('/api/employee/0').status_code, 404)
+
+    def test_unsupported_schema(self):
+        class Resolved(Schema):
+            name: str
+
+            @staticmethod
+            def resolve_name(obj):
+                return obj.first_name
+
+        with self.assertRaises(SerializerError):
+            compile_serializer(Resolved)
+
+
+class AsyncApiTest(TransactionTestCase):
+    """
+    查询在其它线程的连接中执行，测试数据需要提交后才能看到，使用 TransactionTestCase
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='ninja', password='ninja')
+        now = timezone.now()
+        self.questions = [
+            Question.objects.create(question_text=f'question {i}', pub_date=now - datetime.timedelta(days=i))
+            for i in range(5)
+        ]
+        Question.objects.create(question_text='future', pub_date=now + datetime.timedelta(days=1))
+        self.questions[0].choice_set.create(choice_text='b', votes=2)
+        self.questions[0].choice_set.create(choice_text='a', votes=1)
+
+    def test_questions_page(self):
+        data = self.client.get('/api/questions', {'offset': 1, 'limit': 2}).json()
+        self.assertEqual(data['count'], 5)
+        self.assertEqual([q['question_text'] for q in data['items']], ['question 1', 'question 2'])
+
+    def test_questions_search(self):
+        """
+        q 使用 question_search 的索引，不再 icontains 全表扫描；未发布的 question 不出现在结果中
+        """
+        for backend in (MemoryQuestionSearch(background=False), FTS5QuestionSearch()):
+            with self.subTest(backend=type(backend).__name__):
+                if isinstance(backend, FTS5QuestionSearch) and not fts5_available():
+                    self.skipTest('SQLite FTS5 trigram tokenizer is not available')
+                with mock.patch.object(QuestionSearch, 'backend', new_callable=mock.PropertyMock,
+                                       return_value=backend), \
+                        mock.patch.object(backend, 'search', wraps=backend.search) as search:
+                    data = self.client.get('/api/questions', {'q': 'question 4'}).json()
+                    self.assertEqual(data['count'], 1)
+                    self.assertEqual([q['id'] for q in data['items']], [self.questions[4].id])
+                    data = self.client.get('/api/questions', {'q': 'ques', 'offset': 1, 'limit': 2}).json()
+                    self.assertEqual(data['count'], 5)
+                    self.assertEqual(len(data['items']), 2)
+                    data = self.client.get('/api/questions', {'q': 'future'}).json()
+                    self.assertEqual(data, {'count': 0, 'items': []})
+                self.assertEqual(search.call_count, 3)
+
+    def test_question_detail(self):
+        data = self.client.get(f'/api/questions/{self.questions[0].id}').json()
+        self.assertEqual([(c['choice_text'], c['votes']) for c in data['choices']], [('b', 2), ('a', 1)])
+        future = Question.objects.get(question_text='future')
+        self.assertEqual(self.client.get(f'/api/questions/{future.id}').status_code, 404)
+
+    def test_async_auth(self):
+        Department.objects.create(title='dev')
+        self.assertEqual(self.client.get('/api/async/departments').status_code, 401)
+        self.client.force_login(self.user)
+        data = self.client.get('/api/async/departments').json()
+        self.assertEqual([d['title'] for d in data['items']], ['dev'])
+        self.assertEqual(self.client.get('/api/async/employees').json(), {'items': [], 'next_cursor': None})
+
+    async def test_stream_asgi(self):
+        """
+        ASGI 下 Django 在事件循环中迭代流式响应，每块的查询在线程池中执行
+        """
+        await database.run(self.create_employees, 25)
+        await database.run(self.async_client.force_login, self.user)
+        response = await self.async_client.get('/api/employees/stream', {'chunk_size': 10})
+        self.assertEqual(response.status_code, 200)
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        ids = await database.run(lambda: list(Employee.objects.order_by('id').values_list('id', flat=True)))
+        self.assertEqual([row['id'] for row in rows], ids)
+
+    async def test_stream_asgi_saturated(self):
+        """
+        线程池忙时：第一块在视图中查询，之后的块等待超时，响应明确地结束而不是被截断
+        """
+        await database.run(self.create_employees, 25)
+        await database.run(self.async_client.force_login, self.user)
+        executor = DatabaseExecutor(max_workers=1, timeout=0.1)
+        release = threading.Event()
+        executor.submit(release.wait, 5)
+        try:
+            with mock.patch('mysite.asyncdb.database', executor):
+                response = await self.async_client.get('/api/employees/stream', {'chunk_size': 10})
+                self.assertEqual(response.status_code, 200)
+                lines = b''.join(response.streaming_content).splitlines()
+                response = await self.async_client.get('/api/employees/stream', {'format': 'json', 'chunk_size': 10})
+                body = b''.join(response.streaming_content)
+        finally:
+            release.set()
+            executor.shutdown()
+        rows = [json.loads(line) for line in lines]
+        self.assertEqual(len(rows), 11)
+        self.assertIn('did not finish', rows[-1]['error'])
+        self.assertFalse(body.endswith(b']'))
+        with self.assertRaises(ValueError):
+            json.loads(body)
+        self.assertEqual(executor.pending, 0)
+
+    def create_employees(self, count):
+        department = Department.objects.create(title='dev')
+        Employee.objects.bulk_create([
+            Employee(first_name=f'first{i}', last_name=f'last{i}', department=department) for i in range(count)
+        ])
+
+    async def test_timeout_interrupts_sqlite_query(self):
+        executor = DatabaseExecutor(max_workers=1)
+        endless = 'WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c) SELECT count(*) FROM c'
+
+        def run_endless():
+            with connection.cursor() as cursor:
+                cursor.execute(endless)
+
+        with self.assertRaises(QueryTimeout):
+            await executor.run(run_endless, timeout=0.1)
+        # 唯一的工作线程已经被释放
+        self.assertEqual(await executor.run(lambda: 1, timeout=5), 1)
+        executor.shutdown()
+
+    async def test_interruptible_does_not_connect(self):
+        """
+        没有查询时不为主库和从库打开连接
+        """
+        executor = DatabaseExecutor(max_workers=1)
+        self.assertTrue(await executor.run(lambda: connections[DEFAULT_DB_ALIAS].connection is None))
+        executor.shutdown()
+
+    async def test_backpressure(self):
+        executor = DatabaseExecutor(max_workers=1, max_pending=1)
+        started, release = threading.Event(), threading.Event()
+
+        def blocked():
+            started.set()
+            release.wait(5)
+            return 'done'
+
+        task = asyncio.create_task(executor.run(blocked))
+        await asyncio.get_running_loop().run_in_executor(None, started.wait, 5)
+        with self.assertRaises(DatabaseBusy):
+            await executor.run(lambda: 1)
+        release.set()
+        self.assertEqual(await task, 'done')
+        self.assertEqual(executor.pending, 0)
+        executor.shutdown()
+
+    async def test_cancelled_query_is_not_run(self):
+        executor = DatabaseExecutor(max_workers=1)
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def blocked():
+            started.set()
+            release.wait(5)
+
+        first = asyncio.create_task(executor.run(blocked))
+        second = asyncio.create_task(executor.run(calls.append, 1))
+        # first 占用唯一的线程，second 已经提交到线程池排队
+        await asyncio.get_running_loop().run_in_executor(None, started.wait, 5)
+        while executor.pending < 2:
+            await asyncio.sleep(0)
+        second.cancel()
+        # second 结束时已经标记为取消，之后才放行 first
+        with self.assertRaises(asyncio.CancelledError):
+            await second
+        release.set()
+        await first
+        # 线程池按提交顺序执行，第三个查询执行完时 second 一定已经出队
+        await executor.run(lambda: None)
+        executor.shutdown()
+        self.assertEqual(calls, [])
+
+    async def test_queries_share_routing_state(self):
+        executor = DatabaseExecutor(max_workers=1)
+        with routing_state() as state:
+            await executor.run(PrimaryReplicaRouter().db_for_write, Question)
+        executor.shutdown()
+        self.assertTrue(state.written)
+
+
+class TaskRunnerTest(TestCase):
+
+    def setUp(self):
+        self.runner = TaskRunner({'default': {'concurrency': 2, 'max_pending': 3}}, drain_timeout=5)
+        self.addCleanup(self.runner.drain)
+
+    def test_concurrency_limit(self):
+        running, peak = [0], [0]
+
+        async def job(i):
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+            await asyncio.sleep(0.02)
+            running[0] -= 1
+            return i
+
+        runner = TaskRunner({'default': {'concurrency': 2, 'max_pending': 10}})
+        futures = [runner.submit('default', job, i) for i in range(6)]
+        self.assertEqual([f.result(5) for f in futures], list(range(6)))
+        self.assertEqual(peak[0], 2)
+        self.assertTrue(runner.drain())
+        metrics = runner.metrics()['default']
+        self.assertEqual((metrics['submitted'], metrics['completed'], metrics['waiting'], metrics['running']),
+                         (6, 6, 0, 0))
+        self.assertGreater(metrics['wait_ms']['max'], 0)
+
+    def test_backpressure(self):
+        release = threading.Event()
+        futures = [self.runner.submit('default', release.wait, 5) for _ in range(3)]
+        with self.assertRaises(TaskRejected):
+            self.runner.submit('default', release.wait, 5)
+        release.set()
+        self.assertTrue(all(f.result(5) for f in futures))
+        self.assertEqual(self.runner.metrics()['default']['rejected'], 1)
+
+    def test_failure_is_logged(self):
+        def fail():
+            raise ValueError('boom')
+
+        with self.assertLogs('mysite.tasks', 'ERROR'):
+            future = self.runner.submit('default', fail)
+            with self.assertRaises(ValueError):
+                future.result(5)
+            self.runner.drain()
+        self.assertEqual(self.runner.metrics()['default']['failed'], 1)
+
+    def test_drain(self):
+        done = []
+
+        async def job():
+            await asyncio.sleep(0.05)
+            done.append(1)
+
+        for _ in range(3):
+            self.runner.submit('default', job)
+        self.assertTrue(self.runner.drain())
+        self.assertEqual(done, [1, 1, 1])
+        with self.assertRaises(TaskRejected):
+            self.runner.submit('default', job)
+        self.runner.start()
+        self.runner.submit('default', job).result(5)
+
+    def test_drain_timeout_cancels(self):
+        future = self.runner.submit('default', asyncio.sleep, 10)
+        with self.assertLogs('mysite.tasks', 'WARNING'):
+            self.assertFalse(self.runner.drain(timeout=0.05))
+        self.assertTrue(future.cancelled())
+
+    async def test_lifespan(self):
+        messages = [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}]
+        sent = []
+        done = []
+
+        async def receive():
+            if len(sent) == 1:
+                self.runner.submit('default', asyncio.sleep, 0.05).add_done_callback(done.append)
+            return messages[len(sent)]
+
+        async def send(message):
+            sent.append(message['type'])
+
+        await with_lifespan(None, self.runner)({'type': 'lifespan'}, receive, send)
+        self.assertEqual(sent, ['lifespan.startup.complete', 'lifespan.shutdown.complete'])
+        self.assertEqual(len(done), 1)
+
+    def test_async_say_after(self):
+        submitted = background.metrics()['default']['submitted']
+        with mock.patch('builtins.print'), mock.patch('ninjademo.api.task1', mock.AsyncMock()):
+            response = self.client.get('/api/async-say-after', {'delay': 0, 'word': 'hi'})
+        self.assertEqual(response.json(), {'saying': 'hi'})
+        self.assertEqual(background.metrics()['default']['submitted'], submitted + 1)
+
+
+class APIKeyTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.api_key, cls.raw_key = api_keys.create('demo')
+
+    def setUp(self):
+        # 每个测试结束后数据库回滚，进程内的校验缓存不会回滚
+        api_keys.invalidate()
+
+    def test_only_digest_is_stored(self):
+        api_key = APIKey.objects.get()
+        self.assertNotIn(self.raw_key.partition('.')[2], api_key.hashed_key)
+        self.assertEqual(api_key.hashed_key, hash_key(self.raw_key))
+        self.assertEqual(api_key.prefix, self.raw_key.partition('.')[0])
+
+    def test_authenticators(self):
+        self.assertEqual(self.client.get('/api/apikeyheader', HTTP_X_API_KEY=self.raw_key).json(), 'Token = demo')
+        self.assertEqual(self.client.get('/api/apikeyquery', {'api_key': self.raw_key}).json(),
+                         f'Hello {self.api_key.id}')
+        self.assertEqual(self.client.get('/api/bearer', HTTP_AUTHORIZATION=f'Bearer {self.raw_key}').json(),
+                         {'token': 'demo'})
+        self.assertEqual(self.client.get('/api/multipleauth', HTTP_KEY=self.raw_key).status_code, 200)
+        self.client.cookies['key'] = self.raw_key
+        self.assertEqual(self.client.get('/api/apikeycookie').json(), 'Cookie = demo')
+
+    def test_invalid_keys(self):
+        wrong = self.raw_key[:-1] + ('A' if self.raw_key[-1] != 'A' else 'B')
+        for key in ['', 'supersecret', wrong]:
+            self.assertEqual(self.client.get('/api/apikeyheader', HTTP_X_API_KEY=key).status_code, 401)
+        response = self.client.get('/api/bearer1', HTTP_AUTHORIZATION=f'Bearer {wrong}')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json()['detail'], 'Invalid token supplied')
+
+    def test_cached_without_queries(self):
+        wrong = f'{self.api_key.prefix}.wrong'
+        with self.assertNumQueries(1):
+            self.assertEqual(api_keys.verify(self.raw_key), self.api_key)
+        with self.assertNumQueries(1):
+            self.assertIsNone(api_keys.verify(wrong))
+        with self.assertNumQueries(0):
+            for _ in range(3):
+                self.assertEqual(self.client.get('/api/apikeyheader', HTTP_X_API_KEY=self.raw_key).status_code, 200)
+                self.assertEqual(self.client.get('/api/apikeyheader', HTTP_X_API_KEY=wrong).status_code, 401)
+
+    def test_constant_time_compare(self):
+        with mock.patch('ninjademo.apikeys.hmac.compare_digest', wraps=hmac.compare_digest) as compare:
+            api_keys.verify(self.raw_key)
+            api_keys.verify(self.raw_key)
+        self.assertEqual(compare.call_count, 2)
+
+    def test_revoke_invalidates_cache(self):
+        self.assertIsNotNone(api_keys.verify(self.raw_key))
+        api_keys.revoke(self.api_key)
+        self.assertIsNone(api_keys.verify(self.raw_key))
+        self.assertEqual(self.client.get('/api/apikeyheader', HTTP_X_API_KEY=self.raw_key).status_code, 401)
+
+    def test_revoked_in_other_process(self):
+        self.assertIsNotNone(api_keys.verify(self.raw_key))
+        # 其它进程吊销：不经过本进程的缓存，只通过共享缓存中的版本号通知
+        APIKey.objects.filter(pk=self.api_key.pk).update(revoked=True)
+        APIKeyStore().invalidate()
+        self.assertIsNone(api_keys.verify(self.raw_key))
+
+
+class CompositeAuthTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.api_key, cls.raw_key = api_keys.create('demo')
+
+    def setUp(self):
+        api_keys.invalidate()
+
+    def test_multiple_auth(self):
+        self.assertEqual(self.client.get('/api/multipleauth', {'key': self.raw_key}).json(), 'Token = demo')
+        self.assertEqual(self.client.get('/api/multipleauth', HTTP_KEY=self.raw_key).json(), 'Token = demo')
+        self.assertEqual(self.client.get('/api/multipleauth', HTTP_KEY='wrong').status_code, 401)
+        self.assertEqual(self.client.get('/api/multipleauth').status_code, 401)
+
+    def test_adaptive_order(self):
+        from .api import HeaderKey, QueryKey
+        composite = CompositeAuth([QueryKey(), HeaderKey()])
+        request = RequestFactory().get('/', HTTP_KEY=self.raw_key)
+        with mock.patch.object(QueryKey, 'authenticate') as query_authenticate:
+            for _ in range(3):
+                self.assertEqual(composite(request), self.api_key)
+        # 请求中没有 query 参数 key，QueryKey 被跳过
+        query_authenticate.assert_not_called()
+        self.assertIsInstance(composite.order[0], HeaderKey)
+        stats = {s['authenticator']: s for s in composite.stats()}
+        # 第一次成功后 HeaderKey 排到前面，之后不再检查 QueryKey
+        self.assertEqual((stats['HeaderKey']['hits'], stats['QueryKey']['skipped']), (3, 1))
+        request = RequestFactory().get('/', {'key': 'wrong'}, HTTP_KEY=self.raw_key)
+        self.assertEqual(composite(request), self.api_key)
+        self.assertEqual(composite.stats()[1]['calls'], 0)
+
+    def test_credentials_parsed_once(self):
+        from .api import HeaderKey, QueryKey
+        composite = CompositeAuth([HeaderKey(), QueryKey(), HeaderKey()])
+        request = RequestFactory().get('/', HTTP_KEY='wrong')
+        with mock.patch('mysite.security.parse_credentials', wraps=parse_credentials) as parse:
+            self.assertIsNone(composite(request))
+        parse.assert_called_once()
+        self.assertEqual([s['misses'] for s in composite.stats()], [1, 0, 1])
+
+    def test_concurrent_stats(self):
+        """
+        多个请求线程同时更新计数，不丢失
+        """
+        composite = CompositeAuth([lambda request: None, lambda request: 'ok'])
+        request = RequestFactory().get('/')
+        threads, calls = 8, 2000
+        barrier = threading.Barrier(threads)
+
+        def worker():
+            barrier.wait()
+            for _ in range(calls):
+                composite(request)
+
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+        stats = composite.stats()
+        self.assertEqual(sum(s['hits'] for s in stats), threads * calls)
+        self.assertEqual(sum(s['calls'] for s in stats), sum(s['hits'] + s['misses'] for s in stats))
+
+    def test_auth_none_skips_session(self):
+        """
+        auth=None 的接口不加载 session，即使请求带着 session cookie
+        """
+        user = User.objects.create_user(username='ninja', password='ninja')
+        self.client.force_login(user)
+        urls = ['/api/hello', '/api/sync-say-after?delay=0&word=hi', '/api/questions']
+        get_session = mock.Mock(side_effect=AssertionError('session loaded'))
+        with mock.patch.object(SessionBase, '_session', property(get_session)):
+            for url in urls:
+                self.assertEqual(self.client.get(url).status_code, 200)
+            with mock.patch('builtins.print'), mock.patch('ninjademo.api.task1', mock.AsyncMock()):
+                self.assertEqual(self.client.get('/api/async-say-after?delay=0&word=hi').status_code, 200)
+        get_session = mock.Mock(wraps=SessionBase._get_session)
+        with mock.patch.object(SessionBase, '_session', property(get_session)):
+            self.assertEqual(self.client.get('/api/multipleauth/stats').status_code, 200)
+        get_session.assert_called()
+
+
+class SessionEngineTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='ninja', password='ninja')
+
+    def signed_login(self):
+        request = HttpRequest()
+        request.session = signed.SessionStore()
+        login(request, self.user, 'mysite.sessions.users.CachedModelBackend')
+        request.session.save()
+        self.client.cookies[settings.SIGNED_SESSION_COOKIE_NAME] = request.session.session_key
+        return request.session.session_key
+
+    def test_local_sessions_without_queries(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get('/api/pets').status_code, 200)
+        with self.assertNumQueries(0):
+            for _ in range(3):
+                self.assertEqual(self.client.get('/api/pets').json(), 'Authenticated user ninja')
+
+    def test_model_backend_session_still_valid(self):
+        """
+        使用 CachedModelBackend 之前登录的 session 中保存的是 ModelBackend 的路径，部署后仍然有效
+        """
+        self.client.force_login(self.user, backend='django.contrib.auth.backends.ModelBackend')
+        self.assertEqual(self.client.get('/api/pets').json(), 'Authenticated user ninja')
+
+    def test_local_session_logout(self):
+        self.client.force_login(self.user)
+        session_key = self.client.cookies[settings.SESSION_COOKIE_NAME].value
+        self.assertEqual(self.client.get('/api/pets').status_code, 200)
+        local.SessionStore(session_key).flush()
+        self.assertEqual(self.client.get('/api/pets').status_code, 401)
+
+    def test_local_session_changed_in_other_process(self):
+        self.client.force_login(self.user)
+        session_key = self.client.cookies[settings.SESSION_COOKIE_NAME].value
+        self.assertEqual(self.client.get('/api/pets').status_code, 200)
+        # 其它进程删除 session：本进程的缓存只能通过共享缓存中的版本号得知
+        Session.objects.filter(pk=session_key).delete()
+        cache.delete(local.KEY_PREFIX + session_key)
+        LocalCache(local.KEY_PREFIX).invalidate(session_key)
+        self.assertEqual(self.client.get('/api/pets').status_code, 401)
+
+    def test_password_change_invalidates_cached_user(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get('/api/pets').status_code, 200)
+        self.user.set_password('changed')
+        self.user.save()
+        self.assertEqual(self.client.get('/api/pets').status_code, 401)
+
+    @override_settings(SESSION_ENGINES={'/api/': 'mysite.sessions.signed'})
+    def test_signed_sessions(self):
+        self.signed_login()
+        self.assertEqual(self.client.get('/api/pets').status_code, 200)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/api/pets').json(), 'Authenticated user ninja')
+        self.assertEqual(Session.objects.count(), 0)
+
+    @override_settings(SESSION_ENGINES={'/api/': 'mysite.sessions.signed'})
+    def test_signed_session_revocation(self):
+        session_key = self.signed_login()
+        self.assertEqual(self.client.get('/api/pets').status_code, 200)
+        # 退出登录后，之前复制出去的 cookie 也不能再使用
+        signed.SessionStore(session_key).flush()
+        self.assertEqual(self.client.get('/api/pets').status_code, 401)
+
+    def test_signed_cycle_key_revokes_old_cookie(self):
+        session = signed.SessionStore()
+        session['cart'] = [1]
+        session.save()
+        old_key = session.session_key
+        session.cycle_key()
+        self.assertNotEqual(session.session_key, old_key)
+        self.assertEqual(signed.SessionStore(session.session_key)['cart'], [1])
+        self.assertNotIn('cart', signed.SessionStore(old_key))
+
+    @override_settings(SESSION_ENGINES={'/signed/': 'mysite.sessions.signed'})
+    def test_engine_per_path(self):
+        def view(request):
+            if request.GET.get('logout'):
+                request.session.flush()
+            else:
+                request.session['visited'] = True
+            return HttpResponse()
+
+        middleware = SessionMiddleware(view)
+        response = middleware(RequestFactory().get('/signed/'))
+        self.assertEqual(list(response.cookies), [settings.SIGNED_SESSION_COOKIE_NAME])
+        session_key = response.cookies[settings.SIGNED_SESSION_COOKIE_NAME].value
+        self.assertTrue(signed.SessionStore(session_key)['visited'])
+        response = middleware(RequestFactory().get('/other/'))
+        self.assertEqual(list(response.cookies), [settings.SESSION_COOKIE_NAME])
+
+        request = RequestFactory().get('/signed/', {'logout': 1})
+        request.COOKIES[settings.SIGNED_SESSION_COOKIE_NAME] = session_key
+        response = middleware(request)
+        self.assertEqual(list(response.cookies), [settings.SIGNED_SESSION_COOKIE_NAME])
+        self.assertEqual(response.cookies[settings.SIGNED_SESSION_COOKIE_NAME]['max-age'], 0)
+
+
+class MediaRootTestCase(EmployeeApiTestCase):
+    """
+    上传的文件保存在临时目录中
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root, FILE_UPLOAD_TEMP_DIR=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def stored_files(self):
+        directory = os.path.join(self.media_root, 'uploads')
+        return sorted(os.listdir(directory)) if os.path.isdir(directory) else []
+
+
+class UploadTest(MediaRootTestCase):
+    def test_upload(self):
+        content = b'ninja' * 1000
+        response = self.client.post('/api/upload', {'file': SimpleUploadedFile('a.txt', content)})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['len'], len(content))
+        self.assertEqual(data['sha256'], hashlib.sha256(content).hexdigest())
+        with open(os.path.join(self.media_root, data['path']), 'rb') as f:
+            self.assertEqual(f.read(), content)
+
+    def test_upload_multi_keeps_order(self):
+        files = [SimpleUploadedFile(f'{i}.txt', str(i).encode() * (i + 1)) for i in range(6)]
+        response = self.client.post('/api/uploadmulti', {'file': files})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['name'] for item in response.json()], [f'{i}.txt' for i in range(6)])
+        self.assertEqual([item['len'] for item in response.json()], list(range(1, 7)))
+        self.assertEqual(len(self.stored_files()), 6)
+
+    @override_settings(UPLOAD_MAX_FILE_SIZE=1024, UPLOAD_CHUNK_SIZE=256)
+    def test_file_too_large(self):
+        files = [SimpleUploadedFile('small.txt', b'x' * 100), SimpleUploadedFile('big.txt', b'x' * 2048)]
+        response = self.client.post('/api/uploadmulti', {'file': files})
+        self.assertEqual(response.status_code, 413)
+        self.assertIn('big.txt', response.json()['detail'])
+        self.assertEqual(self.stored_files(), [])
+        self.assertEqual(os.listdir(self.media_root), [])
+
+    @override_settings(UPLOAD_MAX_REQUEST_SIZE=1024 * 1024)
+    def test_request_too_large_rejected_before_reading(self):
+        cookies = f'{settings.SESSION_COOKIE_NAME}={self.client.cookies[settings.SESSION_COOKIE_NAME].value}'
+        upload = SyntheticUpload([('big.bin', 2 * 1024 * 1024)])
+        response = post_upload('/api/upload', upload, cookies)
+        self.assertEqual(response.status_code, 413)
+        # 请求体一块都没有读取
+        self.assertEqual(upload.sha256, {})
+
+    def test_streaming_upload_memory(self):
+        cookies = f'{settings.SESSION_COOKIE_NAME}={self.client.cookies[settings.SESSION_COOKIE_NAME].value}'
+        size = 32 * 1024 * 1024
+        upload = SyntheticUpload([('synthetic.bin', size)])
+        tracemalloc.start()
+        try:
+            response = post_upload('/api/upload', upload, cookies)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['sha256'], upload.sha256['synthetic.bin'])
+        self.assertEqual(os.path.getsize(os.path.join(self.media_root, 'uploads', 'synthetic.bin')), size)
+        # 内存中只有几块数据，和文件大小无关
+        self.assertLess(peak, 8 * 1024 * 1024)
+
+    def test_handler_counts_request_size(self):
+        handler = StreamingUploadHandler(max_file_size=100, max_request_size=150, chunk_size=50)
+        handler.new_file('file', 'a.txt', 'text/plain', 100)
+        handler.receive_data_chunk(b'x' * 100, 0)
+        handler.file_complete(100)
+        handler.new_file('file', 'b.txt', 'text/plain', 100)
+        with self.assertRaisesMessage(UploadTooLarge, 'request body exceeds 150 bytes'):
+            handler.receive_data_chunk(b'x' * 60, 0)
+
+
+class DownloadTest(MediaRootTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.content = bytes(range(256)) * 400
+        os.makedirs(os.path.join(self.media_root, 'uploads'))
+        with open(os.path.join(self.media_root, 'uploads', 'data.bin'), 'wb') as f:
+            f.write(self.content)
+
+    def download(self, **headers):
+        return self.client.get('/api/download/uploads/data.bin', **headers)
+
+    def test_download(self):
+        response = self.download()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(response['Content-Length'], str(len(self.content)))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Content-Type'], 'application/octet-stream')
+
+    def test_range(self):
+        response = self.download(HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{len(self.content)}')
+        self.assertEqual(response['Content-Length'], '100')
+        self.assertEqual(b''.join(response.streaming_content), self.content[100:200])
+
+    def test_resume(self):
+        # 下载中断后带上 ETag 从断点继续
+        first = self.download(HTTP_RANGE='bytes=0-999')
+        received = b''.join(first.streaming_content)
+        response = self.download(HTTP_RANGE=f'bytes={len(received)}-', HTTP_IF_RANGE=first['ETag'])
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(received + b''.join(response.streaming_content), self.content)
+
+    def test_if_range_changed_file(self):
+        etag = self.download()['ETag']
+        path = os.path.join(self.media_root, 'uploads', 'data.bin')
+        with open(path, 'ab') as f:
+            f.write(b'more')
+        response = self.download(HTTP_RANGE='bytes=1000-', HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.content + b'more')
+
+    def test_not_modified(self):
+        etag = self.download()['ETag']
+        response = self.download(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_unsatisfiable_range(self):
+        response = self.download(HTTP_RANGE=f'bytes={len(self.content)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.content)}')
+
+    def test_head(self):
+        response = self.client.head('/api/download/uploads/data.bin', HTTP_RANGE='bytes=-10')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Length'], '10')
+        self.assertEqual(b''.join(response.streaming_content), b'')
+
+    def test_missing_file(self):
+        self.assertEqual(self.client.get('/api/download/uploads/missing.bin').status_code, 404)
+        self.assertEqual(self.client.get('/api/download/uploads').status_code, 404)
+        self.assertEqual(self.client.get('/api/download/../settings.py').status_code, 400)
+
+    def test_parse_range(self):
+        self.assertEqual(parse_range('bytes=0-0', 10), (0, 1))
+        self.assertEqual(parse_range('bytes=5-', 10), (5, 5))
+        self.assertEqual(parse_range('bytes=-3', 10), (7, 3))
+        self.assertEqual(parse_range('bytes=-30', 10), (0, 10))
+        self.assertEqual(parse_range('bytes=8-100', 10), (8, 2))
+        self.assertIsNone(parse_range('bytes=0-1,5-6', 10))
+        self.assertIsNone(parse_range('items=0-1', 10))
+        self.assertIsNone(parse_range('bytes=5-1', 10))
+        self.assertIsNone(parse_range('bytes=a-b', 10))
+        with self.assertRaises(ValueError):
+            parse_range('bytes=10-', 10)
+
+    def test_range_file_for_sendfile(self):
+        # gunicorn 等服务器从文件描述符的当前位置开始 sendfile Content-Length 字节
+        file = RangeFile(os.path.join(self.media_root, 'uploads', 'data.bin'), 1000, 500)
+        try:
+            self.assertEqual(os.lseek(file.fileno(), 0, os.SEEK_CUR), 1000)
+            self.assertEqual(b''.join(iter(lambda: file.read(128), b'')), self.content[1000:1500])
+        finally:
+            file.close()
+
+
+class SearchIndexTest(TestCase):
+
+    def test_same_results_as_substring_scan(self):
+        rng = random.Random(0)
+        texts = [''.join(rng.choices('abcd ', k=rng.randint(0, 12))) for _ in range(500)]
+        index = SearchIndex()
+        index.add_many(enumerate(texts))
+        for q in ['a', 'ab', 'abc', 'dcba', ' a', 'a b', 'e', '']:
+            expected = {i for i, text in enumerate(texts) if all(term in text for term in q.split())} if q else set()
+            total, ids = index.search(q, limit=None)
+            self.assertEqual(total, len(expected), q)
+            self.assertEqual(set(ids), expected, q)
+
+    def test_update_and_remove(self):
+        index = SearchIndex()
+        index.add_many([(1, 'Katana'), (2, 'Kama')])
+        index.add(1, 'Wakizashi')
+        index.remove(2)
+        self.assertEqual(index.search('ki'), (1, [1]))
+        self.assertEqual(index.search('katana'), (0, []))
+        self.assertEqual(len(index), 1)
+
+    def test_compact(self):
+        index = SearchIndex()
+        for i in range(2000):
+            index.add(i % 10, f'text number {i}')
+        self.assertEqual(len(index), 10)
+        self.assertLess(index._stale, 2000)
+        self.assertEqual(index.search('number 1999'), (1, [9]))
+
+    def test_weapons_search(self):
+        user = User.objects.create_user(username='ninja', password='ninja')
+        self.client.force_login(user)
+        self.assertEqual(self.client.get('/api/weapons/search', {'q': 'ka'}).json(), ['Kama', 'Katana'])
+        self.assertEqual(self.client.get('/api/weapons/search', {'q': 'Kun'}).json(), ['Kunai'])
+        self.assertEqual(self.client.get('/api/weapons/search', {'q': 'a', 'offset': 6}).json(), [])
+        self.assertEqual(self.client.get('/api/weapons/search', {'q': ''}).json(), weapons)
+        self.assertEqual(self.client.get('/api/weapons/search', {'q': '', 'offset': 5}).json(), weapons[5:])
+
+
+class FilterTest(EmployeeApiTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.ops = Department.objects.create(title='ops')
+        names = ['Smith', 'Smyth', 'Jones', 'Brown', 'Smith', 'Taylor', 'Sm', 'Johnson']
+        Employee.objects.bulk_create([
+            Employee(first_name=f'first{i}', last_name=name, department=cls.department if i % 2 else cls.ops)
+            for i, name in enumerate(names)
+        ])
+        cls.filters = FilterSet(
+            Employee,
+            fields={'query': 'last_name__startswith', 'category__in': 'department__title__in'},
+            orderings=['id', 'last_name', 'department'],
+            max_limit=3,
+            keyset_threshold=2,
+        )
+
+    def values(self):
+        return Employee.objects.values('id', 'last_name', 'department_id')
+
+    def test_filter(self):
+        response = self.client.get('/api/filter', {'query': 'Sm', 'categories': ['ops'], 'order': '-last_name'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['last_name'] for item in response.json()['items']], ['Smith', 'Smith', 'Sm'])
+        self.assertEqual(len(self.client.get('/api/filter', {'limit': 1000}).json()['items']), 8)
+
+    def test_rejected(self):
+        for params in ({'order': 'first_name'}, {'order': '-brithdate'}, {'cursor': 'xyz'}, {'limit': 0}):
+            response = self.client.get('/api/filter', params)
+            self.assertEqual(response.status_code, 400, params)
+        with self.assertRaises(FilterError):
+            self.filters.filter(self.values(), {'first_name': 'x'})
+        with self.assertRaises(FilterError):
+            self.filters.filter(self.values(), {'category__in': [str(i) for i in range(101)]})
+
+    def test_unindexed_configuration(self):
+        with self.assertRaisesMessage(ImproperlyConfigured, 'not indexed'):
+            FilterSet(Employee, fields={'name': 'first_name'})
+        with self.assertRaisesMessage(ImproperlyConfigured, 'must be indexed and not null'):
+            FilterSet(Employee, fields={}, orderings=['brithdate'])
+
+    def test_limit_capped(self):
+        page = self.filters.paginate(self.values(), {'limit': 100})
+        self.assertEqual(len(page['items']), 3)
+
+    def test_cursor_pagination(self):
+        for order in ('id', '-id', 'last_name', '-last_name', 'department', '-department'):
+            expected = list(self.filters.filter(self.values(), {}).order_by(
+                order.replace('department', 'department_id'), ('-' if order.startswith('-') else '') + 'pk'))
+            items, cursor = [], None
+            while True:
+                page = self.filters.paginate(self.values(), {'order': order, 'cursor': cursor})
+                items += page['items']
+                cursor = page['next_cursor']
+                if cursor is None:
+                    break
+            self.assertEqual(items, expected, order)
+
+    def test_large_offset_uses_keyset(self):
+        for order in ('id', 'last_name', '-department'):
+            for offset in range(9):
+                with_offset = FilterSet(Employee, fields={}, orderings=[order.lstrip('-')], max_limit=3,
+                                        keyset_threshold=100).paginate(self.values(), {'order': order, 'offset': offset})
+                page = self.filters.paginate(self.values(), {'order': order, 'offset': offset})
+                self.assertEqual(page, with_offset, (order, offset))
+
+    def test_query_plans(self):
+        """
+        各种参数组合生成的查询都使用索引，没有全表扫描
+        """
+        cursor = self.filters.paginate(self.values(), {'order': 'last_name', 'limit': 1})['next_cursor']
+        cases = [
+            {}, {'query': 'Sm'}, {'category__in': ['dev', 'ops']}, {'order': 'last_name'},
+            {'order': '-department'}, {'query': 'Sm', 'order': '-last_name'}, {'category__in': ['dev'], 'order': 'id'},
+            {'order': 'last_name', 'cursor': cursor}, {'order': '-last_name', 'offset': 5},
+            {'query': 'S', 'offset': 5, 'order': 'last_name'}, {'offset': 1},
+        ]
+        for params in cases:
+            with CaptureQueriesContext(connection) as ctx:
+                self.filters.paginate(self.values(), params)
+            for query in ctx.captured_queries:
+                self.assertEqual(full_scans(query['sql']), [], (params, query['sql']))
+        # 没有索引的条件会被发现
+        self.assertNotEqual(full_scans(Employee.objects.filter(first_name='x')), [])
+        self.assertNotEqual(full_scans(Employee.objects.order_by('first_name')), [])
+
+
+class ConnectionPoolTest(TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.name = os.path.join(directory, 'pool.sqlite3')
+        self.handler = ConnectionHandler({
+            'default': {
+                'ENGINE': 'mysite.db.sqlite3', 'NAME': self.name, 'CONN_MAX_AGE': 0,
+                'OPTIONS': {
+                    'pool': {'max_size': 2, 'timeout': 0.1, 'health_check_interval': 0},
+                    'pragmas': {'journal_mode': 'wal', 'busy_timeout': 1000},
+                },
+            },
+        })
+        self.addCleanup(self.close_pool)
+
+    def close_pool(self):
+        self.handler.close_all()
+        pool = pools.pop(f'default:{self.name}', None)
+        if pool is not None:
+            pool.close()
+
+    def test_connection_is_reused(self):
+        db = self.handler['default']
+        db.ensure_connection()
+        raw = db.connection
+        db.close()
+        db.ensure_connection()
+        self.assertIs(db.connection, raw)
+        metrics = db.get_pool().metrics()
+        self.assertEqual((metrics['created'], metrics['acquired'], metrics['in_use']), (1, 2, 1))
+
+    def test_pragmas_applied(self):
+        with self.handler['default'].cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 1000)
+
+    def test_open_transaction_is_rolled_back_on_release(self):
+        db = self.handler['default']
+        with db.cursor() as cursor:
+            cursor.execute('CREATE TABLE item (id INTEGER PRIMARY KEY)')
+        db.connection.execute('BEGIN')
+        db.connection.execute('INSERT INTO item VALUES (1)')
+        db.close()
+        with db.cursor() as cursor:
+            self.assertFalse(db.connection.in_transaction)
+            cursor.execute('SELECT count(*) FROM item')
+            self.assertEqual(cursor.fetchone()[0], 0)
+
+    def test_exhausted_pool_raises_operational_error(self):
+        pool = self.handler['default'].get_pool()
+        held = [pool.acquire(), pool.acquire()]
+        self.addCleanup(lambda: [pool.release(conn) for conn in held])
+        with self.assertRaises(OperationalError):
+            self.handler['default'].ensure_connection()
+        self.assertEqual(pool.metrics()['timeouts'], 1)
+
+    def test_waiter_gets_released_connection(self):
+        pool = self.handler['default'].get_pool()
+        held = [pool.acquire(), pool.acquire()]
+        threading.Timer(0.02, pool.release, [held[0]]).start()
+        conn = pool.acquire(timeout=5)
+        self.assertIs(conn, held[0])
+        pool.release(conn)
+        pool.release(held[1])
+        self.assertEqual(pool.metrics()['waits'], 1)
+
+    def test_unhealthy_connection_is_replaced(self):
+        pool = self.handler['default'].get_pool()
+        conn = pool.acquire()
+        pool.release(conn)
+        conn.close()
+        replacement = pool.acquire()
+        self.assertIsNot(replacement, conn)
+        replacement.execute('SELECT 1')
+        pool.release(replacement)
+        metrics = pool.metrics()
+        self.assertEqual((metrics['health_check_failures'], metrics['created'], metrics['closed']), (1, 2, 1))
+
+    def test_expired_connection_is_closed(self):
+        pool = ConnectionPool(lambda: mock.Mock(), max_lifetime=0)
+        conn = pool.acquire()
+        pool.release(conn)
+        self.assertIsNot(pool.acquire(), conn)
+        conn.close.assert_called_once_with()
+
+    def test_closed_pool(self):
+        pool = ConnectionPool(lambda: mock.Mock())
+        conn = pool.acquire()
+        pool.close()
+        pool.release(conn)
+        conn.close.assert_called_once_with()
+        with self.assertRaises(PoolTimeout):
+            pool.acquire()
+
+    def test_in_memory_database_is_not_pooled(self):
+        handler = ConnectionHandler({'default': {
+            'ENGINE': 'mysite.db.sqlite3', 'NAME': ':memory:', 'OPTIONS': {'pool': {'max_size': 1}},
+        }})
+        self.assertIsNone(handler['default'].get_pool())
+
+    def test_metrics_endpoint(self):
+        self.handler['default'].ensure_connection()
+        self.client.force_login(User.objects.create_user(username='ninja', password='ninja'))
+        response = self.client.get('/api/db/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[f'default:{self.name}']['in_use'], 1)
+
+
+@override_settings(DATABASE_REPLICAS=['replica1', 'replica2'], DATABASE_REPLICA_STICKY_SECONDS=5)
+class ReplicaRoutingTest(SimpleTestCase):
+    """
+    只检查路由结果，不查询数据库；TestCase 中的查询都在事务里，读总是发到主库
+    """
+
+    def setUp(self):
+        self.router = PrimaryReplicaRouter()
+        self.factory = RequestFactory()
+
+    def read(self):
+        return self.router.db_for_read(Question)
+
+    def test_without_replicas(self):
+        with self.settings(DATABASE_REPLICAS=[]):
+            self.assertEqual(self.read(), 'default')
+
+    def test_reads_go_to_replicas_and_writes_to_primary(self):
+        self.assertEqual({self.read() for _ in range(50)}, {'replica1', 'replica2'})
+        self.assertEqual(self.router.db_for_write(Question), 'default')
+
+    def test_read_your_writes_in_request(self):
+        with routing_state():
+            self.assertIn(self.read(), ['replica1', 'replica2'])
+            self.router.db_for_write(Question)
+            self.assertEqual(self.read(), 'default')
+        self.assertNotEqual(self.read(), 'default')
+
+    def test_use_primary(self):
+        with routing_state():
+            with use_primary():
+                self.assertEqual(self.read(), 'default')
+            self.assertNotEqual(self.read(), 'default')
+        with use_primary():
+            self.assertEqual(self.read(), 'default')
+
+    def test_atomic_block_reads_primary(self):
+        with mock.patch.object(connections['default'], 'in_atomic_block', True):
+            self.assertEqual(self.read(), 'default')
+
+    def test_replicas_are_not_migrated(self):
+        self.assertFalse(self.router.allow_migrate('replica1', 'polls'))
+        self.assertIsNone(self.router.allow_migrate('default', 'polls'))
+
+    def route(self, request, write=False):
+        reads = []
+
+        def view(request):
+            if write:
+                self.router.db_for_write(Question)
+            reads.append(self.read())
+            return HttpResponse()
+
+        response = ReplicaRoutingMiddleware(view)(request)
+        return reads[0], response
+
+    def test_middleware_sticks_to_primary_after_write(self):
+        db, response = self.route(self.factory.get('/'))
+        self.assertNotEqual(db, 'default')
+        self.assertNotIn(COOKIE_NAME, response.cookies)
+
+        db, response = self.route(self.factory.get('/'), write=True)
+        self.assertEqual(db, 'default')
+        cookie = response.cookies[COOKIE_NAME]
+        self.assertEqual(cookie['max-age'], 5)
+
+        request = self.factory.get('/')
+        request.COOKIES[COOKIE_NAME] = cookie.value
+        self.assertEqual(self.route(request)[0], 'default')
+        with mock.patch('time.time', return_value=float(cookie.value) + 1):
+            self.assertNotEqual(self.route(request)[0], 'default')
+
+    def test_middleware_pins_unsafe_methods(self):
+        self.assertEqual(self.route(self.factory.post('/'))[0], 'default')
+
+    def test_forged_cookie_is_ignored(self):
+        request = self.factory.get('/')
+        request.COOKIES[COOKIE_NAME] = str(9e12)
+        self.assertNotEqual(self.route(request)[0], 'default')
+
+
+class ReplicationTest(SimpleTestCase):
+
+    def test_replicate(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        primary, replica = os.path.join(directory, 'primary.sqlite3'), os.path.join(directory, 'replica.sqlite3')
+        conn = sqlite3.connect(primary)
+        self.addCleanup(conn.close)
+        conn.execute('PRAGMA journal_mode = wal')
+        conn.execute('CREATE TABLE item (id INTEGER PRIMARY KEY)')
+        conn.executemany('INSERT INTO item VALUES (?)', [(i,) for i in range(100)])
+        conn.commit()
+
+        self.assertEqual(list(replicate(primary, [replica], pages=1)), [replica])
+        reader = sqlite3.connect(replica)
+        self.addCleanup(reader.close)
+        self.assertEqual(reader.execute('SELECT count(*) FROM item').fetchone()[0], 100)
+
+        # 复制之前从库上的读看到的是旧数据
+        conn.execute('DELETE FROM item WHERE id >= 50')
+        conn.commit()
+        self.assertEqual(reader.execute('SELECT count(*) FROM item').fetchone()[0], 100)
+        replicate(primary, [replica])
+        self.assertEqual(reader.execute('SELECT count(*) FROM item').fetchone()[0], 50)
+
+
+class ProfilingTest(EmployeeApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        override = self.settings(PROFILING_ENABLED=True, PROFILING_SNAPSHOT_DIR=directory)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.directory = directory
+        profiling.stats.clear()
+        self.addCleanup(profiling.stats.clear)
+
+    def test_disabled_middleware_is_not_loaded(self):
+        with self.settings(PROFILING_ENABLED=False):
+            with self.assertRaises(MiddlewareNotUsed):
+                profiling.ProfilingMiddleware(lambda request: HttpResponse())
+            self.assertNotIn('Server-Timing', self.client.get('/api/employees/page'))
+
+    def test_operation_stats_and_server_timing(self):
+        self.create_employees(3)
+        response = self.client.get('/api/employees/page')
+        self.assertEqual(response.status_code, 200)
+        timing = response['Server-Timing']
+        self.assertRegex(timing, r'^db;desc="\d+ queries";dur=[\d.]+, ser;dur=[\d.]+, total;dur=[\d.]+$')
+
+        stats = profiling.stats.merged()['GET api-1.0.0:get_employees_page'].summary()
+        self.assertEqual(stats['count'], 1)
+        self.assertGreaterEqual(stats['queries'], 1)
+        self.assertEqual(stats['size'], len(response.content))
+        self.assertGreater(stats['p50'], 0)
+
+    def test_duplicate_queries(self):
+        def view(request):
+            for employee in Employee.objects.order_by('id'):
+                employee.department.title
+            return HttpResponse()
+
+        self.create_employees(3)
+        request = RequestFactory().get('/polls/')
+        request.resolver_match = resolve('/polls/')
+        response = profiling.ProfilingMiddleware(view)(request)
+        self.assertIn('4 queries, 2 duplicate', response['Server-Timing'])
+        stats = profiling.stats.merged()['GET polls:index'].summary()
+        self.assertEqual((stats['queries'], stats['duplicates']), (4, 2))
+        self.assertIn('"ninjademo_department"', stats['top_duplicate'])
+
+    def test_histogram_percentiles(self):
+        histogram = profiling.Histogram()
+        for value in range(1, 1001):
+            histogram.record(value)
+        other = profiling.Histogram(json.loads(json.dumps(histogram.buckets)))
+        histogram.merge(other)
+        self.assertEqual(histogram.count, 2000)
+        for p in (50, 95, 99):
+            self.assertAlmostEqual(histogram.percentile(p), p * 10, delta=p * 10 * 0.05)
+
+    def test_window_expires(self):
+        window = profiling.RollingStats(window=60, slots=6)
+        window.record('GET a', profiling.RequestProfile(), 1.0, 10, now=1000)
+        window.record('GET a', profiling.RequestProfile(), 2.0, 10, now=1030)
+        self.assertEqual(window.merged(now=1031)['GET a'].count, 2)
+        self.assertEqual(window.merged(now=1061)['GET a'].count, 1)
+        self.assertEqual(window.merged(now=1100), {})
+
+    def test_report_merges_snapshots(self):
+        self.client.get('/api/employees/page')
+        self.client.get('/polls/')
+        profiling.SnapshotWriter(profiling.stats, self.directory, 5).write()
+        # 另一个进程的统计
+        shutil.copy(os.path.join(self.directory, f'{os.getpid()}.json'), os.path.join(self.directory, '0.json'))
+        out = StringIO()
+        call_command('profile_report', '--json', stdout=out)
+        rows = {row['endpoint']: row for row in json.loads(out.getvalue())}
+        self.assertEqual(rows['GET api-1.0.0:get_employees_page']['count'], 2)
+        self.assertEqual(rows['GET polls:index']['count'], 2)
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'], PROFILING_ENABLED=False, RATELIMIT_ENABLED=False)
+class LoadTestTest(TransactionTestCase):
+    """
+    压测的请求在其它线程的连接中执行，使用 TransactionTestCase；和 loadtest 命令一样关闭 ProfilingMiddleware 和限流
+    """
+
+    def test_run_routes(self):
+        dataset = loadtest.seed(questions=10, departments=2, employees=20)
+        self.assertEqual(Employee.objects.count(), 20)
+        routes = [route for route in loadtest.ROUTES
+                  if route.name in ('polls:index', 'polls:vote', 'api:get_employee', 'api:async_employees',
+                                    'api:stream_employees')]
+        votes = Choice.objects.aggregate(votes=Sum('votes'))['votes']
+        results = loadtest.run(routes, dataset, concurrency=2, requests=4, warmup=0)
+        self.assertEqual(len(results['results']), 10)
+        for key, result in results['results'].items():
+            self.assertEqual((result['requests'], result['errors'], result['error']), (4, 0, None), key)
+            self.assertGreater(result['rps'], 0)
+        self.assertEqual(loadtest.crashes(results), [])
+        self.assertGreaterEqual(results['results']['wsgi POST polls:vote']['queries'], 2)
+        self.assertEqual(Choice.objects.aggregate(votes=Sum('votes'))['votes'] - votes, 8)
+
+    def test_unexpected_status_is_an_error(self):
+        dataset = loadtest.seed(questions=2, departments=1, employees=1)
+        route = loadtest.Route('missing', 'GET', '/polls/0/')
+        result = loadtest.run([route], dataset, ['wsgi'], concurrency=1, requests=2, warmup=0)['results']
+        self.assertEqual(result['wsgi GET missing']['errors'], 2)
+        self.assertEqual(result['wsgi GET missing']['error'], 'status 404')
+
+    def test_uncovered_routes(self):
+        uncovered = loadtest.uncovered_routes()
+        self.assertIn('api/login', uncovered)
+        self.assertNotIn('api/hello', uncovered)
+        self.assertNotIn('polls/<int:pk>/', uncovered)
+        self.assertFalse([route for route in uncovered if route.startswith('admin/')])
+
+    def test_compare(self):
+        def results(p95, rps, queries, errors=0):
+            return {'meta': {'concurrency': 4}, 'results': {'wsgi GET polls:index': {
+                'p95': p95, 'rps': rps, 'queries': queries, 'errors': errors}}}
+
+        baseline = results(10.0, 400, 2)
+        self.assertEqual(loadtest.compare(results(11.0, 380, 2), baseline), [])
+        # 亚毫秒级的变化不算退化
+        self.assertEqual(loadtest.compare(results(0.9, 4000, 0), results(0.5, 8000, 0)), [])
+        regressions = loadtest.compare(results(13.0, 300, 3, errors=1), baseline)
+        self.assertEqual(len(regressions), 4)
+        self.assertIn('p95 13.00ms > 12.00ms', regressions[0])
+        # 抛出异常的路由即使基线中也有同样的错误，也算失败
+        crashed = results(10.0, 400, 2, errors=2)
+        crashed['results']['wsgi GET polls:index'].update(exceptions=2, error='SynchronousOnlyOperation: ...')
+        self.assertEqual(loadtest.compare(crashed, crashed),
+                         ['wsgi GET polls:index: 2 requests raised SynchronousOnlyOperation: ...'])
+
+
+class RateLimitTest(TestCase):
+
+    def setUp(self):
+        ratelimit.get_store().clear()
+        self.addCleanup(ratelimit.get_store().clear)
+        self.factory = RequestFactory()
+
+    def check(self, limit, now, **extra):
+        with mock.patch('time.time', return_value=now):
+            limit.check(self.factory.get('/', **extra))
+
+    def test_parse_rate(self):
+        self.assertEqual(parse_rate('10/s'), (10, 1))
+        self.assertEqual(parse_rate('100/m'), (100, 60))
+        self.assertEqual(parse_rate('5/10m'), (5, 600))
+        for rate in ['10', '0/s', '10/w', '1.5/s']:
+            with self.assertRaises(ValueError):
+                parse_rate(rate)
+
+    def test_token_bucket(self):
+        limit = RateLimit('2/s', scope='test', store=LocalStore())
+        self.check(limit, 1000.0)
+        self.check(limit, 1000.0)
+        with self.assertRaises(RateLimited) as cm:
+            self.check(limit, 1000.1)
+        self.assertAlmostEqual(cm.exception.retry_after, 0.4)
+        # 每 0.5 秒补充一个令牌，其它客户端不受影响
+        self.check(limit, 1000.5)
+        self.check(limit, 1000.5, REMOTE_ADDR='10.0.0.1')
+        # 空闲之后最多攒 burst 个
+        for _ in range(2):
+            self.check(limit, 2000.0)
+        with self.assertRaises(RateLimited):
+            self.check(limit, 2000.0)
+        self.assertEqual((limit.allowed, limit.throttled), (6, 2))
+
+        burst = RateLimit('1/m', burst=3, scope='burst', store=LocalStore())
+        for _ in range(3):
+            self.check(burst, 1000.0)
+        with self.assertRaises(RateLimited) as cm:
+            self.check(burst, 1000.0)
+        self.assertAlmostEqual(cm.exception.retry_after, 60)
+
+    def test_local_store_evicts_least_recent(self):
+        store = LocalStore(size=2)
+        for key in ['a', 'b', 'a', 'c']:
+            store.consume(key, 1000.0, 1, 10)
+        self.assertEqual(list(store._data), ['a', 'c'])
+
+    def test_cache_store(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        limit = RateLimit('1/s', burst=2, scope='shared', store=CacheStore('default'))
+        self.check(limit, 1000.0)
+        self.check(limit, 1000.5)
+        with self.assertRaises(RateLimited) as cm:
+            self.check(limit, 1001.5)
+        # 每 2 秒一个窗口，到下一个窗口开始
+        self.assertAlmostEqual(cm.exception.retry_after, 0.5)
+        self.check(limit, 1002.0)
+        # 缓存不可用时不限流
+        with mock.patch.object(cache, 'incr', side_effect=ConnectionError):
+            self.check(limit, 1002.0)
+            self.check(limit, 1002.0)
+
+    def test_cache_store_concurrent_burst(self):
+        """
+        同时到达的请求（多个进程/线程）不会都读到空桶：limit 为 1 时只放过一个
+        """
+        cache.clear()
+        self.addCleanup(cache.clear)
+        store = CacheStore('default')
+        threads = 20
+        barrier = threading.Barrier(threads)
+        waits = []
+
+        def worker():
+            barrier.wait()
+            waits.append(store.consume('burst', 1000.0, 1.0, 1))
+
+        def slow(method):
+            # 模拟共享缓存的网络往返，让并发的请求交错执行
+            def call(*args, **kwargs):
+                time.sleep(0.001)
+                return method(*args, **kwargs)
+            return call
+
+        with contextlib.ExitStack() as stack:
+            for name in ['get', 'set', 'add', 'incr']:
+                stack.enter_context(mock.patch.object(LocMemCache, name, slow(getattr(LocMemCache, name))))
+            workers = [threading.Thread(target=worker) for _ in range(threads)]
+            for t in workers:
+                t.start()
+            for t in workers:
+                t.join()
+        self.assertEqual(waits.count(0.0), 1)
+
+    def test_keys(self):
+        request = self.factory.get('/', REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(ratelimit.KEY_FUNCTIONS['ip'](request), 'ip:10.0.0.1')
+        request.user = User(pk=7)
+        self.assertEqual(ratelimit.KEY_FUNCTIONS['user'](request), 'user:7')
+        self.assertEqual(ratelimit.KEY_FUNCTIONS['auth'](request), 'ip:10.0.0.1')
+        request.auth = 'secret-token'
+        key = ratelimit.KEY_FUNCTIONS['auth'](request)
+        self.assertTrue(key.startswith('auth:'))
+        self.assertNotIn('secret', key)
+        request.auth = APIKey(pk=3)
+        self.assertEqual(ratelimit.KEY_FUNCTIONS['auth'](request), 'ninjademo.apikey:3')
+
+    def test_operation_limit(self):
+        url = '/api/sync-say-after?delay=0&word=hi'
+        # 先限流再校验参数，校验失败的请求也用掉一个令牌
+        self.assertEqual(self.client.get('/api/sync-say-after?delay=11&word=hi').status_code, 422)
+        for _ in range(9):
+            self.assertEqual(self.client.get(url).status_code, 200)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '6')
+        self.assertEqual(response.json()['error'], 'Rate limit 10/m exceeded')
+        with self.settings(RATELIMIT_ENABLED=False):
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_router_limit_is_shared(self):
+        router = Router()
+        router.get('/a')(lambda request: 'a')
+        router.get('/b')(lambda request: 'b')
+        limit_router(router, RateLimit('2/m', scope='router', store=LocalStore()))
+        api = renderers.NinjaAPI(urls_namespace='ratelimit-test')
+        api.add_router('/', router)
+        protect_api(api)
+        view_a, view_b = (router.path_operations[path].get_view() for path in ['/a', '/b'])
+        self.assertEqual(view_a(self.factory.get('/a')).status_code, 200)
+        self.assertEqual(view_b(self.factory.get('/b')).status_code, 200)
+        response = view_a(self.factory.get('/a'))
+        self.assertEqual((response.status_code, response['Retry-After']), (429, '30'))
+
+    def test_service_unavailable_has_retry_after(self):
+        self.client.force_login(User.objects.create_user(username='ninja', password='ninja'))
+        with mock.patch('random.choice', return_value=True):
+            response = self.client.get('/api/exc')
+        self.assertEqual((response.status_code, response['Retry-After']), (503, '1'))
+
+    def test_concurrency_limit(self):
+        limiter = ratelimit.concurrency
+        rejected = limiter.rejected
+        with self.settings(RATELIMIT_MAX_CONCURRENT=2), mock.patch.object(limiter, 'active', 2):
+            response = self.client.get('/api/hello')
+            self.assertEqual((response.status_code, response['Retry-After']), (503, '1'))
+            self.assertEqual(self.client.get('/apis/blogs/blogs').status_code, 503)
+        self.assertEqual(limiter.rejected, rejected + 2)
+        self.assertEqual(self.client.get('/api/hello').status_code, 200)
+        self.assertEqual(limiter.active, 0)
+
+    async def test_concurrency_limit_async(self):
+        with self.settings(RATELIMIT_MAX_CONCURRENT=1):
+            with mock.patch.object(ratelimit.concurrency, 'active', 1):
+                self.assertEqual((await self.async_client.get('/api/questions')).status_code, 503)
+            self.assertEqual((await self.async_client.get('/api/questions')).status_code, 200)
+        self.assertEqual(ratelimit.concurrency.active, 0)
+
+    def test_concurrency_limiter(self):
+        limiter = ConcurrencyLimiter(1, retry_after=3)
+        limiter.acquire()
+        with self.assertRaises(ratelimit.Overloaded) as cm:
+            limiter.acquire()
+        self.assertEqual(cm.exception.retry_after, 3)
+        limiter.release()
+        limiter.acquire()
+        self.assertEqual(limiter.metrics(), {'limit': 1, 'active': 1, 'peak': 1, 'rejected': 1})
+
+
+class ConditionalGetTest(EmployeeApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.employee = Employee.objects.create(first_name='a', last_name='b', department=self.department)
+
+    def get(self, url, **extra):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, **extra)
+        employee_queries = [query for query in queries if 'ninjademo_employee' in query['sql']]
+        return response, employee_queries
+
+    def test_not_modified(self):
+        url = f'/api/employee/{self.employee.id}'
+        response, queries = self.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(queries), 1)
+        etag = response['ETag']
+        self.assertTrue(etag.startswith('W/"'))
+        self.assertEqual(response['Cache-Control'], 'no-cache, private')
+        self.assertIn('Accept', response['Vary'])
+
+        response, queries = self.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((response.status_code, response.content, queries), (304, b'', []))
+        self.assertEqual(response['ETag'], etag)
+        # 弱比较，多个 ETag 中有一个相同即可
+        self.assertEqual(self.get(url, HTTP_IF_NONE_MATCH=f'"other", {etag[2:]}')[0].status_code, 304)
+        self.assertEqual(self.get(url, HTTP_IF_NONE_MATCH='*')[0].status_code, 304)
+        # 其它表示（Accept）、其它资源的 ETag 不同
+        self.assertEqual(self.get(url, HTTP_IF_NONE_MATCH=etag, HTTP_ACCEPT='application/xml')[0].status_code, 200)
+        self.assertEqual(self.get('/api/employees', HTTP_IF_NONE_MATCH=etag)[0].status_code, 200)
+
+    def test_writes_change_etag(self):
+        url = '/api/employees'
+        etag = self.client.get(url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True), mock.patch('builtins.print'):
+            response = self.client.put(f'/api/employeeupdate/{self.employee.id}', {
+                'first_name': 'c', 'last_name': 'd', 'department_id': self.department.id,
+            }, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]['first_name'], 'c')
+        self.assertNotEqual(response['ETag'], etag)
+
+        # bulk_create 不发送信号，接口中手动加一
+        etag = response['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/employees/bulk', [
+                {'first_name': 'e', 'last_name': 'f', 'department_id': self.department.id},
+            ], content_type='application/json')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        # 事务没有提交时版本号不变
+        etag = self.client.get(url)['ETag']
+        Employee.objects.filter(pk=self.employee.pk).delete()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_if_modified_since(self):
+        url = '/api/employees/page'
+        response = self.client.get(url)
+        # 刚修改过（包括刚初始化）时不返回 Last-Modified
+        self.assertFalse(response.has_header('Last-Modified'))
+        generations, modified = conditional.get_versions(Employee)
+        with mock.patch('time.time', return_value=modified + 10):
+            response = self.client.get(url)
+            last_modified = response['Last-Modified']
+            self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+            # If-None-Match 优先
+            self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified,
+                                             HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+            with self.captureOnCommitCallbacks(execute=True):
+                conditional.bump_version(Employee)
+        with mock.patch('time.time', return_value=modified + 20):
+            self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 200)
+
+    def test_recent_write_reads_primary(self):
+        url = f'/api/employee/{self.employee.id}'
+        with mock.patch('mysite.conditional.pin_primary') as pin_primary:
+            self.client.get(url)
+            pin_primary.assert_called_once()
+            generations, modified = conditional.get_versions(Employee)
+            with mock.patch('time.time', return_value=modified + settings.DATABASE_REPLICA_STICKY_SECONDS):
+                self.client.get(url)
+            pin_primary.assert_called_once()
+
+    def test_checks_run_first(self):
+        url = f'/api/employee/{self.employee.id}'
+        etag = self.client.get(url)['ETag']
+        self.client.logout()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 401)
+
+    def test_post_is_unconditional(self):
+        url = f'/api/employee/{self.employee.id}'
+        etag = self.client.get(url)['ETag']
+        response = self.client.post(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('ETag'))
+
+    def test_static_version(self):
+        response = self.client.get('/apis/blogs/blogs/1')
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        self.assertEqual(self.client.get('/apis/blogs/blogs/1', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertEqual(self.client.get('/apis/blogs/blogs/2', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+
+class CompressionTest(EmployeeApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        compression.stats.clear()
+
+    def test_select_encoding(self):
+        best = 'br' if compression.brotli is not None else 'gzip'
+        self.assertEqual(compression.select_encoding('gzip, deflate, br'), best)
+        self.assertEqual(compression.select_encoding('*'), best)
+        self.assertEqual(compression.select_encoding('br;q=0.5, gzip'), 'gzip')
+        self.assertEqual(compression.select_encoding('gzip;q=0, deflate'), None)
+        self.assertEqual(compression.select_encoding('identity'), None)
+        self.assertEqual(compression.select_encoding(None), None)
+
+    def test_compress_json(self):
+        self.create_employees(100)
+        plain = self.client.get('/api/employees')
+        self.assertFalse(plain.has_header('Content-Encoding'))
+        self.assertIn('Accept-Encoding', plain['Vary'])
+        response = self.client.get('/api/employees', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+        self.assertEqual(int(response['Content-Length']), len(response.content))
+        self.assertLess(len(response.content), len(plain.content) / 4)
+        # 条件请求的 ETag 本来就是弱 ETag，压缩后不变
+        self.assertEqual(response['ETag'], plain['ETag'])
+        [row] = compression.stats.metrics()
+        self.assertEqual((row['encoding'], row['responses'], row['bytes_in']), ('gzip', 1, len(plain.content)))
+
+    def test_small_and_not_modified_responses_are_not_compressed(self):
+        response = self.client.get('/api/hello', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.create_employees(100)
+        etag = self.client.get('/api/employees')['ETag']
+        response = self.client.get('/api/employees', HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_compress_stream(self):
+        self.create_employees(300)
+        url = '/api/employees/stream?chunk_size=100'
+        plain = b''.join(self.client.get(url).streaming_content)
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        chunks = list(response.streaming_content)
+        # 每块单独 flush：只取前面几块也能解压出完整的行
+        partial = zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(b''.join(chunks[:2]))
+        self.assertTrue(partial.endswith(b'\n'))
+        self.assertEqual(gzip.decompress(b''.join(chunks)), plain)
+        self.assertEqual(compression.stats.metrics()[0]['bytes_in'], len(plain))
+
+
+class StaticFilesTest(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        settings_override = self.settings(STATIC_ROOT=directory)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.directory = directory
+
+    def test_without_collectstatic_uses_original_names(self):
+        from django.contrib.staticfiles.storage import staticfiles_storage
+        self.assertEqual(staticfiles_storage.url('polls/style.css'), '/static/polls/style.css')
+
+    def test_collectstatic_writes_compressed_variants(self):
+        from django.contrib.staticfiles.storage import staticfiles_storage
+        call_command('collectstatic', interactive=False, verbosity=0, ignore_patterns=['admin'])
+        hashed = staticfiles_storage.stored_name('polls/style.css')
+        self.assertRegex(hashed, r'^polls/style\.[0-9a-f]{12}\.css$')
+        self.assertEqual(staticfiles_storage.url('polls/style.css'), f'/static/{hashed}')
+        with open(os.path.join(self.directory, hashed), 'rb') as f:
+            content = f.read()
+        with open(os.path.join(self.directory, hashed + '.gz'), 'rb') as f:
+            self.assertEqual(gzip.decompress(f.read()), content)
+        # 图片不压缩
+        self.assertFalse([name for name in os.listdir(os.path.join(self.directory, 'polls', 'images'))
+                          if name.endswith(('.gz', '.br'))])
+
+        response = self.client.get(f'/static/{hashed}', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Type'], 'text/css')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), content)
+        self.assertEqual(response['Cache-Control'], f'public, max-age={settings.STATIC_MAX_AGE}, immutable')
+
+        # 不带哈希的原文件（css 中的 url 没有替换）
+        response = self.client.get('/static/polls/style.css')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        with open(os.path.join(self.directory, 'polls', 'style.css'), 'rb') as f:
+            self.assertEqual(b''.join(response.streaming_content), f.read())
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertEqual(self.client.get('/static/polls/missing.css').status_code, 404)
@@ -1,13 +1,20 @@
 from ninja import Router
 
+from mysite.conditional import conditional
+
 router = Router()
 
+# 数据写在代码里：@conditional 按 VERSION 生成 ETag，修改数据时把 VERSION 加一
+VERSION = 1
+
 
 @router.get('/news')
+@conditional(version=VERSION)
 def list_news(request):
     return {"new_id": 1, "new_title": "title1"}
 
 
 @router.get('/news/{new_id}')
+@conditional(version=VERSION)
 def new(request, new_id):
     return {"new_id": new_id, "new_title": "title1"}
\ No newline at end of file
@@ -1,7 +1,9 @@
 # Register your models here.
 
-from django.contrib import admin
+from django.conf import settings
+from django.contrib import admin, messages
 from .models import Question, Choice
+from .search import question_search
 
 
 # 通过 admin.ModelAdmin 在后台新增功能以及展示内容，通过 register 到 amdin 后台
@@ -25,6 +27,18 @@ class QuestionAdmin(admin.ModelAdmin):
     ]
     inlines = [ChoiceInline]
 
+    # 搜索框使用 question_search 的索引，不再 question_text__icontains 全表扫描；
+    # fts5 通过子查询过滤，结果完整；memory 只取相关度最高的 POLLS_SEARCH_ADMIN_LIMIT 条（避免 IN 的参数过多），并提示结果不完整
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip():
+            return queryset, False
+        limit = settings.POLLS_SEARCH_ADMIN_LIMIT
+        queryset, truncated = question_search.filter(queryset, search_term, limit=limit)
+        if truncated:
+            self.message_user(request, f'More than {limit} questions match, only the {limit} most relevant are shown.',
+                              messages.WARNING)
+        return queryset, False
+
 
 # Choice 展示页面，新增展示的字段 list_display
 class ChoiceAdmin(admin.ModelAdmin):
@@ -0,0 +1,94 @@
+"""
+投票接口，挂在 mysite/apis.py 的 /apis/polls/ 下
+表单投票（views.vote）一次只能投一个 choice，之后还要跳转到结果页再请求一次；
+离线排队投票的终端（自助机、手机）同步时用 POST /apis/polls/votes 一次提交多个 question 的票：
+1. 所有 choice 用一条查询校验：choice 存在、属于请求中的 question、question 已经发布
+2. 同一个 choice 的票先合并，再用 record_votes 在一个事务内每个 choice 执行一条 UPDATE（开启 POLLS_VOTE_BUFFERING 时先记在内存里）
+3. 某一票有问题时不影响其它票，在 errors 中返回出错票的下标 index 和原因
+4. 响应中直接带上涉及的 question 最新的票数（包括缓冲区中还没写入数据库的票），不用再请求结果页
+"""
+
+from collections import Counter
+from typing import List
+
+from django.conf import settings
+from django.utils import timezone
+from ninja import Body, Router, Schema
+
+from mysite.db.routers import use_primary
+
+from .counters import record_votes, vote_buffer
+from .models import Choice
+
+router = Router()
+
+
+class VoteIn(Schema):
+    question_id: int
+    choice_id: int
+
+
+class VoteError(Schema):
+    index: int
+    error: str
+
+
+class ChoiceTally(Schema):
+    id: int
+    votes: int
+
+
+class QuestionTally(Schema):
+    id: int
+    total_votes: int
+    choices: List[ChoiceTally]
+
+
+class VoteResult(Schema):
+    accepted: int
+    errors: List[VoteError] = []
+    questions: List[QuestionTally] = []
+
+
+def tallies(question_ids):
+    """
+    question 下所有 choice 的票数，一条查询
+    """
+    questions = {}
+    choices = Choice.objects.filter(question_id__in=question_ids).order_by('question_id', 'id')
+    for choice_id, question_id, votes in choices.values_list('id', 'question_id', 'votes'):
+        if settings.POLLS_VOTE_BUFFERING:
+            votes += vote_buffer.pending(choice_id)
+        question = questions.setdefault(question_id, {"id": question_id, "total_votes": 0, "choices": []})
+        question["total_votes"] += votes
+        question["choices"].append({"id": choice_id, "votes": votes})
+    return list(questions.values())
+
+
+@router.post('/votes', response=VoteResult)
+def vote(request, votes: List[VoteIn] = Body(..., max_items=settings.POLLS_VOTE_BATCH_SIZE)):
+    # 刚创建的 choice 从库可能还没有复制到，校验和返回的票数都读主库
+    with use_primary():
+        choices = dict(
+            Choice.objects.filter(
+                pk__in={item.choice_id for item in votes}, question__pub_date__lte=timezone.now()
+            ).values_list('id', 'question_id')
+        )
+        counts, errors = Counter(), []
+        for index, item in enumerate(votes):
+            if choices.get(item.choice_id) != item.question_id:
+                error = f'Choice {item.choice_id} of question {item.question_id} does not exist'
+                errors.append({"index": index, "error": error})
+            else:
+                counts[item.choice_id] += 1
+        question_ids = {choices[choice_id] for choice_id in counts}
+        if settings.POLLS_VOTE_BUFFERING:
+            for choice_id, n in counts.items():
+                vote_buffer.add(choice_id, n)
+        elif counts:
+            record_votes(counts, question_ids)
+        return {
+            "accepted": sum(counts.values()),
+            "errors": errors,
+            "questions": tallies(question_ids) if question_ids else [],
+        }
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class PollsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'polls'
+
+    def ready(self):
+        # 注册 question/choice 的信号，修改后让页面缓存失效
+        from . import signals
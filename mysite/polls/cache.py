@@ -0,0 +1,61 @@
+"""
+投票页面缓存
+1. 每个 question 有一个版本号（generation），缓存的 key 中带上版本号，投票、修改 question/choice 时版本号加一，旧缓存自然失效
+2. 首页使用单独的版本号 INDEX，question 新增、修改、删除时加一
+3. 版本号保存在 django cache 中，locmem 用于开发和测试，生产环境使用 redis/memcached 等共享缓存即可在多进程间生效
+4. 缓存 key 不存在时用当前纳秒时间初始化版本号，缓存被淘汰后也不会复用旧的版本号
+"""
+
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+INDEX = 'index'
+
+
+def get_cache():
+    return caches[settings.POLLS_CACHE_ALIAS]
+
+
+def _generation_key(scope):
+    return f'polls:gen:{scope}'
+
+
+def get_generation(scope):
+    cache = get_cache()
+    key = _generation_key(scope)
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, time.time_ns(), timeout=None)
+        generation = cache.get(key)
+    return generation
+
+
+def bump_generation(*scopes):
+    cache = get_cache()
+    for scope in scopes:
+        key = _generation_key(scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # key 不存在，初始化即相当于换了新版本
+            cache.add(key, time.time_ns(), timeout=None)
+
+
+def next_generation(scope):
+    """
+    版本号加一并返回新的版本号，多个进程同时调用时各自拿到不同的值
+    """
+    cache = get_cache()
+    key = _generation_key(scope)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.add(key, time.time_ns(), timeout=None)
+        return get_generation(scope)
+
+
+def page_key(name, scope):
+    return f'polls:page:{name}:{scope}:{get_generation(scope)}'
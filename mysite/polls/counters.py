@@ -0,0 +1,144 @@
+"""
+投票计数
+1. record_vote/record_votes：在数据库中原子自增 votes = votes + n，不再读-改-写，并发时不会丢票，也只更新 votes 这一列
+2. VoteBuffer：热点投票先在内存里分片计数，达到阈值或时间间隔后批量刷新到数据库，每个 Choice 只执行一条 UPDATE
+   分片按线程划分（线程第一次投票时轮流分配一个分片），同一个 Choice 的计数分散在多个分片里，写入时各线程只争用自己分片的锁
+3. 票数写入数据库后让对应 question 的页面缓存失效（UPDATE 不会触发 post_save 信号）
+"""
+
+import atexit
+import itertools
+import logging
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from .cache import bump_generation
+from .models import Choice
+
+
+logger = logging.getLogger(__name__)
+
+
+def record_vote(question_id, choice_id):
+    """
+    给 question 下的 choice 加一票，choice 不属于该 question 时返回 False
+    """
+    updated = Choice.objects.filter(pk=choice_id, question_id=question_id).update(votes=F('votes') + 1)
+    if updated:
+        bump_generation(question_id)
+    return updated == 1
+
+
+def record_votes(counts, question_ids=None):
+    """
+    批量加票，counts 为 {choice_id: 票数}，在一个事务内每个 choice 执行一条 UPDATE
+    按 choice_id 排序后更新，多个事务并发时加锁顺序一致，避免死锁
+    question_ids 为 choice 所属的 question，调用方已经查过时传入，不再查询
+    """
+    updated = 0
+    with transaction.atomic():
+        for choice_id, n in sorted(counts.items()):
+            if n:
+                updated += Choice.objects.filter(pk=choice_id).update(votes=F('votes') + n)
+    if question_ids is None:
+        question_ids = Choice.objects.filter(pk__in=counts).values_list('question_id', flat=True).distinct()
+    bump_generation(*question_ids)
+    return updated
+
+
+class VoteBuffer:
+    """
+    内存分片计数器
+    shards：分片个数，flush_threshold：累计多少票后刷新，flush_interval：最早一票未写入超过多少秒后刷新
+    （从缓冲区空了之后的第一票开始计时，空闲很久后的第一票不会马上单独写入）
+    刷新失败时计数会放回缓冲区，下次刷新再写入，不会丢票
+    """
+
+    def __init__(self, shards=16, flush_threshold=1000, flush_interval=1.0):
+        self.shards = [(threading.Lock(), Counter()) for _ in range(shards)]
+        self.flush_threshold = flush_threshold
+        self.flush_interval = flush_interval
+        self._flush_lock = threading.Lock()
+        # 缓冲区中最早一票的时间，没有未写入的票时为 None；并发设置时只会相差几微秒，不用加锁
+        self._oldest = None
+        # threading.get_ident() 是对齐的地址，取模总是落在同一个分片，改为轮流分配
+        self._next_shard = itertools.count()
+        self._local = threading.local()
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = self.shards[next(self._next_shard) % len(self.shards)]
+        return shard
+
+    def add(self, choice_id, n=1):
+        lock, counter = self._shard()
+        with lock:
+            counter[choice_id] += n
+            shard_size = sum(counter.values())
+        now = time.monotonic()
+        if self._oldest is None:
+            self._oldest = now
+        if (shard_size * len(self.shards) >= self.flush_threshold
+                or now - self._oldest >= self.flush_interval):
+            self.flush(blocking=False)
+
+    def pending(self, choice_id=None):
+        # 还未写入数据库的票数
+        total = 0
+        for lock, counter in self.shards:
+            with lock:
+                total += counter[choice_id] if choice_id is not None else sum(counter.values())
+        return total
+
+    def _drain(self):
+        merged = Counter()
+        for lock, counter in self.shards:
+            with lock:
+                merged.update(counter)
+                counter.clear()
+        return merged
+
+    def _restore(self, counts):
+        lock, counter = self._shard()
+        with lock:
+            counter.update(counts)
+
+    def flush(self, blocking=True):
+        """
+        把缓冲区的票写入数据库，返回写入的票数
+        blocking=False 时如果其它线程正在刷新则直接返回 0
+        """
+        if not self._flush_lock.acquire(blocking=blocking):
+            return 0
+        try:
+            self._oldest = None
+            counts = self._drain()
+            if not counts:
+                return 0
+            try:
+                record_votes(counts)
+            except Exception:
+                logger.exception("Flush %s buffered votes failed, will retry", sum(counts.values()))
+                self._restore(counts)
+                # 过一个 flush_interval 再重试
+                self._oldest = time.monotonic()
+                return 0
+            return sum(counts.values())
+        finally:
+            self._flush_lock.release()
+
+
+vote_buffer = VoteBuffer(
+    shards=settings.POLLS_VOTE_SHARDS,
+    flush_threshold=settings.POLLS_VOTE_FLUSH_THRESHOLD,
+    flush_interval=settings.POLLS_VOTE_FLUSH_INTERVAL,
+)
+
+# 进程退出前把剩余的票写入数据库
+atexit.register(vote_buffer.flush)
@@ -0,0 +1,172 @@
+"""
+首页"最新发布的问题"
+在进程内维护按 pub_date 排好序的已发布问题，首页直接取前 N 条，不用每次在数据库中排序
+1. 只保留最新的 size + slack 条，删除或修改几条后不用马上回源数据库
+2. 未来发布的问题只加载最早的 capacity 条，放在按 pub_date 排序的堆中，到时间后移入已发布列表；
+   堆用完而数据库中还有更晚的未来问题时重新加载
+3. question 保存/删除的事务提交后通过信号增量更新（见 signals.py），回滚的修改不会出现在首页
+4. 修改 question 时增加页面缓存中首页的版本号，其它进程发现版本号和自己记录的不一致时从数据库重新加载
+5. 每隔 refresh_interval 秒也会重新加载一次，修正事务回滚等造成的偏差
+6. 从主库加载：版本号变化后从还没复制到的从库加载，会把旧列表当作新版本保存下来
+"""
+
+import bisect
+import copy
+import heapq
+import threading
+import time
+
+from django.conf import settings
+from django.utils import timezone
+
+from mysite.db.routers import use_primary
+
+from .cache import INDEX, get_generation, next_generation
+from .models import Question
+
+
+class LatestQuestionsFeed:
+
+    def __init__(self, size=5, slack=20, refresh_interval=60):
+        self.size = size
+        self.capacity = size + slack
+        self.refresh_interval = refresh_interval
+        self._lock = threading.RLock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._published = []  # 升序的 (pub_date, pk)
+            self._scheduled = []  # 未来发布的 (pub_date, pk) 小顶堆，过期条目在出堆时丢弃
+            self._questions = {}  # pk -> Question
+            self._truncated = False  # 数据库中是否还有更早的已发布问题没有加载
+            self._horizon = None  # 数据库中还有更晚的未来问题没有加载时，为已加载的最晚一条 (pub_date, pk)
+            self._generation = None
+            self._loaded_at = None
+
+    def _load(self, now):
+        with use_primary():
+            published = list(Question.objects.filter(pub_date__lte=now).order_by('-pub_date', '-pk')[:self.capacity])
+            scheduled = list(Question.objects.filter(pub_date__gt=now).order_by('pub_date', 'pk')[:self.capacity])
+        self._published = sorted((q.pub_date, q.pk) for q in published)
+        # 已经按 pub_date 升序，本身就是小顶堆
+        self._scheduled = [(q.pub_date, q.pk) for q in scheduled]
+        self._questions = {q.pk: q for q in published + scheduled}
+        self._truncated = len(published) >= self.capacity
+        self._horizon = self._scheduled[-1] if len(scheduled) >= self.capacity else None
+        self._loaded_at = time.monotonic()
+
+    def _ensure_loaded(self, now):
+        generation = get_generation(INDEX)
+        if (self._loaded_at is None or generation != self._generation
+                or time.monotonic() - self._loaded_at >= self.refresh_interval):
+            self._load(now)
+            self._generation = generation
+
+    def _insert(self, key):
+        i = bisect.bisect_left(self._published, key)
+        if i < len(self._published) and self._published[i] == key:
+            return
+        if self._truncated and self._published and key < self._published[0]:
+            # 比已加载的最早一条还早，不在维护范围内
+            self._questions.pop(key[1], None)
+            return
+        bisect.insort(self._published, key)
+        if len(self._published) > self.capacity:
+            _, pk = self._published.pop(0)
+            self._questions.pop(pk, None)
+            self._truncated = True
+
+    def _remove(self, pk):
+        question = self._questions.pop(pk, None)
+        if question is None:
+            return
+        key = (question.pub_date, pk)
+        i = bisect.bisect_left(self._published, key)
+        if i < len(self._published) and self._published[i] == key:
+            del self._published[i]
+
+    def _promote(self, now):
+        while self._scheduled and self._scheduled[0][0] <= now:
+            pub_date, pk = heapq.heappop(self._scheduled)
+            question = self._questions.get(pk)
+            if question is not None and question.pub_date == pub_date:
+                self._insert((pub_date, pk))
+        if not self._scheduled and self._horizon is not None:
+            # 加载的未来问题都已经发布，数据库中还有更晚的
+            self._load(now)
+            self._promote(now)
+
+    def latest(self):
+        """
+        返回最新发布的 size 条问题，按 pub_date 倒序
+        """
+        now = timezone.now()
+        with self._lock:
+            self._ensure_loaded(now)
+            self._promote(now)
+            if len(self._published) < self.size and self._truncated:
+                self._load(now)
+            return [self._questions[pk] for _, pk in reversed(self._published[-self.size:])]
+
+    def next_pub_date(self):
+        """
+        下一个未来发布的问题的发布时间，没有时返回 None
+        """
+        now = timezone.now()
+        with self._lock:
+            self._ensure_loaded(now)
+            self._promote(now)
+            while self._scheduled:
+                pub_date, pk = self._scheduled[0]
+                question = self._questions.get(pk)
+                if question is not None and question.pub_date == pub_date:
+                    return pub_date
+                heapq.heappop(self._scheduled)
+                if not self._scheduled and self._horizon is not None:
+                    self._load(now)
+            return None
+
+    def _bump(self):
+        """
+        首页版本号加一，返回修改前本进程的列表是否是最新的，不是最新的则下次使用时重新加载
+        """
+        # 加一和读取新版本号是一次操作，其它进程同时加一时拿到的不是 self._generation + 1，本进程的列表已经过期
+        generation = next_generation(INDEX)
+        in_sync = self._loaded_at is not None and generation == self._generation + 1
+        if in_sync:
+            self._generation = generation
+        else:
+            self._loaded_at = None
+        return in_sync
+
+    def update(self, question):
+        """
+        question 保存（的事务提交）后调用
+        """
+        with self._lock:
+            if not self._bump():
+                return
+            self._remove(question.pk)
+            question = copy.copy(question)
+            key = (question.pub_date, question.pk)
+            if question.pub_date > timezone.now():
+                if self._horizon is not None and key > self._horizon:
+                    # 比已加载的未来问题都晚，之后重新加载时再取
+                    return
+                self._questions[question.pk] = question
+                heapq.heappush(self._scheduled, key)
+            else:
+                self._questions[question.pk] = question
+                self._insert((question.pub_date, question.pk))
+
+    def delete(self, question):
+        """
+        question 删除（的事务提交）后调用
+        """
+        with self._lock:
+            if self._bump():
+                self._remove(question.pk)
+
+
+latest_questions = LatestQuestionsFeed(refresh_interval=settings.POLLS_FEED_REFRESH_INTERVAL)
@@ -0,0 +1,64 @@
+"""
+首页最新问题的性能对比：python manage.py bench_latest_questions --count 1000000
+1. db (no index)：不使用 pub_date 索引，全表扫描后排序（仅 SQLite 支持 NOT INDEXED）
+2. db (index)：原来的 filter(pub_date__lte=now).order_by('-pub_date')[:5]，使用 pub_date 索引
+3. feed：进程内维护的最新问题列表 LatestQuestionsFeed
+测试数据在事务中创建，结束后回滚，不会留在数据库中
+"""
+
+import datetime
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from polls.feed import LatestQuestionsFeed
+from polls.models import Question
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the latest questions feed against the database query'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=1000000, help='number of questions')
+        parser.add_argument('--repeat', type=int, default=100, help='calls per path')
+        parser.add_argument('--batch-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.seed(options['count'], options['batch_size'])
+            now = timezone.now()
+            paths = [
+                ('db (index)', lambda: list(
+                    Question.objects.filter(pub_date__lte=timezone.now()).order_by('-pub_date')[:5])),
+            ]
+            if connection.vendor == 'sqlite':
+                sql = (f'SELECT * FROM {Question._meta.db_table} NOT INDEXED '
+                       'WHERE pub_date <= %s ORDER BY pub_date DESC LIMIT 5')
+                paths.insert(0, ('db (no index)', lambda: list(Question.objects.raw(sql, [now]))))
+            feed = LatestQuestionsFeed(refresh_interval=float('inf'))
+            paths.append(('feed', feed.latest))
+
+            for name, func in paths:
+                func()  # 预热，feed 在这里从数据库加载
+                start = time.perf_counter()
+                for _ in range(options['repeat']):
+                    func()
+                elapsed = (time.perf_counter() - start) / options['repeat']
+                self.stdout.write(f'{name:<15} {elapsed * 1000:10.3f} ms/request')
+            transaction.set_rollback(True)
+
+    def seed(self, count, batch_size):
+        self.stdout.write(f'Creating {count} questions...')
+        now = timezone.now()
+        start = time.perf_counter()
+        for offset in range(0, count, batch_size):
+            Question.objects.bulk_create([
+                # 约 1% 为未来发布的问题
+                Question(question_text=f'Question {i}',
+                         pub_date=now + datetime.timedelta(minutes=random.randint(-10 ** 6, 10 ** 4)))
+                for i in range(offset, min(offset + batch_size, count))
+            ])
+        self.stdout.write(f'Created in {time.perf_counter() - start:.1f}s')
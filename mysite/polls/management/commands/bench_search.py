@@ -0,0 +1,82 @@
+"""
+question_text 搜索的性能对比：python manage.py bench_search --count 1000000
+1. scan：原来 weapons_search 的做法，在 Python 中逐个 q in text.lower()
+2. icontains：admin search_fields 的做法，question_text__icontains 全表扫描
+3. memory：进程内的倒排索引（polls/search.py）
+4. fts5：SQLite FTS5 trigram 索引（需要迁移 0003 创建了 polls_question_fts）
+测试数据在事务中创建，结束后回滚，不会留在数据库中
+"""
+
+import random
+import string
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from polls.models import Question
+from polls.search import FTS5QuestionSearch, MemoryQuestionSearch, fts5_available
+
+
+class Command(BaseCommand):
+    help = 'Benchmark question search backends against a linear scan'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=1000000, help='number of questions')
+        parser.add_argument('--repeat', type=int, default=5, help='calls per query and path')
+        parser.add_argument('--batch-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        vocabulary = [''.join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 9))) for _ in range(5000)]
+        queries = [
+            vocabulary[0],  # 一个完整的词
+            vocabulary[1][:3],  # 3 个字符的子串
+            vocabulary[2][:2],  # 2 个字符的前缀
+            f'{vocabulary[3]} {vocabulary[4][:4]}',  # 两个词
+            'zzzzzz',  # 没有结果
+        ]
+        with transaction.atomic():
+            self.seed(options['count'], options['batch_size'], vocabulary, rng)
+            rows = [(pk, text) for pk, text in Question.objects.values_list('pk', 'question_text')]
+
+            def scan(q):
+                matches = [pk for pk, text in rows if q in text.lower()]
+                return len(matches), matches[:10]
+
+            def icontains(q):
+                queryset = Question.objects.filter(question_text__icontains=q)
+                return queryset.count(), list(queryset.values_list('pk', flat=True)[:10])
+
+            # 数据在这个事务中，后台线程看不到，在当前线程加载
+            memory = MemoryQuestionSearch(background=False)
+            start = time.perf_counter()
+            memory.load()
+            self.stdout.write(f'memory index built in {time.perf_counter() - start:.1f}s')
+            paths = [('scan', scan), ('icontains', icontains), ('memory', memory.search)]
+            if fts5_available():
+                paths.append(('fts5', FTS5QuestionSearch().search))
+
+            for q in queries:
+                self.stdout.write(f'query {q!r}')
+                for name, func in paths:
+                    total, _ = func(q)
+                    start = time.perf_counter()
+                    for _ in range(options['repeat']):
+                        func(q)
+                    elapsed = (time.perf_counter() - start) / options['repeat']
+                    self.stdout.write(f'  {name:<10} {elapsed * 1000:10.3f} ms/query {total:>8} matches')
+            transaction.set_rollback(True)
+
+    def seed(self, count, batch_size, vocabulary, rng):
+        self.stdout.write(f'Creating {count} questions...')
+        now = timezone.now()
+        start = time.perf_counter()
+        for offset in range(0, count, batch_size):
+            Question.objects.bulk_create([
+                Question(question_text=' '.join(rng.choices(vocabulary, k=rng.randint(3, 8))).capitalize() + '?',
+                         pub_date=now)
+                for _ in range(offset, min(offset + batch_size, count))
+            ])
+        self.stdout.write(f'Created in {time.perf_counter() - start:.1f}s')
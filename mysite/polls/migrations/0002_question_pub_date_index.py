@@ -0,0 +1,17 @@
+# Generated by Django 4.0.1 on 2026-10-18 18:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=['-pub_date'], name='polls_question_pub_date_idx'),
+        ),
+    ]
@@ -0,0 +1,63 @@
+"""
+SQLite 的 FTS5 全文索引，见 polls/search.py；其它数据库或 SQLite 不支持 FTS5 trigram 分词时跳过，搜索使用进程内索引
+"""
+
+import logging
+
+from django.db import OperationalError, migrations
+
+logger = logging.getLogger(__name__)
+
+CREATE = [
+    "CREATE VIRTUAL TABLE polls_question_fts USING fts5("
+    "question_text, content='polls_question', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER polls_question_fts_insert AFTER INSERT ON polls_question BEGIN "
+    "INSERT INTO polls_question_fts(rowid, question_text) VALUES (new.id, new.question_text); END",
+    "CREATE TRIGGER polls_question_fts_delete AFTER DELETE ON polls_question BEGIN "
+    "INSERT INTO polls_question_fts(polls_question_fts, rowid, question_text) "
+    "VALUES ('delete', old.id, old.question_text); END",
+    "CREATE TRIGGER polls_question_fts_update AFTER UPDATE OF question_text ON polls_question BEGIN "
+    "INSERT INTO polls_question_fts(polls_question_fts, rowid, question_text) "
+    "VALUES ('delete', old.id, old.question_text); "
+    "INSERT INTO polls_question_fts(rowid, question_text) VALUES (new.id, new.question_text); END",
+    "INSERT INTO polls_question_fts(polls_question_fts) VALUES ('rebuild')",
+]
+
+DROP = [
+    "DROP TRIGGER IF EXISTS polls_question_fts_update",
+    "DROP TRIGGER IF EXISTS polls_question_fts_delete",
+    "DROP TRIGGER IF EXISTS polls_question_fts_insert",
+    "DROP TABLE IF EXISTS polls_question_fts",
+]
+
+
+def create_fts(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        try:
+            cursor.execute(CREATE[0])
+        except OperationalError as e:
+            logger.warning('FTS5 trigram tokenizer is not available, question search uses the in-memory index: %s', e)
+            return
+        for sql in CREATE[1:]:
+            cursor.execute(sql)
+
+
+def drop_fts(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for sql in DROP:
+            cursor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0002_question_pub_date_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts, drop_fts),
+    ]
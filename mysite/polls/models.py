@@ -29,6 +29,12 @@ class Question(models.Model):
     question_text = models.CharField(max_length=200)
     pub_date = models.DateTimeField('date published')
 
+    class Meta:
+        # 首页按 pub_date 倒序取最新的问题，加索引避免全表扫描后再排序
+        indexes = [
+            models.Index(fields=['-pub_date'], name='polls_question_pub_date_idx'),
+        ]
+
     def __str__(self):
         return self.question_text
 
@@ -0,0 +1,270 @@
+"""
+question_text 搜索
+admin 的 search_fields 使用 question_text__icontains，每次搜索都全表扫描
+1. memory：进程内的 SearchIndex（见 mysite/search.py），question 保存/删除时通过信号增量更新（见 signals.py）；
+   每次修改把版本号 SEARCH 加一，并把修改（新增/修改的文本或删除的 id）以新版本号为 key 写入共享缓存中的修改日志，
+   其它进程搜索时按版本号取出自己还没有的修改依次应用，不查询数据库；
+   日志被淘汰（中间缺了一条）或落后超过 POLLS_SEARCH_LOG_MAX 条时在后台线程中从主库重建，重建期间继续使用旧索引；
+   进程第一次搜索时同样在后台加载，加载完成之前用 icontains 查询数据库
+2. fts5：SQLite 的 FTS5 虚拟表 polls_question_fts（trigram 分词，任意 3 个字符以上的子串都能使用索引），
+   由迁移 0003 创建，触发器在 polls_question 增删改时同步，不需要进程间同步；按 bm25 排序，不足 3 个字符的词使用 LIKE
+   注意：迁移中重建 polls_question 表（SQLite 修改字段时）会删除触发器，之后需要重新创建
+3. POLLS_SEARCH_BACKEND 选择后端，fts5 不可用时（不是 SQLite 或没有 FTS5 trigram 分词，需要 SQLite 3.34+）使用 memory
+
+使用：
+    total, ids = question_search.search('what', offset=0, limit=10)
+"""
+
+import logging
+import threading
+from functools import reduce
+from operator import and_
+
+from django.conf import settings
+from django.db import connection, connections
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Length
+
+from mysite.db.routers import use_primary
+from mysite.search import SearchIndex
+
+from .cache import get_cache, get_generation, next_generation
+from .models import Question
+
+logger = logging.getLogger(__name__)
+
+SEARCH = 'search'
+FTS_TABLE = 'polls_question_fts'
+
+
+def _log_key(generation):
+    return f'polls:search:log:{generation}'
+
+
+def database_search(query, offset=0, limit=10):
+    """
+    索引还没有加载时使用：每个词 icontains，按文本长度排序
+    """
+    terms = query.split()
+    if not terms:
+        return 0, []
+    queryset = Question.objects.filter(reduce(and_, (Q(question_text__icontains=term) for term in terms)))
+    ids = queryset.order_by(Length('question_text'), 'pk').values_list('pk', flat=True)
+    return queryset.count(), list(ids[offset:None if limit is None else offset + limit])
+
+
+class MemoryQuestionSearch:
+    """
+    background 为 False 时在调用的线程中重建（测试中使用，后台线程看不到测试事务中的数据）
+    """
+
+    def __init__(self, background=True):
+        self.background = background
+        self.index = SearchIndex()
+        self._lock = threading.RLock()
+        self._generation = None
+        self._loaded = False
+        self._rebuilding = False
+        self._thread = None
+
+    def reset(self):
+        """
+        丢弃索引，下次搜索时重新加载；先等正在进行的后台重建结束，避免它之后又装回旧的索引
+        """
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+        with self._lock:
+            self.index = SearchIndex()
+            self._generation = None
+            self._loaded = False
+
+    def load(self):
+        """
+        从主库加载整个索引；先记下版本号再查询，查询期间的修改之后从日志中再应用一次（新增/修改/删除都可以重复应用）
+        """
+        generation = get_generation(SEARCH)
+        index = SearchIndex()
+        with use_primary():
+            index.add_many(Question.objects.values_list('pk', 'question_text').iterator(chunk_size=10000))
+        with self._lock:
+            self.index = index
+            self._generation = generation
+            self._loaded = True
+            self._catch_up()
+
+    def _rebuild(self):
+        try:
+            self.load()
+        except Exception:
+            logger.exception('Rebuild question search index failed')
+        finally:
+            self._rebuilding = False
+            if self.background:
+                connections.close_all()
+
+    def _start_rebuild(self):
+        if self._rebuilding:
+            return
+        self._rebuilding = True
+        if self.background:
+            self._thread = threading.Thread(target=self._rebuild, name='polls-search-rebuild', daemon=True)
+            self._thread.start()
+        else:
+            self._rebuild()
+
+    def _apply(self, entry):
+        doc_id, text = entry
+        if text is None:
+            self.index.remove(doc_id)
+        else:
+            self.index.add(doc_id, text)
+
+    def _catch_up(self):
+        """
+        应用其它进程（和本进程）写入日志的修改；日志不完整时在后台重建
+        """
+        current = get_generation(SEARCH)
+        if current == self._generation:
+            return
+        if not 0 < current - self._generation <= settings.POLLS_SEARCH_LOG_MAX:
+            # 版本号被淘汰后重新初始化，或者落后太多
+            self._start_rebuild()
+            return
+        generations = range(self._generation + 1, current + 1)
+        entries = get_cache().get_many([_log_key(generation) for generation in generations])
+        for i, generation in enumerate(generations):
+            entry = entries.get(_log_key(generation))
+            if entry is None:
+                if any(_log_key(later) in entries for later in generations[i + 1:]):
+                    # 中间缺了一条：日志被淘汰
+                    self._start_rebuild()
+                # 最后几条可能是其它进程已经加了版本号、还没写入日志，下次搜索时再取
+                return
+            self._apply(entry)
+            self._generation = generation
+
+    def search(self, query, offset=0, limit=10):
+        with self._lock:
+            if self._loaded:
+                self._catch_up()
+                return self.index.search(query, offset, limit)
+            self._start_rebuild()
+        return database_search(query, offset, limit)
+
+    def _log(self, entry):
+        get_cache().set(_log_key(next_generation(SEARCH)), entry, settings.POLLS_SEARCH_LOG_TTL)
+        with self._lock:
+            if self._loaded:
+                self._catch_up()
+
+    def update(self, question):
+        self._log((question.pk, question.question_text))
+
+    def delete(self, question):
+        self._log((question.pk, None))
+
+
+def _match_expression(terms):
+    # 每个词作为一个短语，双引号转义后 AND 连接
+    return ' AND '.join('"{}"'.format(term.replace('"', '""')) for term in terms)
+
+
+def _like_pattern(term):
+    return '%{}%'.format(term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_'))
+
+
+class FTS5QuestionSearch:
+
+    def search(self, query, offset=0, limit=10):
+        terms = query.lower().split()
+        if not terms:
+            return 0, []
+        long_terms = [term for term in terms if len(term) >= 3]
+        conditions, params = [], []
+        if long_terms:
+            conditions.append(f'{FTS_TABLE} MATCH %s')
+            params.append(_match_expression(long_terms))
+        for term in terms:
+            if len(term) < 3:
+                conditions.append("question_text LIKE %s ESCAPE '\\'")
+                params.append(_like_pattern(term))
+        where = ' AND '.join(conditions)
+        if long_terms:
+            table, order = FTS_TABLE, 'rank'
+        else:
+            # 没有可以使用 trigram 索引的词，通过 FTS5 虚拟表 LIKE 比直接扫描原表还慢
+            table, order = Question._meta.db_table, 'length(question_text)'
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT count(*) FROM {table} WHERE {where}', params)
+            total = cursor.fetchone()[0]
+            cursor.execute(f'SELECT rowid FROM {table} WHERE {where} ORDER BY {order}, rowid LIMIT %s OFFSET %s',
+                           params + [-1 if limit is None else limit, offset])
+            return total, [row[0] for row in cursor.fetchall()]
+
+    def filter(self, queryset, query):
+        """
+        只保留匹配 query 的 question：FTS5 表作为子查询，不限制条数
+        """
+        terms = query.lower().split()
+        long_terms = [term for term in terms if len(term) >= 3]
+        if long_terms:
+            queryset = queryset.filter(pk__in=RawSQL(
+                f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [_match_expression(long_terms)]
+            ))
+        for term in terms:
+            if len(term) < 3:
+                queryset = queryset.filter(question_text__icontains=term)
+        return queryset
+
+
+def fts5_available():
+    return connection.vendor == 'sqlite' and FTS_TABLE in connection.introspection.table_names()
+
+
+class QuestionSearch:
+    """
+    按 POLLS_SEARCH_BACKEND 选择后端
+    """
+
+    def __init__(self):
+        self.memory = MemoryQuestionSearch()
+        self.fts5 = FTS5QuestionSearch()
+        self._fts5_available = None
+
+    @property
+    def backend(self):
+        if settings.POLLS_SEARCH_BACKEND == 'fts5':
+            if self._fts5_available is None:
+                self._fts5_available = fts5_available()
+            if self._fts5_available:
+                return self.fts5
+        return self.memory
+
+    def search(self, query, offset=0, limit=10):
+        """
+        返回 (匹配总数, 按相关度排序后 offset 开始的 limit 个 question id)，limit 为 None 时返回全部
+        """
+        return self.backend.search(query, offset, limit)
+
+    def filter(self, queryset, query, limit=None):
+        """
+        按 query 过滤 queryset，返回 (queryset, 匹配总数是否超过了 limit)
+        fts5 使用子查询，不限制条数；memory 只保留相关度最高的 limit 个 id
+        """
+        backend = self.backend
+        if backend is self.fts5:
+            return self.fts5.filter(queryset, query), False
+        total, ids = backend.search(query, limit=limit)
+        return queryset.filter(pk__in=ids), total > len(ids)
+
+    # fts5 由触发器维护；memory 始终写入修改日志，切换后端后也不会使用过期的索引
+    def update(self, question):
+        self.memory.update(question)
+
+    def delete(self, question):
+        self.memory.delete(question)
+
+
+question_search = QuestionSearch()
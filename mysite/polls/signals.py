@@ -0,0 +1,38 @@
+"""
+question/choice 保存或删除（包括后台修改）时让页面缓存失效，并更新首页的最新问题列表和搜索索引
+最新问题列表和搜索索引在事务提交后才更新：事务回滚时首页和搜索结果不会出现没有保存成功的修改
+"""
+
+import copy
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import bump_generation
+from .feed import latest_questions
+from .models import Question, Choice
+from .search import question_search
+
+
+@receiver(post_save, sender=Question)
+def question_saved(sender, instance, **kwargs):
+    # 首页的版本号由 latest_questions 更新
+    bump_generation(instance.pk)
+    # 复制一份：提交前 instance 可能还会被修改
+    question = copy.copy(instance)
+    transaction.on_commit(lambda: latest_questions.update(question), using=kwargs.get('using'))
+    transaction.on_commit(lambda: question_search.update(question), using=kwargs.get('using'))
+
+
+@receiver(post_delete, sender=Question)
+def question_deleted(sender, instance, **kwargs):
+    bump_generation(instance.pk)
+    question = copy.copy(instance)
+    transaction.on_commit(lambda: latest_questions.delete(question), using=kwargs.get('using'))
+    transaction.on_commit(lambda: question_search.delete(question), using=kwargs.get('using'))
+
+
+@receiver([post_save, post_delete], sender=Choice)
+def choice_changed(sender, instance, **kwargs):
+    bump_generation(instance.question_id)
@@ -3,12 +3,25 @@ from django.test import TestCase
 # Create your tests here.
 
 import datetime
+import threading
+from unittest import mock
 
-from django.test import TestCase
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models.signals import post_save
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 from django.urls import reverse
 
 from .models import Question, Choice
+from .cache import bump_generation, get_generation, next_generation
+from .counters import VoteBuffer, record_vote, vote_buffer
+from .feed import LatestQuestionsFeed, latest_questions
+from .search import SEARCH, FTS5QuestionSearch, MemoryQuestionSearch, fts5_available, question_search
+from .views import IndexView
 
 
 class QuestionModelTests(TestCase):
@@ -46,7 +59,22 @@ def create_question(question_text, days):
     return Question.objects.create(question_text=question_text, pub_date=time)
 
 
-class QuestionIndexViewTest(TestCase):
+class PollsViewTestCase(TestCase):
+    """
+    页面缓存保存在 locmem 中，不会随测试数据库回滚，每个测试前先清空
+    搜索索引是进程内的全局对象，每个测试前后丢弃；后台线程看不到测试事务中的数据，在当前线程重建
+    """
+
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch.object(question_search.memory, 'background', False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        question_search.memory.reset()
+        self.addCleanup(question_search.memory.reset)
+
+
+class QuestionIndexViewTest(PollsViewTestCase):
 
     def test_no_question(self):
         """
@@ -93,7 +121,7 @@ class QuestionIndexViewTest(TestCase):
         self.assertQuerysetEqual(response.context['lastest_question_list'], [question2, question1])
 
 
-class QuestionDetailViewTest(TestCase):
+class QuestionDetailViewTest(PollsViewTestCase):
 
     def test_future_question(self):
         """
@@ -131,3 +159,626 @@ class TemplateTest(TestCase):
     def test_indextemplate(self):
         response = self.client.get('/polls/')
         self.assertTemplateUsed(response, 'polls/index.html')
+
+
+class VoteViewTest(PollsViewTestCase):
+
+    def test_vote(self):
+        """
+        投票后票数加一，并跳转到结果页
+        """
+        question = create_question(question_text='Past question', days=-1)
+        choice = question.choice_set.create(choice_text='choice one')
+        response = self.client.post(reverse('polls:vote', args=(question.id,)), {'choice': choice.id})
+        self.assertRedirects(response, reverse('polls:results', args=(question.id,)))
+        choice.refresh_from_db()
+        self.assertEqual(choice.votes, 1)
+
+    def test_vote_other_question_choice(self):
+        """
+        不能给其他 question 的 choice 投票
+        """
+        question = create_question(question_text='Past question', days=-1)
+        other = create_question(question_text='Other question', days=-1)
+        choice = other.choice_set.create(choice_text='choice one')
+        response = self.client.post(reverse('polls:vote', args=(question.id,)), {'choice': choice.id})
+        self.assertContains(response, "You didn&#x27;t select a choice.")
+        choice.refresh_from_db()
+        self.assertEqual(choice.votes, 0)
+
+    def test_vote_without_choice(self):
+        question = create_question(question_text='Past question', days=-1)
+        response = self.client.post(reverse('polls:vote', args=(question.id,)))
+        self.assertContains(response, "You didn&#x27;t select a choice.")
+
+    def test_vote_only_updates_votes_column(self):
+        """
+        投票只更新 votes 一列，不会覆盖同时修改的 choice_text
+        """
+        question = create_question(question_text='Past question', days=-1)
+        choice = question.choice_set.create(choice_text='choice one')
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.post(reverse('polls:vote', args=(question.id,)), {'choice': choice.id})
+        updates = [q['sql'] for q in ctx.captured_queries if q['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        self.assertNotIn('choice_text', updates[0])
+
+    @override_settings(POLLS_VOTE_BUFFERING=True)
+    def test_buffered_vote(self):
+        """
+        开启缓冲后，投票先记在内存里，flush 后写入数据库
+        """
+        question = create_question(question_text='Past question', days=-1)
+        choice = question.choice_set.create(choice_text='choice one')
+        # 最早一票超过 flush_interval 时 add 会立即写入，测试中不按时间刷新
+        with mock.patch.object(vote_buffer, 'flush_interval', 3600):
+            self.client.post(reverse('polls:vote', args=(question.id,)), {'choice': choice.id})
+        self.assertEqual(vote_buffer.pending(choice.id), 1)
+        vote_buffer.flush()
+        choice.refresh_from_db()
+        self.assertEqual(choice.votes, 1)
+        self.assertEqual(vote_buffer.pending(), 0)
+
+    def test_buffer_interval_starts_at_oldest_vote(self):
+        """
+        flush_interval 从缓冲区中最早一票开始计时：空闲很久之后的第一票不会马上写入，超过间隔后的下一票才写入
+        """
+        question = create_question(question_text='Past question', days=-1)
+        choice = question.choice_set.create(choice_text='choice one')
+        buffer = VoteBuffer(shards=2, flush_threshold=1000, flush_interval=60)
+        with mock.patch('polls.counters.time.monotonic', return_value=1000.0):
+            buffer.add(choice.id)
+        self.assertEqual(buffer.pending(), 1)
+        with mock.patch('polls.counters.time.monotonic', return_value=1060.0):
+            buffer.add(choice.id)
+        self.assertEqual(buffer.pending(), 0)
+        choice.refresh_from_db()
+        self.assertEqual(choice.votes, 2)
+        with mock.patch('polls.counters.time.monotonic', return_value=5000.0):
+            buffer.add(choice.id)
+        self.assertEqual(buffer.pending(), 1)
+
+
+@override_settings(RATELIMIT_ENABLED=False)
+class VoteApiTest(PollsViewTestCase):
+    url = '/apis/polls/votes'
+
+    def setUp(self):
+        super().setUp()
+        self.question = create_question(question_text='Past question', days=-1)
+        self.one = self.question.choice_set.create(choice_text='choice one')
+        self.two = self.question.choice_set.create(choice_text='choice two', votes=5)
+        self.other = create_question(question_text='Other question', days=-1)
+        self.three = self.other.choice_set.create(choice_text='choice three')
+
+    def post(self, votes):
+        return self.client.post(self.url, votes, content_type='application/json')
+
+    def test_batch_vote(self):
+        """
+        一次提交多个 question 的票，响应中带上最新的票数
+        """
+        response = self.post([
+            {'question_id': self.question.id, 'choice_id': self.one.id},
+            {'question_id': self.question.id, 'choice_id': self.one.id},
+            {'question_id': self.other.id, 'choice_id': self.three.id},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {
+            'accepted': 3,
+            'errors': [],
+            'questions': [
+                {'id': self.question.id, 'total_votes': 7,
+                 'choices': [{'id': self.one.id, 'votes': 2}, {'id': self.two.id, 'votes': 5}]},
+                {'id': self.other.id, 'total_votes': 1, 'choices': [{'id': self.three.id, 'votes': 1}]},
+            ],
+        })
+        self.one.refresh_from_db()
+        self.assertEqual(self.one.votes, 2)
+
+    def test_invalid_votes_do_not_affect_others(self):
+        future = create_question(question_text='Future question', days=30)
+        future_choice = future.choice_set.create(choice_text='future choice')
+        response = self.post([
+            {'question_id': self.question.id, 'choice_id': self.three.id},
+            {'question_id': self.question.id, 'choice_id': self.one.id},
+            {'question_id': future.id, 'choice_id': future_choice.id},
+            {'question_id': self.question.id, 'choice_id': 0},
+        ])
+        data = response.json()
+        self.assertEqual(data['accepted'], 1)
+        self.assertEqual([error['index'] for error in data['errors']], [0, 2, 3])
+        self.assertEqual([question['id'] for question in data['questions']], [self.question.id])
+        self.three.refresh_from_db()
+        future_choice.refresh_from_db()
+        self.assertEqual((self.three.votes, future_choice.votes), (0, 0))
+
+    def test_queries(self):
+        """
+        校验一条查询，每个 choice 一条 UPDATE，返回票数一条查询
+        """
+        votes = [{'question_id': self.question.id, 'choice_id': self.one.id}] * 10
+        votes += [{'question_id': self.question.id, 'choice_id': self.two.id},
+                  {'question_id': self.other.id, 'choice_id': self.three.id}]
+        with CaptureQueriesContext(connection) as ctx:
+            self.post(votes)
+        sql = [q['sql'] for q in ctx.captured_queries if not q['sql'].startswith(('SAVEPOINT', 'RELEASE'))]
+        self.assertEqual([statement.split()[0] for statement in sql], ['SELECT', 'UPDATE', 'UPDATE', 'UPDATE', 'SELECT'])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.post([]).json(), {'accepted': 0, 'errors': [], 'questions': []})
+
+    def test_invalidates_results_page(self):
+        self.assertContains(self.client.get(reverse('polls:results', args=(self.question.id,))), '共 5 票')
+        self.post([{'question_id': self.question.id, 'choice_id': self.one.id}])
+        self.assertContains(self.client.get(reverse('polls:results', args=(self.question.id,))), '共 6 票')
+
+    def test_batch_size(self):
+        votes = [{'question_id': self.question.id, 'choice_id': self.one.id}] * (settings.POLLS_VOTE_BATCH_SIZE + 1)
+        self.assertEqual(self.post(votes).status_code, 422)
+        self.one.refresh_from_db()
+        self.assertEqual(self.one.votes, 0)
+
+    @override_settings(POLLS_VOTE_BUFFERING=True)
+    def test_buffered_votes(self):
+        """
+        开启缓冲后票先记在内存里，返回的票数包括还没写入数据库的票
+        """
+        with mock.patch.object(vote_buffer, 'flush_interval', 3600):
+            response = self.post([{'question_id': self.question.id, 'choice_id': self.one.id}] * 2)
+        self.assertEqual(response.json()['questions'][0]['choices'][0], {'id': self.one.id, 'votes': 2})
+        self.assertEqual(vote_buffer.pending(self.one.id), 2)
+        vote_buffer.flush()
+        self.one.refresh_from_db()
+        self.assertEqual(self.one.votes, 2)
+
+
+class PageCacheTest(PollsViewTestCase):
+
+    def test_vote_invalidates_results(self):
+        """
+        投票后结果页立即更新，不用等缓存超时
+        """
+        question = create_question(question_text='Past question', days=-1)
+        choice = question.choice_set.create(choice_text='choice one')
+        url = reverse('polls:results', args=(question.id,))
+        self.assertContains(self.client.get(url), '0 votes')
+        self.client.post(reverse('polls:vote', args=(question.id,)), {'choice': choice.id})
+        self.assertContains(self.client.get(url), '1 vote')
+
+    def test_buffered_flush_invalidates_results(self):
+        question = create_question(question_text='Past question', days=-1)
+        choice = question.choice_set.create(choice_text='choice one')
+        url = reverse('polls:results', args=(question.id,))
+        self.assertContains(self.client.get(url), '0 votes')
+        buffer = VoteBuffer(flush_threshold=10 ** 6, flush_interval=10 ** 6)
+        buffer.add(choice.id, 3)
+        self.assertContains(self.client.get(url), '0 votes')
+        buffer.flush()
+        self.assertContains(self.client.get(url), '3 votes')
+
+    def test_edit_invalidates_pages(self):
+        """
+        后台修改 question/choice 后，首页、详情页、结果页都会更新
+        """
+        question = create_question(question_text='Past question', days=-1)
+        choice = question.choice_set.create(choice_text='choice one')
+        self.client.get(reverse('polls:index'))
+        self.client.get(reverse('polls:detail', args=(question.id,)))
+        question.question_text = 'Edited question'
+        # 首页的最新问题列表在事务提交后更新
+        with self.captureOnCommitCallbacks(execute=True):
+            question.save()
+        choice.choice_text = 'edited choice'
+        choice.save()
+        self.assertContains(self.client.get(reverse('polls:index')), 'Edited question')
+        self.assertContains(self.client.get(reverse('polls:detail', args=(question.id,))), 'edited choice')
+        choice.delete()
+        self.assertNotContains(self.client.get(reverse('polls:detail', args=(question.id,))), 'edited choice')
+
+    def test_csrf_token_not_cached(self):
+        """
+        缓存的详情页中 csrf_token 每个请求都重新生成
+        """
+        question = create_question(question_text='Past question', days=-1)
+        url = reverse('polls:detail', args=(question.id,))
+        first = self.client.get(url).content.decode()
+        second = self.client.get(url).content.decode()
+        self.assertNotIn('polls-csrf-token-placeholder', second)
+        self.assertIn('name="csrfmiddlewaretoken"', second)
+        self.assertNotEqual(first, second)
+
+    def test_index_timeout_until_next_pub_date(self):
+        """
+        首页缓存时间不超过下一个未来 question 的发布时间
+        """
+        create_question(question_text='Future question', days=1)
+        future = Question.objects.create(question_text='Soon question',
+                                         pub_date=timezone.now() + datetime.timedelta(seconds=30))
+        self.assertNotContains(self.client.get(reverse('polls:index')), future.question_text)
+        self.assertLessEqual(IndexView().get_cache_timeout(), 30)
+
+
+class LatestQuestionsFeedTest(PollsViewTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.feed = LatestQuestionsFeed(size=2, slack=1)
+        latest_questions.reset()
+
+    def test_latest(self):
+        q1 = create_question(question_text='q1', days=-3)
+        q2 = create_question(question_text='q2', days=-2)
+        q3 = create_question(question_text='q3', days=-1)
+        self.assertEqual(self.feed.latest(), [q3, q2])
+        self.assertEqual(self.feed.latest(), [q3, q2])
+        with self.captureOnCommitCallbacks(execute=True):
+            q3.delete()
+        self.assertEqual(self.feed.latest(), [q2, q1])
+
+    def test_incremental_update(self):
+        """
+        列表加载后，新增、修改、删除 question 都不需要重新查询
+        """
+        self.feed = latest_questions
+        q1 = create_question(question_text='q1', days=-3)
+        self.assertEqual(self.feed.latest(), [q1])
+        with self.assertNumQueries(0):
+            q2 = Question(pk=100, question_text='q2', pub_date=timezone.now() - datetime.timedelta(days=1))
+            with self.captureOnCommitCallbacks(execute=True):
+                post_save.send(Question, instance=q2, created=True)
+            self.assertEqual([q.pk for q in self.feed.latest()], [100, q1.pk])
+            q1.pub_date = timezone.now()
+            with self.captureOnCommitCallbacks(execute=True):
+                post_save.send(Question, instance=q1, created=False)
+            self.assertEqual([q.pk for q in self.feed.latest()], [q1.pk, 100])
+
+    def test_truncated_reload(self):
+        """
+        只保留 size + slack 条，删除后不足 size 条时从数据库重新加载
+        """
+        questions = [create_question(question_text=f'q{i}', days=-10 + i) for i in range(5)]
+        self.assertEqual(self.feed.latest(), [questions[4], questions[3]])
+        with self.captureOnCommitCallbacks(execute=True):
+            questions[4].delete()
+            questions[3].delete()
+        self.assertEqual(self.feed.latest(), [questions[2], questions[1]])
+        with self.captureOnCommitCallbacks(execute=True):
+            questions[2].delete()
+        self.assertEqual(self.feed.latest(), [questions[1], questions[0]])
+
+    def test_promote_future_question(self):
+        """
+        未来发布的 question 到时间后出现在列表中
+        """
+        past = create_question(question_text='past', days=-1)
+        future = create_question(question_text='future', days=1)
+        self.assertEqual(self.feed.latest(), [past])
+        self.assertEqual(self.feed.next_pub_date(), future.pub_date)
+        later = timezone.now() + datetime.timedelta(days=2)
+        with mock.patch('polls.feed.timezone.now', return_value=later):
+            self.assertEqual(self.feed.latest(), [future, past])
+            self.assertIsNone(self.feed.next_pub_date())
+
+    def test_scheduled_questions_are_bounded(self):
+        """
+        未来发布的 question 只加载最早的 size + slack 条，发布完之后再从数据库加载
+        """
+        future = [create_question(question_text=f'future{i}', days=i + 1) for i in range(5)]
+        self.assertEqual(self.feed.latest(), [])
+        self.assertEqual(len(self.feed._scheduled), 3)
+        self.assertEqual(self.feed.next_pub_date(), future[0].pub_date)
+        # 比已加载的都晚的新 question 不放进堆中
+        later = create_question(question_text='later', days=30)
+        self.feed.update(later)
+        self.assertNotIn(later.pk, self.feed._questions)
+        with mock.patch('polls.feed.timezone.now', return_value=timezone.now() + datetime.timedelta(days=3, hours=12)):
+            self.assertEqual(self.feed.latest(), [future[2], future[1]])
+            self.assertEqual(self.feed.next_pub_date(), future[3].pub_date)
+        with mock.patch('polls.feed.timezone.now', return_value=timezone.now() + datetime.timedelta(days=10)):
+            self.assertEqual(self.feed.latest(), [future[4], future[3]])
+            self.assertEqual(self.feed.next_pub_date(), later.pub_date)
+
+    def test_concurrent_bump_reloads(self):
+        """
+        其它进程同时修改了首页版本号时，本进程不应用自己的修改，下次使用时重新加载
+        """
+        past = create_question(question_text='past', days=-1)
+        self.assertEqual(self.feed.latest(), [past])
+        new = create_question(question_text='new', days=-1)
+
+        def other_process_first(scope):
+            bump_generation(scope)
+            return next_generation(scope)
+
+        with mock.patch('polls.feed.next_generation', side_effect=other_process_first):
+            self.feed.update(new)
+        self.assertIsNone(self.feed._loaded_at)
+        self.assertEqual(self.feed.latest(), [new, past])
+
+    def test_rollback_is_not_published(self):
+        """
+        事务回滚的 question 不会出现在首页
+        """
+        self.feed = latest_questions
+        past = create_question(question_text='past', days=-1)
+        self.assertEqual(self.feed.latest(), [past])
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            try:
+                with transaction.atomic():
+                    create_question(question_text='rolled back', days=-1)
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+        self.assertEqual(callbacks, [])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.feed.latest(), [past])
+
+
+class VoteConcurrencyTest(TransactionTestCase):
+    """
+    并发压力测试：多个线程同时给同一个 choice 投票，票数不能丢
+    """
+    threads = 8
+    votes_per_thread = 250
+
+    def setUp(self):
+        question = create_question(question_text='Hot question', days=-1)
+        self.choice = question.choice_set.create(choice_text='hot choice')
+
+    def run_threads(self, target):
+        barrier = threading.Barrier(self.threads)
+
+        def worker():
+            barrier.wait()
+            try:
+                target()
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(self.threads)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    def test_concurrent_atomic_votes(self):
+        def target():
+            for _ in range(self.votes_per_thread):
+                record_vote(self.choice.question_id, self.choice.id)
+
+        self.run_threads(target)
+        self.choice.refresh_from_db()
+        self.assertEqual(self.choice.votes, self.threads * self.votes_per_thread)
+
+    def test_concurrent_buffered_votes(self):
+        buffer = VoteBuffer(flush_threshold=100, flush_interval=0.01)
+
+        def target():
+            for _ in range(self.votes_per_thread):
+                buffer.add(self.choice.id)
+
+        self.run_threads(target)
+        buffer.flush()
+        self.choice.refresh_from_db()
+        self.assertEqual(self.choice.votes, self.threads * self.votes_per_thread)
+
+    def test_threads_use_different_shards(self):
+        buffer = VoteBuffer(flush_threshold=10 ** 9, flush_interval=60)
+
+        def target():
+            for _ in range(self.votes_per_thread):
+                buffer.add(self.choice.id)
+
+        self.run_threads(target)
+        used = [counter[self.choice.id] for _, counter in buffer.shards if counter]
+        self.assertEqual(len(used), min(self.threads, len(buffer.shards)))
+        self.assertEqual(sum(used), self.threads * self.votes_per_thread)
+        self.assertEqual(buffer.flush(), self.threads * self.votes_per_thread)
+
+
+class PollsQueryCountTest(PollsViewTestCase):
+    """
+    每个页面的查询次数固定，不随 choice 个数增加
+    """
+
+    def create_question_with_choices(self, count):
+        question = create_question(question_text=f'Question with {count} choices', days=-1)
+        Choice.objects.bulk_create([
+            Choice(question=question, choice_text=f'choice {i}', votes=i) for i in range(count)
+        ])
+        return question
+
+    def test_index_queries(self):
+        # 首次加载最新问题列表：已发布的 + 未来发布的；之后新增 question 时增量更新，页面未命中缓存也不查询
+        with self.assertNumQueries(2):
+            self.client.get(reverse('polls:index'))
+        for count in (0, 1, 10):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.create_question_with_choices(count)
+            with self.assertNumQueries(0):
+                response = self.client.get(reverse('polls:index'))
+            self.assertContains(response, f'Question with {count} choices')
+            with self.assertNumQueries(0):
+                self.client.get(reverse('polls:index'))
+
+    def test_detail_queries(self):
+        for count in (0, 1, 10, 50):
+            question = self.create_question_with_choices(count)
+            with self.assertNumQueries(2):
+                response = self.client.get(reverse('polls:detail', args=(question.id,)))
+            self.assertEqual(response.content.decode().count('name="choice"'), count)
+            with self.assertNumQueries(0):
+                response = self.client.get(reverse('polls:detail', args=(question.id,)))
+            self.assertEqual(response.content.decode().count('name="choice"'), count)
+
+    def test_results_queries(self):
+        for count in (0, 1, 10, 50):
+            question = self.create_question_with_choices(count)
+            with self.assertNumQueries(2):
+                response = self.client.get(reverse('polls:results', args=(question.id,)))
+            self.assertEqual(response.content.decode().count('class="progress"'), count)
+            with self.assertNumQueries(0):
+                response = self.client.get(reverse('polls:results', args=(question.id,)))
+            self.assertEqual(response.content.decode().count('class="progress"'), count)
+
+    def test_results_percent(self):
+        """
+        总票数和占比在数据库中计算，进度条宽度为占比而不是票数
+        """
+        question = create_question(question_text='Past question', days=-1)
+        question.choice_set.create(choice_text='choice one', votes=1)
+        question.choice_set.create(choice_text='choice two', votes=3)
+        response = self.client.get(reverse('polls:results', args=(question.id,)))
+        self.assertEqual(response.context['question'].total_votes, 4)
+        percents = [choice.percent for choice in response.context['question'].choice_set.all()]
+        self.assertEqual(percents, [25.0, 75.0])
+        self.assertContains(response, 'style="width: 75.00%"')
+
+    def test_results_without_votes(self):
+        question = create_question(question_text='Past question', days=-1)
+        question.choice_set.create(choice_text='choice one')
+        response = self.client.get(reverse('polls:results', args=(question.id,)))
+        self.assertEqual(response.context['question'].total_votes, 0)
+        self.assertContains(response, 'style="width: 0.00%"')
+
+
+class QuestionSearchTest(PollsViewTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.questions = [
+            create_question(question_text=text, days=-1)
+            for text in ["What's up?", 'What is your favourite colour?', 'Whatever happened?', 'Best sushi in town']
+        ]
+        question_search.memory.load()
+
+    def ids(self, questions):
+        return [question.pk for question in questions]
+
+    def test_search_ranking(self):
+        total, ids = question_search.search('what')
+        self.assertEqual(total, 3)
+        # 完整的词排在前缀前面，再按文本长度
+        self.assertEqual(ids, self.ids([self.questions[0], self.questions[1], self.questions[2]]))
+        self.assertEqual(question_search.search('WHAT', offset=2, limit=1), (3, self.ids([self.questions[2]])))
+        self.assertEqual(question_search.search('su'), (1, self.ids([self.questions[3]])))
+        self.assertEqual(question_search.search('what colour'), (1, self.ids([self.questions[1]])))
+
+    def test_incremental_update(self):
+        """
+        索引加载后，新增、修改、删除 question 都不需要重新查询
+        """
+        question_search.search('what')
+        with self.assertNumQueries(0):
+            question = Question(pk=100, question_text='What now?', pub_date=timezone.now())
+            with self.captureOnCommitCallbacks(execute=True):
+                post_save.send(Question, instance=question, created=True)
+            self.assertEqual(question_search.search('now'), (1, [100]))
+            question.question_text = 'Later'
+            with self.captureOnCommitCallbacks(execute=True):
+                post_save.send(Question, instance=question, created=False)
+            self.assertEqual(question_search.search('now'), (0, []))
+            self.assertEqual(question_search.search('later'), (1, [100]))
+
+    def test_rollback_is_not_indexed(self):
+        """
+        事务回滚的保存和删除不写入修改日志，搜索结果不变
+        """
+        question_search.search('what')
+        generation = get_generation(SEARCH)
+        deleted = self.questions[0].pk
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            try:
+                with transaction.atomic():
+                    self.questions[3].question_text = 'What else?'
+                    self.questions[3].save()
+                    self.questions[0].delete()
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+        self.assertEqual(callbacks, [])
+        self.assertEqual(get_generation(SEARCH), generation)
+        self.assertEqual(question_search.search('else'), (0, []))
+        self.assertEqual(question_search.search('up'), (1, [deleted]))
+
+    def test_changed_in_other_process(self):
+        """
+        其它进程的修改从共享缓存中的修改日志应用，不重新加载
+        """
+        question_search.search('what')
+        other = MemoryQuestionSearch(background=False)
+        question = self.questions[3]
+        question.question_text = 'What else?'
+        with self.assertNumQueries(0):
+            other.update(question)
+            other.delete(self.questions[0])
+            self.assertEqual(question_search.search('else'), (1, self.ids([question])))
+            self.assertEqual(question_search.search('up'), (0, []))
+
+    def test_missing_log_entry_rebuilds(self):
+        question_search.search('what')
+        other = MemoryQuestionSearch(background=False)
+        Question.objects.filter(pk=self.questions[3].pk).update(question_text='What else?')
+        other.update(Question(pk=self.questions[3].pk, question_text='What else?'))
+        other.update(Question(pk=self.questions[2].pk, question_text='Whatever happened?'))
+        # 日志被淘汰：中间缺了一条
+        cache.delete(f'polls:search:log:{get_generation(SEARCH) - 1}')
+        with self.assertNumQueries(1):
+            self.assertEqual(question_search.search('else'), (1, self.ids([self.questions[3]])))
+
+    def test_first_search_does_not_block_on_load(self):
+        """
+        索引没有加载时在后台加载，这次搜索直接查询数据库
+        """
+        question_search.memory.reset()
+        self.addCleanup(setattr, question_search.memory, '_rebuilding', False)
+        with mock.patch.object(question_search.memory, 'background', True), \
+                mock.patch('polls.search.threading.Thread') as thread:
+            # 按文本长度排序
+            self.assertEqual(question_search.search('what'),
+                             (3, self.ids([self.questions[0], self.questions[2], self.questions[1]])))
+        thread.return_value.start.assert_called_once()
+
+    def test_fts5(self):
+        if not fts5_available():
+            self.skipTest('SQLite FTS5 trigram tokenizer is not available')
+        fts5 = FTS5QuestionSearch()
+        self.assertEqual(fts5.search('what')[0], 3)
+        self.assertEqual(fts5.search('sushi'), (1, self.ids([self.questions[3]])))
+        self.assertEqual(fts5.search('su'), (1, self.ids([self.questions[3]])))
+        self.assertEqual(fts5.search('what colour'), (1, self.ids([self.questions[1]])))
+        self.assertEqual(fts5.search('"; drop'), (0, []))
+        # 触发器同步修改和删除
+        self.questions[3].question_text = 'Best ramen in town'
+        self.questions[3].save()
+        self.assertEqual(fts5.search('sushi'), (0, []))
+        self.assertEqual(fts5.search('ramen'), (1, self.ids([self.questions[3]])))
+        self.questions[3].delete()
+        self.assertEqual(fts5.search('ramen'), (0, []))
+
+    @override_settings(POLLS_SEARCH_BACKEND='fts5')
+    def test_admin_search(self):
+        admin = User.objects.create_superuser(username='admin', password='admin')
+        self.client.force_login(admin)
+        response = self.client.get(reverse('admin:polls_question_changelist'), {'q': 'what'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['cl'].result_count, 3)
+        self.assertNotContains(response, 'Best sushi')
+        self.assertNotContains(response, 'most relevant are shown')
+
+    @override_settings(POLLS_SEARCH_ADMIN_LIMIT=2)
+    def test_admin_search_truncated(self):
+        admin = User.objects.create_superuser(username='admin', password='admin')
+        self.client.force_login(admin)
+        with mock.patch.object(question_search, '_fts5_available', False):
+            response = self.client.get(reverse('admin:polls_question_changelist'), {'q': 'what'})
+        self.assertEqual(response.context['cl'].result_count, 2)
+        self.assertContains(response, 'More than 2 questions match, only the 2 most relevant are shown.')
+
+    def test_fts5_filter_is_not_capped(self):
+        if not fts5_available():
+            self.skipTest('SQLite FTS5 trigram tokenizer is not available')
+        queryset = FTS5QuestionSearch().filter(Question.objects.all(), 'what u')
+        self.assertIn('MATCH', str(queryset.query))
+        self.assertEqual(sorted(queryset.values_list('pk', flat=True)),
+                         self.ids([self.questions[0], self.questions[1]]))
@@ -1,17 +1,68 @@
 # Create your views here.
 
+import math
+
+from django.conf import settings
+from django.db.models import Case, ExpressionWrapper, F, FloatField, Prefetch, Sum, Value, When, Window
+from django.db.models.functions import Coalesce
 from django.http import HttpResponse, Http404, HttpResponseRedirect
+from django.middleware.csrf import get_token
 from django.template import loader
 from django.shortcuts import render, get_object_or_404
 from django.urls import reverse
 from django.views import generic
 from django.utils import timezone
 
+from mysite.db.routers import use_primary
+
 from .models import Question, Choice
+from .counters import record_vote, vote_buffer
+from .cache import INDEX, get_cache, page_key
+from .feed import latest_questions
+
+
+CSRF_PLACEHOLDER = 'polls-csrf-token-placeholder'
+
+
+class CachedPageMixin:
+    """
+    页面缓存：渲染好的页面按（视图，question 版本号）缓存，命中时既不查询数据库也不渲染模版
+    投票或修改 question/choice 后版本号加一，页面不会过期，也不用等缓存超时
+    页面中的 csrf_token 每个请求都不一样，缓存时先用占位符渲染，返回前再替换成当前请求的 token
+    缓存未命中时从主库读取：刚投票后版本号已经变了，从库可能还没复制到，旧页面会被缓存到新版本号下
+    """
+
+    def get_cache_scope(self):
+        return self.kwargs['pk']
+
+    def get_cache_timeout(self):
+        return settings.POLLS_PAGE_CACHE_TIMEOUT
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['csrf_token'] = CSRF_PLACEHOLDER
+        return context
+
+    def get(self, request, *args, **kwargs):
+        cache = get_cache()
+        key = page_key(self.__class__.__name__, self.get_cache_scope())
+        content = cache.get(key)
+        if content is None:
+            with use_primary():
+                response = super().get(request, *args, **kwargs)
+                content = response.render().content
+            cache.set(key, content, self.get_cache_timeout())
+        else:
+            response = HttpResponse(content)
+
+        placeholder = CSRF_PLACEHOLDER.encode()
+        if placeholder in content:
+            response.content = content.replace(placeholder, get_token(request).encode())
+        return response
 
 
 # django 通用视图
-class IndexView(generic.ListView):
+class IndexView(CachedPageMixin, generic.ListView):
     """
     IndexViwe：需要提供一个问题列表，也就是 lastest_question_list
     template_name: 指定 ListView 使用的模版，否则 django 将寻找默认模版 <app name>/<model name>_list.html
@@ -24,10 +75,24 @@ class IndexView(generic.ListView):
         # 返回最新的 5 条问题，通过 django 提供的数据库 API 操作数据
         # return Question.objects.order_by('-pub_date')[:5]
         # 返回最新的 5 条问题，但不包括未来生效的日期
-        return Question.objects.filter(pub_date__lte=timezone.now()).order_by('-pub_date')[:5]
+        # return Question.objects.filter(pub_date__lte=timezone.now()).order_by('-pub_date')[:5]
+        # 从进程内维护好的最新问题列表中获取，不用每次在数据库中排序，见 feed.py
+        return latest_questions.latest()
+
+    def get_cache_scope(self):
+        return INDEX
 
+    def get_cache_timeout(self):
+        # 未来发布的 question 到时间后要出现在首页，缓存时间不超过下一个 question 的发布时间
+        now = timezone.now()
+        timeout = settings.POLLS_PAGE_CACHE_TIMEOUT
+        next_pub_date = latest_questions.next_pub_date()
+        if next_pub_date is not None:
+            timeout = min(timeout, math.ceil((next_pub_date - now).total_seconds()))
+        return timeout
 
-class DetailView(generic.DetailView):
+
+class DetailView(CachedPageMixin, generic.DetailView):
     """
     DetailView：需要提供一个 question 对象以及模版
     model：model 变量可以提供一个模型对象，也就是 question
@@ -36,18 +101,36 @@ class DetailView(generic.DetailView):
     template_name = 'polls/detail.html'
 
     def get_queryset(self):
-        # 只返回当天的 question 详情
-        return Question.objects.filter(pub_date__lte=timezone.now())
+        # 只返回当天的 question 详情，choice 通过 prefetch_related 一次查出，模版中遍历 choice_set 不再逐个查询
+        return Question.objects.filter(pub_date__lte=timezone.now()).prefetch_related(
+            Prefetch('choice_set', queryset=Choice.objects.order_by('id'))
+        )
 
 
-class ResultsView(generic.DetailView):
+class ResultsView(CachedPageMixin, generic.DetailView):
     """
     ResulstView：需要提供一个 question 对象以及模版
     model：model 变量可以提供一个模型对象，也就是 question
+    总票数 total_votes 以及每个 choice 的占比 percent 都在数据库中计算
     """
     model = Question
     template_name = 'polls/results.html'
 
+    def get_queryset(self):
+        # 窗口函数按 question 求和得到总票数，percent 为 0-100 的占比，没有投票时为 0
+        total_votes = Window(Sum('votes'), partition_by=[F('question_id')])
+        choices = Choice.objects.annotate(
+            total_votes=total_votes,
+            percent=Case(
+                When(total_votes=0, then=Value(0.0)),
+                default=ExpressionWrapper(F('votes') * 100.0 / total_votes, output_field=FloatField()),
+                output_field=FloatField(),
+            ),
+        ).order_by('id')
+        return Question.objects.annotate(
+            total_votes=Coalesce(Sum('choice__votes'), 0),
+        ).prefetch_related(Prefetch('choice_set', queryset=choices))
+
 
 # 以下为普通视图
 def index(request):
@@ -94,16 +177,21 @@ def vote(request, question_id):
 
     # return HttpResponse(f"You'er voting on question {queston_id}")
 
+    # select_choice.votes += 1; select_choice.save() 是先读后写，并发投票时会丢票，而且会更新整行
+    # 改为数据库原子自增（或开启 POLLS_VOTE_BUFFERING 后先在内存中计数，再批量写入）
     question = get_object_or_404(Question, pk=question_id)
     try:
-        select_choice = question.choice_set.get(pk=request.POST['choice'])
-    except (KeyError, Choice.DoesNotExist):
+        choice_id = int(request.POST['choice'])
+        if settings.POLLS_VOTE_BUFFERING:
+            if not question.choice_set.filter(pk=choice_id).exists():
+                raise Choice.DoesNotExist
+            vote_buffer.add(choice_id)
+        elif not record_vote(question.id, choice_id):
+            raise Choice.DoesNotExist
+    except (KeyError, ValueError, Choice.DoesNotExist):
         return render(request, 'polls/detail.html', {
             "question": question,
             "error_message": "You didn't select a choice."
         })
     else:
-        select_choice.votes += 1
-        select_choice.save()
-
         return HttpResponseRedirect(reverse('polls:results', args=(question.id,)))